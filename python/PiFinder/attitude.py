@@ -0,0 +1,340 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+This module is the IMU attitude math
+* Converts BNO055 quaternions to rotation matrices
+* Dead reckons pointing from the last camera solve
+  by composing the IMU rotation since that solve
+* AttitudeFilter fuses camera solves with that
+  prediction instead of letting each solve overwrite it
+
+Everything stays a rotation matrix until the final
+RA/Dec/Roll, so there are no euler angle wraps and
+no gimbal lock near the zenith.
+
+"""
+import logging
+import numpy as np
+from scipy.spatial.transform import Rotation
+from typing import Optional
+
+from PiFinder.solver_tracking import (
+    radec_to_vectors,
+    vector_to_radec,
+    rotation_to_radec_roll,
+)
+
+# Rotation of the earth against the stars, degrees per second
+SIDEREAL_RATE = 360.98564736629 / 86400
+
+# IMU body axis along the camera boresight for the "right"
+# screen direction, see imu_boresight
+IMU_BORESIGHT = np.array([1.0, 0.0, 0.0])
+
+
+def imu_boresight(screen_direction: str) -> np.ndarray:
+    """
+    IMU body axis along the camera boresight for a
+    screen direction.  Like the old flip_alt_offset, "left"
+    and "flat" mounts look down -X: "left" shares the
+    imu_pi axis remap of "right" with the unit turned around
+    """
+    if screen_direction in ("left", "flat"):
+        return -IMU_BORESIGHT
+    return IMU_BORESIGHT.copy()
+
+
+def quat_to_matrix(quat) -> Optional[np.ndarray]:
+    """
+    BNO055 quaternion (w, x, y, z) to a body to
+    IMU world rotation matrix, None if there is no reading
+    """
+    if quat is None or not any(quat):
+        return None
+    w, x, y, z = quat
+    return Rotation.from_quat([x, y, z, w]).as_matrix()
+
+
+def quat_angle(quat_a, quat_b) -> float:
+    """
+    Rotation in degrees between two (w, x, y, z) quaternions
+    """
+    dot = abs(float(np.dot(quat_a, quat_b)))
+    dot /= np.linalg.norm(quat_a) * np.linalg.norm(quat_b)
+    return float(np.rad2deg(2 * np.arccos(min(dot, 1.0))))
+
+
+def rotation_z(angle):
+    """
+    Rotation about +z by angle degrees
+    """
+    c, s = np.cos(np.deg2rad(angle)), np.sin(np.deg2rad(angle))
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+
+def horizon_frame(lat, lst):
+    """
+    Columns are east, north and up as equatorial
+    unit vectors for latitude and local sidereal time
+    """
+    lat, lst = np.deg2rad(lat), np.deg2rad(lst)
+    east = [-np.sin(lst), np.cos(lst), 0]
+    north = [-np.sin(lat) * np.cos(lst), -np.sin(lat) * np.sin(lst), np.cos(lat)]
+    up = [np.cos(lat) * np.cos(lst), np.cos(lat) * np.sin(lst), np.sin(lat)]
+    return np.array([east, north, up]).T
+
+
+def radec_roll_to_rotation(ra, dec, roll):
+    """
+    Inverse of solver_tracking.rotation_to_radec_roll
+    """
+    return (
+        Rotation.from_euler("x", -roll, degrees=True)
+        * Rotation.from_euler("y", dec, degrees=True)
+        * Rotation.from_euler("z", -ra, degrees=True)
+    ).as_matrix()
+
+
+def vector_to_altaz(vector):
+    """
+    Alt/Az in degrees of an east, north, up vector
+    """
+    alt = np.rad2deg(np.arcsin(np.clip(vector[2], -1, 1)))
+    az = np.rad2deg(np.arctan2(vector[0], vector[1])) % 360
+    return float(alt), float(az)
+
+
+class DeadReckoning:
+    """
+    Holds the last camera solve as a rotation and moves
+    it by the IMU rotation since then.
+
+    The IMU world frame has up along gravity but an
+    arbitrary heading, which is lined up with the local
+    horizon each camera solve using IMU_BORESIGHT.
+    """
+
+    def __init__(self, boresight=IMU_BORESIGHT):
+        self.boresight = np.asarray(boresight, dtype=np.float64)
+        self.reference = None
+        # IMU heading drift to take out, degrees per second
+        self.heading_rate = 0.0
+
+    def set_reference(self, solution, quat, lat, lst, solve_time):
+        """
+        solution needs RA/Dec (target pixel), Roll, Alt and Az.
+        lst is the local sidereal time at solve_time
+        """
+        imu_rotation = quat_to_matrix(quat)
+        if imu_rotation is None or solution.get("RA") is None:
+            self.reference = None
+            return
+
+        horizon = horizon_frame(lat, lst)
+        target = radec_to_vectors(solution["RA"], solution["Dec"])
+        target_enu = horizon.T @ target
+        _, target_az = vector_to_altaz(target_enu)
+        boresight_world = imu_rotation @ self.boresight
+        _, boresight_az = vector_to_altaz(boresight_world)
+        # world heading to horizon heading, about up
+        world_to_enu = rotation_z(boresight_az - target_az)
+
+        self.reference = {
+            "quat": quat,
+            "imu_rotation": imu_rotation,
+            "horizon": horizon,
+            "world_to_enu": world_to_enu,
+            "target": target,
+            "target_enu": target_enu,
+            "camera": radec_roll_to_rotation(
+                solution["RA"], solution["Dec"], solution.get("Roll") or 0
+            ),
+            "Alt": solution.get("Alt"),
+            "Az": solution.get("Az"),
+            "time": solve_time,
+        }
+
+    def update(self, quat, now) -> Optional[dict]:
+        """
+        Returns RA, Dec, Roll, Alt, Az for the current
+        IMU reading, or None without a reference
+        """
+        imu_rotation = quat_to_matrix(quat)
+        reference = self.reference
+        if reference is None or imu_rotation is None:
+            return None
+
+        delta_world = imu_rotation @ reference["imu_rotation"].T
+        world_to_enu = reference["world_to_enu"]
+        delta_enu = world_to_enu @ delta_world @ world_to_enu.T
+        if self.heading_rate:
+            drift = self.heading_rate * (now - reference["time"])
+            delta_enu = rotation_z(-drift) @ delta_enu
+
+        horizon = reference["horizon"]
+        # the horizon turns with the earth since the solve
+        sky_delta = (
+            rotation_z(SIDEREAL_RATE * (now - reference["time"]))
+            @ horizon
+            @ delta_enu
+            @ horizon.T
+        )
+
+        ra, dec = vector_to_radec(sky_delta @ reference["target"])
+        _, _, roll = rotation_to_radec_roll(reference["camera"] @ sky_delta.T)
+        result = {"RA": ra, "Dec": dec, "Roll": roll, "Alt": None, "Az": None}
+
+        if reference["Alt"] is not None:
+            # move the (refracted) camera Alt/Az by the geometric
+            # change so IMU updates line up with camera solves
+            alt_0, az_0 = vector_to_altaz(reference["target_enu"])
+            alt_1, az_1 = vector_to_altaz(delta_enu @ reference["target_enu"])
+            result["Alt"] = reference["Alt"] + alt_1 - alt_0
+            result["Az"] = (reference["Az"] + az_1 - az_0) % 360
+        return result
+
+
+class AttitudeFilter:
+    """
+    Fuses camera solves with the IMU dead reckoning.
+
+    Keeps a single (isotropic) variance for the pointing.
+    It grows with time and with how far the IMU has turned
+    since the last solve.  Each camera solve is weighted
+    by its RMSE and match count against that, like a
+    scalar Kalman update, and the fused pointing becomes
+    the new dead reckoning reference.
+
+    Also learns online:
+    * IMU heading drift, from the azimuth error that
+      builds up between solves
+    * which IMU body axis the target pixel looks along,
+      from the camera altitude at each solve
+    """
+
+    # Camera pointing noise floor, arcsec
+    MIN_CAMERA_SIGMA = 5.0
+    # Used for solves without RMSE/Matches, arcsec
+    DEFAULT_CAMERA_SIGMA = 60.0
+    # Pointing uncertainty growth, arcsec per second
+    # and fraction of the angle the IMU has turned
+    DRIFT_SIGMA_RATE = 2.0
+    TURN_SIGMA_FRACTION = 0.01
+    # Prediction further off than this (arcsec) means the
+    # IMU reference is bad, take the camera solve as is
+    MAX_INNOVATION = 1800.0
+    # Heading drift estimate
+    HEADING_ALPHA = 0.2
+    MIN_HEADING_INTERVAL = 10.0
+    MAX_HEADING_RATE = 0.05
+    # Boresight estimate, weight of the IMU_BORESIGHT prior
+    BORESIGHT_PRIOR = 1.0
+
+    def __init__(self, boresight=IMU_BORESIGHT):
+        self.dead_reckoning = DeadReckoning(boresight)
+        self.variance = None
+        self._boresight_prior = np.asarray(boresight, dtype=np.float64)
+        self._boresight_normal = np.eye(3) * self.BORESIGHT_PRIOR
+        self._boresight_rhs = self._boresight_prior * self.BORESIGHT_PRIOR
+
+    def camera_sigma(self, solution) -> float:
+        rmse = solution.get("RMSE")
+        matches = solution.get("Matches")
+        if not rmse or not matches:
+            return self.DEFAULT_CAMERA_SIGMA
+        return max(self.MIN_CAMERA_SIGMA, rmse / np.sqrt(matches))
+
+    def _learn_boresight(self, quat, alt):
+        """
+        sin(alt) = up_in_body . boresight for every solve,
+        least squares with a pull toward the prior for the
+        directions the mount motion never exercises
+        """
+        imu_rotation = quat_to_matrix(quat)
+        up_body = imu_rotation.T @ np.array([0.0, 0.0, 1.0])
+        self._boresight_normal += np.outer(up_body, up_body)
+        self._boresight_rhs += up_body * np.sin(np.deg2rad(alt))
+        boresight = np.linalg.solve(self._boresight_normal, self._boresight_rhs)
+        self.dead_reckoning.boresight = boresight / np.linalg.norm(boresight)
+
+    def _learn_heading(self, predicted, solution, elapsed):
+        if elapsed < self.MIN_HEADING_INTERVAL:
+            return
+        az_error = (solution["Az"] - predicted["Az"] + 180) % 360 - 180
+        rate = self.dead_reckoning.heading_rate + az_error / elapsed
+        rate = float(np.clip(rate, -self.MAX_HEADING_RATE, self.MAX_HEADING_RATE))
+        self.dead_reckoning.heading_rate += self.HEADING_ALPHA * (
+            rate - self.dead_reckoning.heading_rate
+        )
+
+    def _reset(self, solution, quat, lat, lst, solve_time, sigma):
+        self.variance = sigma**2
+        self.dead_reckoning.set_reference(solution, quat, lat, lst, solve_time)
+        return {"RA": solution["RA"], "Dec": solution["Dec"], "fusion_sigma": sigma}
+
+    def camera_update(self, solution, quat, lat, lst, solve_time) -> dict:
+        """
+        solution is a camera solve with RA/Dec (target pixel),
+        Roll, Alt/Az, RMSE and Matches.  Returns the fused
+        RA, Dec, Roll, Alt, Az and fusion_sigma (arcsec)
+        """
+        sigma = self.camera_sigma(solution)
+        reference = self.dead_reckoning.reference
+        predicted = self.dead_reckoning.update(quat, solve_time)
+        if quat_to_matrix(quat) is not None and solution.get("Alt") is not None:
+            self._learn_boresight(quat, solution["Alt"])
+        if predicted is None or self.variance is None:
+            return self._reset(solution, quat, lat, lst, solve_time, sigma)
+
+        predicted_vector = radec_to_vectors(predicted["RA"], predicted["Dec"])
+        measured_vector = radec_to_vectors(solution["RA"], solution["Dec"])
+        innovation = np.rad2deg(
+            np.arccos(np.clip(np.dot(predicted_vector, measured_vector), -1, 1))
+        )
+        if innovation * 3600 > self.MAX_INNOVATION:
+            logging.debug("Attitude filter: %.2f deg off, resetting", innovation)
+            return self._reset(solution, quat, lat, lst, solve_time, sigma)
+
+        elapsed = solve_time - reference["time"]
+        turned = quat_angle(reference["quat"], quat)
+        variance = (
+            self.variance
+            + (self.DRIFT_SIGMA_RATE * elapsed) ** 2
+            + (self.TURN_SIGMA_FRACTION * turned * 3600) ** 2
+        )
+        gain = variance / (variance + sigma**2)
+
+        # move the prediction gain of the way to the camera
+        axis = np.cross(predicted_vector, measured_vector)
+        fused_vector = predicted_vector
+        if np.linalg.norm(axis) > 0:
+            fused_vector = (
+                Rotation.from_rotvec(
+                    axis / np.linalg.norm(axis) * np.deg2rad(innovation) * gain
+                ).as_matrix()
+                @ predicted_vector
+            )
+        ra, dec = vector_to_radec(fused_vector)
+        roll_error = (solution["Roll"] - predicted["Roll"] + 180) % 360 - 180
+        fused = {
+            "RA": ra,
+            "Dec": dec,
+            "Roll": (predicted["Roll"] + gain * roll_error) % 360,
+        }
+        if solution.get("Alt") is not None and predicted["Alt"] is not None:
+            self._learn_heading(predicted, solution, elapsed)
+            alt_error = solution["Alt"] - predicted["Alt"]
+            az_error = (solution["Az"] - predicted["Az"] + 180) % 360 - 180
+            fused["Alt"] = predicted["Alt"] + gain * alt_error
+            fused["Az"] = (predicted["Az"] + gain * az_error) % 360
+
+        self.variance = (1 - gain) * variance
+        fused["fusion_sigma"] = float(np.sqrt(self.variance))
+        self.dead_reckoning.set_reference(solution | fused, quat, lat, lst, solve_time)
+        return fused
+
+    def update(self, quat, now) -> Optional[dict]:
+        """
+        IMU only update, see DeadReckoning.update
+        """
+        return self.dead_reckoning.update(quat, now)
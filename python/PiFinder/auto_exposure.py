@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+This module is the camera auto exposure
+* Reads the outcome of each solve attempt
+  (solved, Matches, RMSE, centroid count, T_extract)
+* Steps exposure toward the shortest one that
+  still solves reliably
+* Gain only goes up once exposure is maxed out
+
+Runs in the camera process, which applies the
+result through set_camera_config.
+
+"""
+import time
+import logging
+from typing import Optional, Tuple
+
+# Exposure limits in microseconds, same range as the preview menu
+MIN_EXPOSURE = 25000
+MAX_EXPOSURE = 1000000
+MAX_GAIN = 30
+
+# Step factors, STEP_UP matches the exp_up command
+STEP_UP = 1.25
+STEP_DOWN = 0.85
+
+# Solve attempts looked at before each decision
+WINDOW = 3
+# Attempts ignored right after a change while the
+# camera pipeline still has frames with the old settings
+SKIP_AFTER_CHANGE = 1
+
+# A solve this good lets us try a shorter exposure
+GOOD_MATCHES = 16
+GOOD_RMSE = 30.0
+# Solved, but extraction is slow from too many centroids
+SLOW_EXTRACT_MS = 300.0
+# Fewer centroids than this won't solve reliably
+MIN_CENTROIDS = 15
+
+# How long an exposure that failed blocks going shorter
+FLOOR_SECONDS = 60
+
+
+class AutoExposure:
+    """
+    update() is fed the latest solve quality record and
+    returns a new (exposure_time, gain) when it wants a
+    change, or None to keep the current settings.
+    """
+
+    def __init__(self, exposure_time: int, gain: float):
+        self.exposure_time = int(exposure_time)
+        self.gain = gain
+        # gain we started with, never go below it
+        self.base_gain = gain
+        self.results = []
+        self.last_exposure_start = 0
+        self.change_time = 0
+        self.skip = 0
+        # shortest exposure known to fail, and when
+        self.floor = None
+        self.floor_time = 0
+
+    def set(self, exposure_time: int, gain: float):
+        """
+        Follow a manual change, start collecting fresh
+        """
+        self.exposure_time = int(exposure_time)
+        self.gain = gain
+        self.base_gain = gain
+        self.floor = None
+        self._changed(time.time())
+
+    def _changed(self, now):
+        self.results = []
+        self.change_time = now
+        self.skip = SKIP_AFTER_CHANGE
+
+    def _lengthen(self) -> bool:
+        if self.exposure_time < MAX_EXPOSURE:
+            self.exposure_time = min(MAX_EXPOSURE, int(self.exposure_time * STEP_UP))
+        elif self.gain < MAX_GAIN:
+            self.gain = min(MAX_GAIN, self.gain + 2)
+        else:
+            return False
+        return True
+
+    def _shorten(self, now) -> bool:
+        if self.gain > self.base_gain:
+            self.gain = max(self.base_gain, self.gain - 2)
+            return True
+        exposure_time = max(MIN_EXPOSURE, int(self.exposure_time * STEP_DOWN))
+        if self.floor is not None and now - self.floor_time < FLOOR_SECONDS:
+            exposure_time = max(exposure_time, int(self.floor * STEP_UP))
+        if exposure_time >= self.exposure_time:
+            return False
+        self.exposure_time = exposure_time
+        return True
+
+    def update(self, quality: Optional[dict], now=None) -> Optional[Tuple[int, float]]:
+        if now is None:
+            now = time.time()
+        if not quality or quality.get("exposure_start") is None:
+            return None
+        exposure_start = quality["exposure_start"]
+        if exposure_start <= self.last_exposure_start:
+            # already seen this one
+            return None
+        self.last_exposure_start = exposure_start
+        if exposure_start < self.change_time:
+            # taken with the old settings
+            return None
+        if self.skip > 0:
+            self.skip -= 1
+            return None
+
+        self.results.append(quality)
+        if len(self.results) < WINDOW:
+            return None
+        results = self.results
+        self.results = []
+
+        failed = [r for r in results if not r["solved"]]
+        if len(failed) * 2 > len(results) or all(
+            (r["centroids"] or 0) < MIN_CENTROIDS for r in results
+        ):
+            self.floor = self.exposure_time
+            self.floor_time = now
+            changed = self._lengthen()
+        elif not failed and (
+            all(
+                (r["Matches"] or 0) >= GOOD_MATCHES and (r["RMSE"] or 0) <= GOOD_RMSE
+                for r in results
+            )
+            or all((r["T_extract"] or 0) >= SLOW_EXTRACT_MS for r in results)
+        ):
+            changed = self._shorten(now)
+        else:
+            changed = False
+
+        if not changed:
+            return None
+        self._changed(now)
+        logging.debug("Auto exposure: exp=%d gain=%.1f", self.exposure_time, self.gain)
+        return self.exposure_time, self.gain
@@ -0,0 +1,301 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+Solver benchmark
+* Replays a directory of frames through the same
+  extraction + solve path the solver process uses
+* No camera, shared state or manager needed
+* Prints timing percentiles, success rate and drift
+  against stored solutions as JSON
+
+Run from the python directory:
+    python -m PiFinder.bench.solver ../test_images
+
+Works on solver_debug_dumps too: if the directory has
+<uid>_raw.png files only those are used, and each is
+compared to <uid>_solution.json when present.
+
+"""
+import argparse
+import json
+import logging
+import sys
+import numpy as np
+from pathlib import Path
+from PIL import Image
+from time import perf_counter as precision_timestamp
+
+from PiFinder import utils
+from PiFinder import solver
+from PiFinder.solver_pipeline import EXTRACT_MODES
+
+
+def find_frames(frame_dir: Path):
+    """
+    Returns a sorted list of (uid, image path)
+    """
+    raw_frames = sorted(frame_dir.glob("*_raw.png"))
+    if raw_frames:
+        return [(p.name[: -len("_raw.png")], p) for p in raw_frames]
+    return [(p.stem, p) for p in sorted(frame_dir.glob("*.png"))]
+
+
+def load_solution(frame_dir: Path, uid: str):
+    solution_path = frame_dir / f"{uid}_solution.json"
+    if not solution_path.exists():
+        return None
+    with open(solution_path, "r") as f:
+        solution = json.load(f)
+    if not solution or solution.get("RA") is None:
+        return None
+    return solution
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """
+    Degrees between two RA/Dec positions in degrees
+    """
+    ra1, dec1, ra2, dec2 = np.deg2rad([ra1, dec1, ra2, dec2])
+    cos_sep = np.sin(dec1) * np.sin(dec2) + np.cos(dec1) * np.cos(dec2) * np.cos(
+        ra1 - ra2
+    )
+    return float(np.rad2deg(np.arccos(np.clip(cos_sep, -1, 1))))
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def summarize(values):
+    if not values:
+        return {"mean": None, "max": None}
+    return {"mean": float(np.mean(values)), "max": float(np.max(values))}
+
+
+def run(
+    frame_dir: Path,
+    arch: str,
+    mode=None,
+    tracking=True,
+    target_pixel=(256, 256),
+    repeat=1,
+    batch=1,
+):
+    frames = find_frames(frame_dir)
+    if not frames:
+        raise ValueError(f"No frames found in {frame_dir}")
+
+    t3 = solver.get_tetra3()
+    cedar_detect = solver.get_cedar_detect(arch)
+    # No cfg, so the learned FOV is never written back
+    frame_solver = solver.FrameSolver(t3, tracking=tracking)
+
+    extract_times = []
+    solve_times = []
+    total_times = []
+    solved = 0
+    attempts = 0
+    position_drift = []
+    rmse_drift = []
+    per_mode = {}
+    per_frame = []
+
+    # Frames come from disk, so no IMU or exposure timing
+    image_metadata = {
+        "exposure_start": 0,
+        "exposure_end": 0,
+        "imu": None,
+        "imu_delta": 0,
+    }
+
+    for _ in range(repeat):
+        for start in range(0, len(frames), batch):
+            chunk = frames[start : start + batch]
+            np_images = [
+                np.asarray(Image.open(image_path).convert("L"))
+                for _, image_path in chunk
+            ]
+
+            extract_mode = mode or frame_solver.mode_selector.mode
+            t0 = precision_timestamp()
+            centroid_sets = solver.extract_centroids_concurrent(
+                np_images, cedar_detect, mode=extract_mode
+            )
+            # frames in a batch share the time evenly
+            t_extract = (precision_timestamp() - t0) * 1000 / len(chunk)
+
+            for (uid, _), centroids in zip(chunk, centroid_sets):
+                frame_solver.mode_selector.record_extract(extract_mode, t_extract)
+                extract_times.append(t_extract)
+                attempts += 1
+
+                result = {
+                    "frame": uid,
+                    "extract_mode": extract_mode,
+                    "centroids": len(centroids),
+                    "T_extract": t_extract,
+                    "solved": False,
+                }
+                per_frame.append(result)
+                if len(centroids) == 0:
+                    # the solver process skips these too
+                    continue
+
+                t0 = precision_timestamp()
+                solution = frame_solver.solve(
+                    centroids, image_metadata, target_pixel, extract_mode
+                )
+                t_solve = (precision_timestamp() - t0) * 1000
+                solve_times.append(t_solve)
+                total_times.append(t_extract + t_solve)
+                result["T_solve"] = t_solve
+                result["solve_mode"] = solution["solve_mode"]
+
+                mode_stats = per_mode.setdefault(
+                    extract_mode, {"frames": 0, "solved": 0}
+                )
+                mode_stats["frames"] += 1
+                if solution["RA"] is None:
+                    continue
+                solved += 1
+                mode_stats["solved"] += 1
+                result["solved"] = True
+                result["RA"] = solution["RA_target"]
+                result["Dec"] = solution["Dec_target"]
+                result["RMSE"] = solution["RMSE"]
+
+                stored = load_solution(frame_dir, uid)
+                if stored is None:
+                    continue
+                # stored solutions are already mapped to the target pixel
+                drift = (
+                    angular_separation(
+                        solution["RA_target"],
+                        solution["Dec_target"],
+                        stored["RA"],
+                        stored["Dec"],
+                    )
+                    * 3600
+                )
+                position_drift.append(drift)
+                result["drift_arcsec"] = drift
+                if stored.get("RMSE") is not None:
+                    rmse_drift.append(solution["RMSE"] - stored["RMSE"])
+                    result["RMSE_drift"] = rmse_drift[-1]
+
+    cedar_detect.close()
+    return {
+        "frame_dir": str(frame_dir),
+        "frames": len(frames),
+        "repeat": repeat,
+        "batch": batch,
+        "tracking": tracking,
+        "target_pixel": list(target_pixel),
+        "attempts": attempts,
+        "solved": solved,
+        "success_rate": solved / attempts,
+        "T_extract": percentiles(extract_times),
+        "T_solve": percentiles(solve_times),
+        "T_total": percentiles(total_times),
+        "position_drift_arcsec": summarize(position_drift),
+        "RMSE_drift_arcsec": summarize(rmse_drift),
+        "extract_modes": per_mode,
+        "per_frame": per_frame,
+    }
+
+
+def main():
+    logging.basicConfig(format="%(asctime)s %(name)s: %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="PiFinder solver benchmark")
+    parser.add_argument("frame_dir", help="Directory of PNG frames to replay")
+    parser.add_argument(
+        "-m",
+        "--mode",
+        help=f"Fix the extraction mode: {', '.join(EXTRACT_MODES)}. "
+        "Default is to let the solver pick like it does live",
+        choices=EXTRACT_MODES,
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--no-tracking",
+        help="Blind solve every frame",
+        default=False,
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--target-pixel",
+        help="Solve pixel as Y X",
+        type=int,
+        nargs=2,
+        default=[256, 256],
+        required=False,
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        help="Replay the frames this many times",
+        type=int,
+        default=1,
+        required=False,
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        help="Send this many frames to cedar-detect concurrently, needs --mode",
+        type=int,
+        default=1,
+        required=False,
+    )
+    parser.add_argument(
+        "--arch",
+        help="cedar-detect server binary suffix, defaults to this machine",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Write the JSON report here instead of stdout",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--summary",
+        help="Leave per frame results out of the report",
+        default=False,
+        action="store_true",
+        required=False,
+    )
+    args = parser.parse_args()
+    if args.batch > 1 and args.mode is None:
+        # the live mode selection works frame by frame
+        parser.error("--batch needs a fixed --mode")
+
+    arch = args.arch or utils.get_os_info()[2]
+    report = run(
+        Path(args.frame_dir),
+        arch,
+        mode=args.mode,
+        tracking=not args.no_tracking,
+        target_pixel=tuple(args.target_pixel),
+        repeat=args.repeat,
+        batch=args.batch,
+    )
+    if args.summary:
+        del report["per_frame"]
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,23 @@
 import datetime
+import heapq
+import logging
+from functools import cached_property
 import pytz
 import math
-from typing import Tuple, Optional
+import threading
+import numpy as np
+from typing import List, Tuple, Optional
 from skyfield.api import (
     wgs84,
     Loader,
     Star,
     Angle,
     position_of_radec,
-    load_constellation_map,
 )
-from skyfield.constants import T0 as J2000, B1950
+from skyfield.constants import T0 as J2000, B1950, C_AUDAY
+from skyfield.earthlib import refract, refraction
+from skyfield.functions import rot_z, load_bundled_npy
+from skyfield.timelib import julian_date_of_besselian_epoch
 from skyfield.magnitudelib import planetary_magnitude
 import PiFinder.utils as utils
 import json
@@ -68,6 +75,416 @@ class FastAltAz:
             az = 360 - _az
         return alt, az
 
+    def radec_to_altaz_array(self, ra, dec, alt_only=False):
+        """
+        radec_to_altaz over numpy arrays of RA/DEC in
+        degrees, returns (alt, az) arrays or (alt, None)
+        """
+        ra = np.asarray(ra, dtype=np.float64)
+        dec = np.radians(np.asarray(dec, dtype=np.float64))
+        lat = math.radians(self.lat)
+        hour_angle = np.radians((self.local_siderial_time - ra) % 360)
+
+        sin_alt = np.sin(dec) * math.sin(lat) + np.cos(dec) * math.cos(lat) * np.cos(
+            hour_angle
+        )
+        alt = np.arcsin(np.clip(sin_alt, -1, 1))
+        if alt_only:
+            return np.degrees(alt), None
+
+        cos_az = (np.sin(dec) - np.sin(alt) * math.sin(lat)) / (
+            np.cos(alt) * math.cos(lat)
+        )
+        az = np.degrees(np.arccos(np.clip(cos_az, -1, 1)))
+        az = np.where(np.sin(hour_angle) < 0, az, 360 - az)
+        return np.degrees(alt), az
+
+
+class AltitudeTracker:
+    """
+    Which of a set of objects are above an altitude
+    limit, kept up to date incrementally.
+
+    The hour angles where each object crosses the
+    limit are fixed for a location, so every object
+    gets the time of its next crossing in a heap and
+    advance() only flips the objects whose crossing
+    has passed.  Uses the FastAltAz sidereal time
+    """
+
+    # FastAltAz sidereal time advance per UT second (degrees)
+    SIDEREAL_RATE = (15 + 0.985647 / 24) / 3600
+    # Bigger time jumps (or going back) need a rebuild
+    MAX_ADVANCE_SECONDS = 3600
+
+    def __init__(self, ra, dec, lat, lon, alt_limit, dt):
+        self.lat = lat
+        self.lon = lon
+        self.alt_limit = alt_limit
+        self.time = dt.timestamp()
+
+        ra = np.asarray(ra, dtype=np.float64)
+        dec = np.radians(np.asarray(dec, dtype=np.float64))
+        lat_r = math.radians(lat)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cos_limit_ha = (
+                math.sin(math.radians(alt_limit)) - math.sin(lat_r) * np.sin(dec)
+            ) / (math.cos(lat_r) * np.cos(dec))
+        crosses = np.abs(cos_limit_ha) < 1
+        # hour angle at which each object reaches the limit
+        self.limit_ha = np.degrees(np.arccos(np.clip(cos_limit_ha, -1, 1)))
+
+        lst = FastAltAz(lat, lon, dt).local_siderial_time
+        hour_angle = (lst - ra + 180) % 360 - 180
+        self.above = np.where(
+            crosses, np.abs(hour_angle) < self.limit_ha, cos_limit_ha <= -1
+        )
+
+        # next setting for objects that are up, next rising otherwise
+        to_crossing = (
+            np.where(self.above, self.limit_ha, -self.limit_ha) - hour_angle
+        ) % 360
+        times = self.time + to_crossing / self.SIDEREAL_RATE
+        rows = np.flatnonzero(crosses)
+        self._queue = list(zip(times[rows].tolist(), rows.tolist()))
+        heapq.heapify(self._queue)
+
+    def matches(self, lat, lon, alt_limit, dt) -> bool:
+        """
+        True if advance() can bring this tracker to dt
+        """
+        elapsed = dt.timestamp() - self.time
+        return (self.lat, self.lon, self.alt_limit) == (
+            lat,
+            lon,
+            alt_limit,
+        ) and 0 <= elapsed <= self.MAX_ADVANCE_SECONDS
+
+    def next_crossing(self) -> Optional[float]:
+        return self._queue[0][0] if self._queue else None
+
+    def advance(self, dt) -> List[int]:
+        """
+        Moves to dt, returns the rows that crossed
+        """
+        self.time = max(self.time, dt.timestamp())
+        changed = []
+        while self._queue and self._queue[0][0] <= self.time:
+            crossing, row = heapq.heappop(self._queue)
+            self.above[row] = not self.above[row]
+            # up for twice the limit hour angle, down the rest of the day
+            span = 2 * self.limit_ha[row]
+            if not self.above[row]:
+                span = 360 - span
+            heapq.heappush(self._queue, (crossing + span / self.SIDEREAL_RATE, row))
+            changed.append(row)
+        return changed
+
+
+# Location changes within these keep the cached observer
+# frame, about 10m / 5m which covers GPS fix jitter
+LOCATION_TOLERANCE_DEG = 1e-4
+ALTITUDE_TOLERANCE_M = 5.0
+
+
+def same_location(a, b) -> bool:
+    """
+    True if two (lat, lon, altitude) tuples are
+    the same place within the tolerances above
+    """
+    if a is None or b is None:
+        return a is b
+    return (
+        abs(a[0] - b[0]) <= LOCATION_TOLERANCE_DEG
+        and abs((a[1] - b[1] + 180) % 360 - 180) <= LOCATION_TOLERANCE_DEG
+        and abs(a[2] - b[2]) <= ALTITUDE_TOLERANCE_M
+    )
+
+
+class ObserverFrame:
+    """
+    Cached J2000 RA/Dec <-> apparent Alt/Az transform
+    for one observing location.
+
+    Precession, nutation, annual aberration and the
+    sidereal rotation are taken from skyfield once per
+    time bucket, the earth rotation within a bucket is
+    applied analytically.  Conversions are then a single
+    matrix multiply and work on scalars or numpy arrays.
+    Matches the full skyfield pipeline to about an
+    arcsecond (light deflection and diurnal aberration
+    changes within a bucket are left out)
+    """
+
+    # How long the skyfield part of the transform is reused
+    BUCKET_SECONDS = 60
+    # Earth rotation in radians per UT second
+    EARTH_ROTATION_RATE = math.radians(360.985647366) / 86400
+
+    def __init__(self, ts, earth, lat, lon, altitude):
+        self.ts = ts
+        self.location = (lat, lon, altitude)
+        self.topos = wgs84.latlon(lat, lon, altitude)
+        self.observer_loc = earth + self.topos
+        self.pressure_mbar = 1010.0 * math.exp(-altitude / 9.1e3)
+        self._bucket = None
+        self._rotation = None
+        self._velocity = None
+        self._pole_rotation = None
+        self._bucket_time = None
+
+    def _frame(self, dt) -> np.ndarray:
+        """
+        Returns the GCRS -> (north, east, up) rotation
+        for dt, refreshing the bucket when needed
+        """
+        timestamp = dt.timestamp()
+        bucket = int(timestamp // self.BUCKET_SECONDS)
+        if bucket != self._bucket:
+            self._bucket_time = bucket * self.BUCKET_SECONDS
+            t = self.ts.from_datetime(
+                datetime.datetime.fromtimestamp(self._bucket_time, pytz.utc)
+            )
+            self._rotation = self.topos.rotation_at(t)
+            self._velocity = self.observer_loc.at(t).velocity.au_per_d / C_AUDAY
+            # spin about the true pole lives in the equator of date
+            self._pole_rotation = t.M
+            self._bucket = bucket
+
+        spin = rot_z(-self.EARTH_ROTATION_RATE * (timestamp - self._bucket_time))
+        return self._rotation @ self._pole_rotation.T @ spin @ self._pole_rotation
+
+    def radec_to_altaz(self, ra, dec, dt, atmos=True, aberration=True):
+        """
+        returns the apparent ALT/AZ of J2000 RA/DEC
+        (degrees, scalars or arrays) at the given time.
+        aberration=False for positions that are
+        already apparent
+        """
+        ra = np.radians(np.asarray(ra, dtype=np.float64))
+        dec = np.radians(np.asarray(dec, dtype=np.float64))
+        vectors = np.stack(
+            [np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1
+        )
+        rotation = self._frame(dt)
+
+        if aberration:
+            # first order annual aberration
+            vectors = vectors + self._velocity
+            vectors /= np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+        horizon = vectors @ rotation.T
+        alt = np.degrees(np.arcsin(np.clip(horizon[..., 2], -1, 1)))
+        az = np.degrees(np.arctan2(horizon[..., 1], horizon[..., 0])) % 360
+        if atmos:
+            alt = refract(alt, 10.0, self.pressure_mbar)
+        if alt.ndim == 0:
+            return float(alt), float(az)
+        return alt, az
+
+    def altaz_to_radec(self, alt, az, dt, atmos=True):
+        """
+        Inverse of radec_to_altaz, returns the J2000
+        RA/DEC of an apparent ALT/AZ at the given time
+        """
+        alt = np.asarray(alt, dtype=np.float64)
+        if atmos:
+            alt = alt - refraction(alt, 10.0, self.pressure_mbar)
+        alt = np.radians(alt)
+        az = np.radians(np.asarray(az, dtype=np.float64))
+        horizon = np.stack(
+            [np.cos(alt) * np.cos(az), np.cos(alt) * np.sin(az), np.sin(alt)], axis=-1
+        )
+        vectors = horizon @ self._frame(dt)
+        vectors = vectors - self._velocity
+        vectors /= np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+        ra = np.degrees(np.arctan2(vectors[..., 1], vectors[..., 0])) % 360
+        dec = np.degrees(np.arcsin(np.clip(vectors[..., 2], -1, 1)))
+        if ra.ndim == 0:
+            return float(ra), float(dec)
+        return ra, dec
+
+
+class ConstellationIndex:
+    """
+    J2000 RA/Dec -> IAU constellation abbreviation
+
+    Uses skyfield's boundary table, which is a grid of
+    RA/Dec intervals in the B1875 frame, directly: the
+    precession to B1875 is a fixed matrix computed once
+    and the cell lookup is a searchsorted per axis, so
+    whole arrays convert in one pass
+    """
+
+    def __init__(self, ts):
+        arrays = load_bundled_npy("constellations.npz")
+        self.sorted_ra = arrays["sorted_ra"]
+        self.sorted_dec = arrays["sorted_dec"]
+        self.radec_to_index = arrays["radec_to_index"]
+        self.abbreviations = arrays["indexed_abbreviations"]
+        self.precession = ts.tt_jd(julian_date_of_besselian_epoch(1875)).M
+
+    def lookup(self, ra, dec):
+        """
+        Constellation for ra/dec in degrees, a str
+        for scalars or an array of str for arrays
+        """
+        ra = np.radians(np.asarray(ra, dtype=np.float64))
+        dec = np.radians(np.asarray(dec, dtype=np.float64))
+        vectors = np.stack(
+            [np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1
+        )
+        vectors = vectors @ self.precession.T
+        ra_hours = np.degrees(np.arctan2(vectors[..., 1], vectors[..., 0])) % 360 / 15
+        dec_degrees = np.degrees(np.arcsin(np.clip(vectors[..., 2], -1, 1)))
+
+        i = np.searchsorted(self.sorted_ra, ra_hours)
+        j = np.searchsorted(self.sorted_dec, dec_degrees, side="right")
+        constellations = self.abbreviations[self.radec_to_index[i, j]]
+        if constellations.ndim == 0:
+            return str(constellations)
+        return constellations
+
+
+class PlanetEphemeris:
+    """
+    Planet positions sampled every SAMPLE_MINUTES over
+    a WINDOW_HOURS window and interpolated on demand.
+
+    Sampling runs skyfield once per planet for all
+    sample times together.  A new window is computed
+    in a background thread when the location changes
+    or dt gets close to the end of the current one,
+    so positions() only ever interpolates
+    """
+
+    SAMPLE_MINUTES = 30
+    WINDOW_HOURS = 12
+    # Start on the next window this long before the end
+    PREFETCH_HOURS = 2
+
+    def __init__(self, sf_utils):
+        self.sf_utils = sf_utils
+        self._window = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _covering(self, dt) -> Optional[dict]:
+        window = self._window
+        frame = self.sf_utils.observer_frame
+        if (
+            window is not None
+            and frame is not None
+            and same_location(window["location"], frame.location)
+            and window["times"][0] <= dt.timestamp() <= window["times"][-1]
+        ):
+            return window
+        return None
+
+    def covers(self, dt) -> bool:
+        """
+        True if positions(dt) can be answered
+        from the cached samples
+        """
+        return self._covering(dt) is not None
+
+    def refresh(self, dt):
+        """
+        Samples a new window starting just before dt
+        in the background, nothing to do until there
+        is a location
+        """
+        if self.sf_utils.observer_frame is None:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._sample, args=(dt,), daemon=True
+                )
+                self._thread.start()
+
+    def _sample(self, dt):
+        sf_utils = self.sf_utils
+        frame = sf_utils.observer_frame
+        start = dt.timestamp() - self.SAMPLE_MINUTES * 60
+        times = start + np.arange(
+            0,
+            (self.WINDOW_HOURS * 60 + self.SAMPLE_MINUTES) * 60,
+            self.SAMPLE_MINUTES * 60,
+        )
+        t = sf_utils.ts.from_datetimes(
+            [datetime.datetime.fromtimestamp(x, pytz.utc) for x in times]
+        )
+        observer = frame.observer_loc.at(t)
+        vectors = {}
+        magnitudes = {}
+        for name, planet in zip(sf_utils.planet_names, sf_utils.planets):
+            apparent = observer.observe(planet).apparent()
+            xyz = apparent.xyz.au
+            vectors[name] = (xyz / np.linalg.norm(xyz, axis=0)).T
+            try:
+                magnitudes[name] = planetary_magnitude(apparent)
+            except ValueError:
+                magnitudes[name] = None
+        self._window = {
+            "location": frame.location,
+            "times": times,
+            "vectors": vectors,
+            "magnitudes": magnitudes,
+        }
+        logging.debug(f"Planet ephemeris sampled from {dt}")
+
+    def positions(self, dt) -> Optional[dict]:
+        """
+        Same dictionary as Skyfield_utils.calc_planets,
+        or None while no samples cover dt yet (a
+        refresh is started) or there is no location
+        """
+        window = self._covering(dt)
+        if window is None:
+            self.refresh(dt)
+            return None
+        timestamp = dt.timestamp()
+        if timestamp > window["times"][-1] - self.PREFETCH_HOURS * 3600:
+            self.refresh(dt)
+
+        times = window["times"]
+        i = min(np.searchsorted(times, timestamp, side="right"), len(times) - 1)
+        fraction = (timestamp - times[i - 1]) / (times[i] - times[i - 1])
+
+        names = list(window["vectors"])
+        vectors = np.array(
+            [
+                window["vectors"][name][i - 1] * (1 - fraction)
+                + window["vectors"][name][i] * fraction
+                for name in names
+            ]
+        )
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        ras = np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0])) % 360
+        decs = np.degrees(np.arcsin(np.clip(vectors[:, 2], -1, 1)))
+        alts, azs = self.sf_utils.observer_frame.radec_to_altaz(
+            ras, decs, dt, atmos=False, aberration=False
+        )
+
+        planet_dict = {}
+        for name, ra, dec, alt, az in zip(names, ras, decs, alts, azs):
+            mag = window["magnitudes"][name]
+            if mag is not None:
+                mag = mag[i - 1] * (1 - fraction) + mag[i] * fraction
+            if mag is None or math.isnan(mag):
+                mag = "?"
+            else:
+                mag = "%.2f" % mag
+            planet_dict[name] = {
+                "radec": (float(ra), float(dec)),
+                "radec_pretty": (ra_to_hms(ra), dec_to_dms(dec)),
+                "altaz": (float(alt), float(az)),
+                "mag": mag,
+            }
+        return planet_dict
+
 
 def ra_to_deg(ra_h, ra_m, ra_s):
     ra_deg = ra_h
@@ -149,7 +566,7 @@ def aim_degrees(shared_state, mount_type, screen_direction, target):
                     location["lon"],
                     location["altitude"],
                 )
-                target_alt, target_az = sf_utils.radec_to_altaz(
+                target_alt, target_az = sf_utils.observer_frame.radec_to_altaz(
                     target.ra,
                     target.dec,
                     dt,
@@ -203,18 +620,39 @@ class Skyfield_utils:
     expensive items that
     skyfield requires (ephemeris, constellations, etc)
     and provide useful util functions using them.
+
+    Nothing is loaded until first used, so processes
+    that only import this module don't pay for the
+    ephemeris (which skyfield memory maps)
     """
 
     def __init__(self):
-        load = Loader(utils.astro_data_dir)
-        self.eph = load("de421.bsp")
-        self.earth = self.eph["earth"]
-        self.observer_loc = None
-        self.constellation_map = load_constellation_map()
-        self.ts = load.timescale()
-        self._set_planet_names()
-
-    def _set_planet_names(self):
+        self._location = None
+        self._observer_frame = None
+        self.planet_ephemeris = PlanetEphemeris(self)
+
+    @cached_property
+    def _loader(self):
+        return Loader(utils.astro_data_dir)
+
+    @cached_property
+    def eph(self):
+        return self._loader("de421.bsp")
+
+    @cached_property
+    def earth(self):
+        return self.eph["earth"]
+
+    @cached_property
+    def ts(self):
+        return self._loader.timescale()
+
+    @cached_property
+    def constellation_index(self):
+        return ConstellationIndex(self.ts)
+
+    @cached_property
+    def _full_planet_names(self):
         full_planet_names = [
             name[0]
             for index, name in self.eph.names().items()
@@ -227,22 +665,36 @@ class Skyfield_utils:
             "NEPTUNE_BARYCENTER",
             "PLUTO_BARYCENTER",
         ]
-        self.planets = [self.eph[name] for name in full_planet_names]
-        self.planet_names = []
-        for name in full_planet_names:
-            if "BARYCENTER" in name:
-                name = name.replace("_BARYCENTER", "")
-            self.planet_names.append(name)
+        return full_planet_names
+
+    @cached_property
+    def planets(self):
+        return [self.eph[name] for name in self._full_planet_names]
+
+    @cached_property
+    def planet_names(self):
+        return [name.replace("_BARYCENTER", "") for name in self._full_planet_names]
 
     def set_location(self, lat, lon, altitude):
         """
-        set observing location
+        set observing location, the cached
+        observer_frame is rebuilt when it moves
+        by more than the location tolerance
         """
-        self.observer_loc = self.earth + wgs84.latlon(
-            lat,
-            lon,
-            altitude,
-        )
+        if not same_location(self._location, (lat, lon, altitude)):
+            self._location = (lat, lon, altitude)
+            self._observer_frame = None
+
+    @property
+    def observer_frame(self) -> Optional[ObserverFrame]:
+        if self._observer_frame is None and self._location is not None:
+            self._observer_frame = ObserverFrame(self.ts, self.earth, *self._location)
+        return self._observer_frame
+
+    @property
+    def observer_loc(self):
+        frame = self.observer_frame
+        return frame.observer_loc if frame else None
 
     def altaz_to_radec(self, alt, az, dt):
         """
@@ -277,12 +729,20 @@ class Skyfield_utils:
             alt, az, distance = apparent.altaz()
         return alt.degrees, az.degrees
 
+    def local_sidereal_time(self, dt, lon):
+        """
+        returns the local mean sidereal time
+        in degrees at the given time and longitude
+        """
+        t = self.ts.from_datetime(dt)
+        return (t.gmst * 15 + lon) % 360
+
     def radec_to_constellation(self, ra, dec):
         """
-        Take a ra/dec and return the constellation
+        Take a ra/dec (scalars or arrays) and
+        return the constellation(s)
         """
-        sky_pos = position_of_radec(Angle(degrees=ra)._hours, dec)
-        return self.constellation_map(sky_pos)
+        return self.constellation_index.lookup(ra, dec)
 
     def calc_planets(self, dt):
         """Returns dictionary with all planet positions:
@@ -321,5 +781,6 @@ class Skyfield_utils:
         return planet_dict
 
 
-# Create a single instance of the skyfield utils
+# Create a single instance of the skyfield utils,
+# loads its data on first use
 sf_utils = Skyfield_utils()
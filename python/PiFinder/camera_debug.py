@@ -58,7 +58,7 @@ class CameraDebug(CameraInterface):
         return self.camType
 
 
-def get_images(shared_state, camera_image, command_queue, console_queue):
+def get_images(shared_state, frame_ring, command_queue, console_queue):
     """
     Instantiates the camera hardware
     then calls the universal image loop
@@ -67,5 +67,5 @@ def get_images(shared_state, camera_image, command_queue, console_queue):
     exposure_time = cfg.get_option("camera_exp")
     camera_hardware = CameraDebug(exposure_time)
     camera_hardware.get_image_loop(
-        shared_state, camera_image, command_queue, console_queue, cfg
+        shared_state, frame_ring, command_queue, console_queue, cfg
     )
@@ -13,6 +13,8 @@ import queue
 import time
 from PIL import Image
 from PiFinder import utils
+from PiFinder import attitude
+from PiFinder.auto_exposure import AutoExposure
 from typing import Tuple
 import logging
 
@@ -38,7 +40,7 @@ class CameraInterface:
         pass
 
     def get_image_loop(
-        self, shared_state, camera_image, command_queue, console_queue, cfg
+        self, shared_state, frame_ring, command_queue, console_queue, cfg
     ):
         try:
             debug = False
@@ -54,6 +56,10 @@ class CameraInterface:
                 root_dir, "test_images", "pifinder_debug_02.png"
             )
 
+            auto_exposure = None
+            if cfg.get_option("camera_auto_exp"):
+                auto_exposure = AutoExposure(self.exposure_time, self.gain)
+
             # 60 half-second cycles
             sleep_delay = 60
             while True:
@@ -98,16 +104,35 @@ class CameraInterface:
                         + abs(imu_start["pos"][2] - imu_end["pos"][2])
                     )
 
-                camera_image.paste(base_image)
-                shared_state.set_last_image_metadata(
+                # Tie the frame to the attitude at mid exposure
+                # from the IMU history, not the last reading
+                frame_imu = imu_end
+                imu_ring = shared_state.imu_ring()
+                mid_quat = imu_ring.quat_at((image_start_time + image_end_time) / 2)
+                if imu_end and mid_quat is not None:
+                    frame_imu = dict(imu_end, quat=mid_quat)
+                    start_quat = imu_ring.quat_at(image_start_time)
+                    end_quat = imu_ring.quat_at(image_end_time)
+                    if start_quat is not None and end_quat is not None:
+                        reading_diff = attitude.quat_angle(start_quat, end_quat)
+
+                frame_ring.put(
+                    base_image,
                     {
                         "exposure_start": image_start_time,
                         "exposure_end": image_end_time,
-                        "imu": imu_end,
+                        "imu": frame_imu,
                         "imu_delta": reading_diff,
-                    }
+                    },
                 )
 
+                if auto_exposure is not None and not debug:
+                    new_config = auto_exposure.update(shared_state.solve_quality())
+                    if new_config:
+                        self.exposure_time, self.gain = self.set_camera_config(
+                            *new_config
+                        )
+
                 # Loop over any pending commands
                 # There may be more than one!
                 command = True
@@ -123,7 +148,13 @@ class CameraInterface:
                         else:
                             debug = True
 
+                    if command == "exp_auto":
+                        auto_exposure = AutoExposure(self.exposure_time, self.gain)
+                        console_queue.put("CAM: Exp=Auto")
+
                     if command.startswith("set_exp"):
+                        # manual exposure turns auto off
+                        auto_exposure = None
                         self.exposure_time = int(command.split(":")[1])
                         self.set_camera_config(self.exposure_time, self.gain)
                         console_queue.put("CAM: Exp=" + str(self.exposure_time))
@@ -133,15 +164,22 @@ class CameraInterface:
                         self.exposure_time, self.gain = self.set_camera_config(
                             self.exposure_time, self.gain
                         )
+                        if auto_exposure is not None:
+                            auto_exposure.set(self.exposure_time, self.gain)
                         console_queue.put("CAM: Gain=" + str(self.gain))
 
                     if command == "exp_up" or command == "exp_dn":
+                        auto_exposure = None
                         if command == "exp_up":
                             self.exposure_time = int(self.exposure_time * 1.25)
                         else:
                             self.exposure_time = int(self.exposure_time * 0.75)
                         self.set_camera_config(self.exposure_time, self.gain)
                         console_queue.put("CAM: Exp=" + str(self.exposure_time))
+                        # keep auto exposure off after a restart,
+                        # like picking an exposure in the preview
+                        cfg.set_option("camera_exp", self.exposure_time)
+                        cfg.set_option("camera_auto_exp", False)
                     if command == "exp_save":
                         console_queue.put("CAM: Exp Saved")
                         cfg.set_option("camera_exp", self.exposure_time)
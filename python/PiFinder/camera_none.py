@@ -23,6 +23,7 @@ class CameraNone(CameraInterface):
         self.camera_type = "none"
         self.camType = f"None {self.camera_type}"
         self.exposure_time = exposure_time
+        self.gain = 0
         self.image = Image.new("RGB", (128, 128))
         self.initialize()
 
@@ -48,7 +49,7 @@ class CameraNone(CameraInterface):
         return self.camType
 
 
-def get_images(shared_state, camera_image, command_queue, console_queue):
+def get_images(shared_state, frame_ring, command_queue, console_queue):
     """
     Instantiates the camera hardware
     then calls the universal image loop
@@ -57,5 +58,5 @@ def get_images(shared_state, camera_image, command_queue, console_queue):
     exposure_time = cfg.get_option("camera_exp")
     camera_hardware = CameraNone(exposure_time)
     camera_hardware.get_image_loop(
-        shared_state, camera_image, command_queue, console_queue, cfg
+        shared_state, frame_ring, command_queue, console_queue, cfg
     )
@@ -62,7 +62,7 @@ class CameraPI(CameraInterface):
         return self.camType
 
 
-def get_images(shared_state, camera_image, command_queue, console_queue):
+def get_images(shared_state, frame_ring, command_queue, console_queue):
     """
     Instantiates the camera hardware
     then calls the universal image loop
@@ -73,5 +73,5 @@ def get_images(shared_state, camera_image, command_queue, console_queue):
     gain = cfg.get_option("camera_gain")
     camera_hardware = CameraPI(exposure_time, gain)
     camera_hardware.get_image_loop(
-        shared_state, camera_image, command_queue, console_queue, cfg
+        shared_state, frame_ring, command_queue, console_queue, cfg
     )
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+This module holds the prebuilt catalog snapshot
+* After a build from pifinder_objects.db, the store
+  arrays, value table and catalog layout are written
+  to one file, keyed by the hash of the database
+* Later boots memory map that file instead of
+  querying the database and building every object
+* Pages are copy on write, so objects can still
+  be changed in memory
+
+"""
+import os
+import mmap
+import pickle
+import hashlib
+import logging
+import numpy as np
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+from PiFinder import utils
+from PiFinder.catalog_store import CatalogStore
+
+# Bump whenever the layout or the way catalogs
+# are built changes, old snapshots are then rebuilt
+SNAPSHOT_VERSION = 1
+# Arrays start on this boundary in the file
+ALIGNMENT = 64
+# Bytes in front of the header for its length
+LENGTH_BYTES = 8
+
+snapshot_path = Path(utils.astro_data_dir, "pifinder_objects.snapshot")
+
+
+class SnapshotCatalog(NamedTuple):
+    catalog_code: str
+    max_sequence: int
+    desc: str
+    # store rows of the objects, in catalog order
+    rows: np.ndarray
+
+
+def db_hash(db_path: Path = utils.pifinder_db) -> str:
+    """
+    Hash of the database file contents
+    """
+    digest = hashlib.sha256()
+    with open(db_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save(
+    key: str,
+    store: CatalogStore,
+    catalogs: List[SnapshotCatalog],
+    path: Path = snapshot_path,
+):
+    """
+    Writes store and catalogs to the snapshot for key
+    """
+    arrays = store.arrays()
+    arrays["catalog_rows"] = np.concatenate(
+        [np.asarray(c.rows, dtype=np.int64) for c in catalogs]
+        or [np.zeros(0, dtype=np.int64)]
+    )
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    # The header holds the array offsets, which depend on its size,
+    # so offsets are relative to the first aligned byte after it
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = (array.dtype.str, array.shape, offset)
+        offset = _aligned(offset + array.nbytes)
+    header = pickle.dumps(
+        {
+            "version": SNAPSHOT_VERSION,
+            "key": key,
+            "values": store.values.values,
+            "catalogs": [(c.catalog_code, c.max_sequence, c.desc) for c in catalogs],
+            "catalog_counts": [len(c.rows) for c in catalogs],
+            "arrays": layout,
+        }
+    )
+    data_start = _aligned(LENGTH_BYTES + len(header))
+
+    # write aside and rename so other processes never
+    # map a half written file
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(len(header).to_bytes(LENGTH_BYTES, "little"))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name][2])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+    logging.info(f"Wrote catalog snapshot {path} with {len(store)} objects")
+
+
+def load(
+    key: str, path: Path = snapshot_path
+) -> Optional[Tuple[CatalogStore, List[SnapshotCatalog]]]:
+    """
+    The memory mapped store and catalogs, None if there
+    is no usable snapshot for key
+    """
+    if not path.exists():
+        return None
+    try:
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        header_length = int.from_bytes(buffer[:LENGTH_BYTES], "little")
+        header = pickle.loads(buffer[LENGTH_BYTES : LENGTH_BYTES + header_length])
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError) as e:
+        logging.warning(f"Unreadable catalog snapshot {path}: {e}")
+        return None
+    if header.get("version") != SNAPSHOT_VERSION or header.get("key") != key:
+        logging.info(f"Catalog snapshot {path} is out of date")
+        return None
+
+    data_start = _aligned(LENGTH_BYTES + header_length)
+    arrays = {}
+    for name, (dtype, shape, offset) in header["arrays"].items():
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        if count == 0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+            continue
+        arrays[name] = np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=data_start + offset
+        ).reshape(shape)
+
+    store = CatalogStore.from_arrays(arrays, header["values"])
+    ends = np.cumsum(header["catalog_counts"], dtype=np.int64)
+    catalogs = [
+        SnapshotCatalog(code, max_sequence, desc, arrays["catalog_rows"][end - n : end])
+        for (code, max_sequence, desc), n, end in zip(
+            header["catalogs"], header["catalog_counts"], ends
+        )
+    ]
+    return store, catalogs
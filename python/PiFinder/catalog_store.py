@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+This module holds the columnar catalog store
+* Numeric fields live in numpy arrays, one
+  entry per catalog object
+* Text fields (and names) are interned in a
+  value table and stored as integer codes
+* CompositeObject is a view on one row, filters
+  can work on the arrays directly
+
+"""
+import numpy as np
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence
+
+# field: (dtype, default)
+NUMERIC_FIELDS = {
+    "id": (np.int64, -1),
+    "object_id": (np.int64, -1),
+    "ra": (np.float64, 0.0),
+    "dec": (np.float64, 0.0),
+    "sequence": (np.int64, 0),
+    "logged": (np.bool_, False),
+}
+# Stored as codes into the value table
+VALUE_FIELDS = {
+    "obj_type": "",
+    "const": "",
+    "size": "",
+    "mag": "",
+    "catalog_code": "",
+    "description": "",
+    "image_name": "",
+}
+# in the order of the dataclass CompositeObject used to be
+FIELDS = [
+    "id",
+    "object_id",
+    "obj_type",
+    "ra",
+    "dec",
+    "const",
+    "size",
+    "mag",
+    "catalog_code",
+    "sequence",
+    "description",
+    "names",
+    "image_name",
+    "logged",
+]
+
+# every array of a store, as saved in a catalog snapshot
+ARRAY_FIELDS = (
+    list(NUMERIC_FIELDS)
+    + list(VALUE_FIELDS)
+    + ["mag_value", "name_start", "name_count", "name_codes"]
+)
+
+# numeric magnitude for objects without a usable one
+NO_MAGNITUDE = 99
+
+
+def magnitude_value(mag) -> float:
+    """
+    Numeric magnitude, NO_MAGNITUDE if mag
+    can't be read as a number
+    """
+    try:
+        return float(mag)
+    except (ValueError, TypeError):
+        return NO_MAGNITUDE
+
+
+class ValueTable:
+    """
+    Interned values, each distinct value is
+    stored once and referenced by its code
+    """
+
+    def __init__(self):
+        self.values: List = []
+        self._codes: Optional[Dict] = {}
+
+    @classmethod
+    def from_values(cls, values: List) -> "ValueTable":
+        """
+        Table over already interned values, the code
+        lookup is only built once it's needed
+        """
+        table = cls()
+        table.values = values
+        table._codes = None
+        return table
+
+    def _code_map(self) -> Dict:
+        if self._codes is None:
+            self._codes = {(type(v), v): code for code, v in enumerate(self.values)}
+        return self._codes
+
+    def code(self, value) -> int:
+        # 1 and 1.0 and True hash the same but print differently
+        key = (type(value), value)
+        codes = self._code_map()
+        code = codes.get(key)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            codes[key] = code
+        return code
+
+    def find(self, value) -> Optional[int]:
+        """
+        Code of value, None if it was never interned
+        """
+        return self._code_map().get((type(value), value))
+
+    def codes(self, values: Iterable) -> np.ndarray:
+        return np.fromiter((self.code(v) for v in values), np.int32)
+
+    def __getitem__(self, code: int):
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class CatalogStore:
+    """
+    Column arrays for a set of catalog objects.
+
+    Numeric columns are plain attributes (store.ra,
+    store.logged, ...), value columns are code arrays
+    (store.obj_type, ...) into store.values, and
+    store.mag_value holds the numeric magnitude.
+    Names are a run of codes in name_codes per row
+    """
+
+    def __init__(self, columns: Mapping[str, Sequence], rows: int):
+        # not self.size, that's the object size column
+        self.rows = rows
+        self.values = ValueTable()
+        for field, (dtype, default) in NUMERIC_FIELDS.items():
+            column = columns.get(field)
+            if column is None:
+                column = np.full(rows, default, dtype=dtype)
+            setattr(self, field, np.asarray(column, dtype=dtype))
+        for field, default in VALUE_FIELDS.items():
+            column = columns.get(field)
+            if column is None:
+                column = [default] * rows
+            setattr(self, field, self.values.codes(column))
+        self.mag_value = np.fromiter(
+            (magnitude_value(self.values[code]) for code in self.mag),
+            np.float64,
+            rows,
+        )
+
+        names = columns.get("names")
+        if names is None:
+            names = [[]] * rows
+        counts = np.fromiter((len(n) for n in names), np.int32, rows)
+        self.name_start = np.zeros(rows, dtype=np.int32)
+        self.name_start[1:] = np.cumsum(counts)[:-1]
+        self.name_count = counts
+        self.name_codes = self.values.codes(name for row in names for name in row)
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Mapping]) -> "CatalogStore":
+        """
+        Store for a list of dicts with the
+        CompositeObject fields
+        """
+        columns = {}
+        for field in FIELDS:
+            if field in NUMERIC_FIELDS:
+                default = NUMERIC_FIELDS[field][1]
+            elif field in VALUE_FIELDS:
+                default = VALUE_FIELDS[field]
+            else:
+                default = []
+            columns[field] = [row.get(field, default) for row in rows]
+        unknown = {key for row in rows for key in row} - set(FIELDS)
+        if unknown:
+            raise TypeError(f"Unknown CompositeObject fields {sorted(unknown)}")
+        return cls(columns, len(rows))
+
+    @classmethod
+    def from_arrays(
+        cls, arrays: Mapping[str, np.ndarray], values: List
+    ) -> "CatalogStore":
+        """
+        Store over existing arrays (e.g. memory mapped),
+        as returned by arrays(), and the value table values
+        """
+        store = cls.__new__(cls)
+        store.rows = len(arrays["id"])
+        store.values = ValueTable.from_values(values)
+        for field in ARRAY_FIELDS:
+            setattr(store, field, arrays[field])
+        return store
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {field: getattr(self, field) for field in ARRAY_FIELDS}
+
+    def __len__(self):
+        return self.rows
+
+    def get(self, field: str, row: int):
+        if field in VALUE_FIELDS:
+            return self.values[getattr(self, field)[row]]
+        if field == "names":
+            start = self.name_start[row]
+            codes = self.name_codes[start : start + self.name_count[row]]
+            return [self.values[code] for code in codes]
+        return getattr(self, field)[row].item()
+
+    def set(self, field: str, row: int, value):
+        if field in VALUE_FIELDS:
+            getattr(self, field)[row] = self.values.code(value)
+            if field == "mag":
+                self.mag_value[row] = magnitude_value(value)
+        elif field == "names":
+            # old codes stay behind, names are rarely set
+            value = list(value)
+            self.name_start[row] = len(self.name_codes)
+            self.name_count[row] = len(value)
+            self.name_codes = np.concatenate(
+                [self.name_codes, self.values.codes(value)]
+            ).astype(np.int32)
+        else:
+            getattr(self, field)[row] = value
+
+    def row_dict(self, row: int) -> dict:
+        return {field: self.get(field, row) for field in FIELDS}
@@ -2,15 +2,20 @@ import logging
 import time
 import datetime
 import pytz
+import numpy as np
 from pprint import pformat
 
-from typing import List, Dict, DefaultDict, Optional
+from typing import List, Dict, DefaultDict, MutableMapping, Optional, Tuple
 from collections import defaultdict
+from weakref import WeakKeyDictionary
+from sqlite3 import Row
 import PiFinder.calc_utils as calc_utils
 from PiFinder.db.db import Database
 from PiFinder.db.objects_db import ObjectsDatabase
 from PiFinder.db.observations_db import ObservationsDatabase
 from PiFinder.composite_object import CompositeObject
+from PiFinder.catalog_store import CatalogStore
+from PiFinder import catalog_snapshot
 from PiFinder.calc_utils import sf_utils
 
 # collection of all catalog-related classes
@@ -78,7 +83,21 @@ class Names:
 
 
 class CatalogFilter:
-    """can be set on catalog to filter"""
+    """
+    can be set on catalog to filter
+
+    Evaluates every filter as a boolean mask over a
+    whole CatalogStore.  The mask for a store is
+    computed once and reused by all catalogs drawing
+    on it until the filter values or time change.
+
+    Kept across refreshes, the magnitude/type part is
+    only redone when those values change, the altitude
+    part is advanced incrementally by an AltitudeTracker
+    per store and mask_version() tells catalogs if their
+    selection can have changed.  Caches are weak on the
+    store so replaced stores are dropped
+    """
 
     fast_aa = None
 
@@ -89,17 +108,46 @@ class CatalogFilter:
         altitude_filter=None,
         observed_filter=None,
     ):
+        self.location = None
+        self.dt = None
+        self.magnitude_filter = None
+        self.type_filter = None
+        self.altitude_filter = None
+        self.observed_filter = None
+        self._masks: MutableMapping[CatalogStore, np.ndarray] = WeakKeyDictionary()
+        self._value_masks: MutableMapping[CatalogStore, np.ndarray] = (
+            WeakKeyDictionary()
+        )
+        self._versions: MutableMapping[CatalogStore, Tuple[np.ndarray, int]] = (
+            WeakKeyDictionary()
+        )
+        self._altitudes: MutableMapping[CatalogStore, calc_utils.AltitudeTracker] = (
+            WeakKeyDictionary()
+        )
         self.set_values(magnitude_filter, type_filter, altitude_filter, observed_filter)
 
     def set_values(
         self, magnitude_filter, type_filter, altitude_filter, observed_filter
     ):
+        if type_filter is not None:
+            # the config list can be changed in place
+            type_filter = list(type_filter)
+        if (magnitude_filter, type_filter) != (self.magnitude_filter, self.type_filter):
+            self._value_masks.clear()
+            self._masks.clear()
+        if (altitude_filter, observed_filter) != (
+            self.altitude_filter,
+            self.observed_filter,
+        ):
+            self._masks.clear()
         self.magnitude_filter = magnitude_filter
         self.type_filter = type_filter
         self.altitude_filter = altitude_filter
         self.observed_filter = observed_filter
 
     def calc_fast_aa(self, shared_state):
+        # new time, the altitude and observed parts are redone
+        self._masks.clear()
         solution = shared_state.solution()
         location = shared_state.location()
         dt = shared_state.datetime()
@@ -109,47 +157,109 @@ class CatalogFilter:
                 location["lon"],
                 dt,
             )
+            self.location = location
+            self.dt = dt
         else:
             logging.warning(
                 f"Calc_fast_aa: {'solution' if not solution else 'location' if not location else 'datetime' if not dt else 'nothing'} not set"
             )
 
-    def apply_filter(self, obj: CompositeObject):
-        # check altitude
-        if self.altitude_filter != "None" and self.fast_aa:
-            obj_altitude, _ = self.fast_aa.radec_to_altaz(
-                obj.ra,
-                obj.dec,
-                alt_only=True,
+    def altitude_mask(self, store: CatalogStore) -> np.ndarray:
+        """
+        Rows of store above the altitude limit, only
+        objects whose limit crossing has passed since
+        the last call are recomputed
+        """
+        lat, lon = self.location["lat"], self.location["lon"]
+        tracker = self._altitudes.get(store)
+        if tracker is not None and tracker.matches(
+            lat, lon, self.altitude_filter, self.dt
+        ):
+            tracker.advance(self.dt)
+        else:
+            tracker = calc_utils.AltitudeTracker(
+                store.ra, store.dec, lat, lon, self.altitude_filter, self.dt
             )
-            if obj_altitude < self.altitude_filter:
-                return False
+            self._altitudes[store] = tracker
+        return tracker.above
 
-        # check magnitude
+    def value_mask(self, store: CatalogStore) -> np.ndarray:
+        """
+        Rows of store that pass the magnitude and
+        type filters, which don't change with time
+        """
+        mask = self._value_masks.get(store)
+        if mask is not None:
+            return mask
+
+        mask = np.ones(len(store), dtype=bool)
+        # check magnitude, unknown magnitudes count as NO_MAGNITUDE
+        if self.magnitude_filter != "None":
+            mask &= store.mag_value < self.magnitude_filter
+
+        # check type, through a lookup table over the value codes
+        if self.type_filter != ["None"]:
+            allowed = np.zeros(len(store.values), dtype=bool)
+            for obj_type in self.type_filter:
+                code = store.values.find(obj_type)
+                if code is not None:
+                    allowed[code] = True
+            mask &= allowed[store.obj_type]
+
+        self._value_masks[store] = mask
+        return mask
+
+    def store_mask(self, store: CatalogStore) -> np.ndarray:
+        """
+        True for every row of store that passes
+        """
+        mask = self._masks.get(store)
+        if mask is not None:
+            return mask
 
-        # first try to get object mag to float
-        try:
-            obj_mag = float(obj.mag)
-        except (ValueError, TypeError):
-            obj_mag = 99
+        mask = self.value_mask(store).copy()
+        # check altitude
+        if self.altitude_filter != "None" and self.fast_aa:
+            mask &= self.altitude_mask(store)
 
-        if self.magnitude_filter != "None" and obj_mag >= self.magnitude_filter:
-            return False
+        # check observed, logged flips as objects are logged
+        if self.observed_filter != "Any":
+            mask &= store.logged == (self.observed_filter == "Yes")
 
-        # check type
-        if self.type_filter != ["None"] and obj.obj_type not in self.type_filter:
-            return False
+        self._masks[store] = mask
+        return mask
 
-        # check observed
-        if self.observed_filter != "Any":
-            return (self.observed_filter == "Yes") == obj.logged
+    def mask_version(self, store: CatalogStore) -> int:
+        """
+        Number that changes whenever the mask
+        for store comes out different
+        """
+        mask = self.store_mask(store)
+        cached = self._versions.get(store)
+        if cached is not None:
+            previous, version = cached
+            if previous is mask or np.array_equal(previous, mask):
+                return version
+            version += 1
+        else:
+            version = 0
+        self._versions[store] = (mask, version)
+        return version
 
-        # object passed all the tests
-        return True
+    def select(self, objects, store_rows=None) -> List[CompositeObject]:
+        """
+        The objects that pass, store_rows is the
+        (store, rows) all objects are backed by if known
+        """
+        if store_rows is not None:
+            store, rows = store_rows
+            keep = self.store_mask(store)[rows]
+            return [objects[i] for i in np.flatnonzero(keep)]
+        return [obj for obj in objects if self.store_mask(obj.store)[obj.row]]
 
-    def apply(self, shared_state, objects: List[CompositeObject]):
+    def apply(self, shared_state, objects: List[CompositeObject], store_rows=None):
         self.calc_fast_aa(shared_state)
-        return [obj for obj in objects if self.apply_filter(obj)]
+        return self.select(objects, store_rows)
 
 
 def catalog_base_id_sort(obj: CompositeObject):
@@ -175,6 +285,7 @@ class CatalogBase:
         self.desc = desc
         self.sort = sort
         self.__objects: List[CompositeObject] = []
+        self.store_rows: Optional[Tuple[CatalogStore, np.ndarray]] = None
         self.id_to_pos: Dict[int, int]
         self.sequence_to_pos: Dict[int, int]
         self.catalog_code: str
@@ -204,6 +315,28 @@ class CatalogBase:
         self._update_sequence_to_pos()
         assert self.check_sequences()
 
+    def add_store_rows(self, store: CatalogStore, rows: np.ndarray):
+        """
+        Adds the objects at rows of store.  Rows already
+        in sequence order, like a snapshot's, skip the
+        sort and the per object indexing
+        """
+        objects = [CompositeObject.view(store, row) for row in rows.tolist()]
+        sequences = store.sequence[rows]
+        if (
+            self.__objects
+            or self.sort is not catalog_base_sequence_sort
+            or np.any(np.diff(sequences) <= 0)
+        ):
+            self.add_objects(objects)
+            return
+        self.__objects.extend(objects)
+        positions = range(len(objects))
+        self.id_to_pos = dict(zip(store.id[rows].tolist(), positions))
+        self.sequence_to_pos = dict(zip(sequences.tolist(), positions))
+        self.store_rows = (store, rows)
+        self._filtered_with = None
+
     def _sort_objects(self):
         self.__objects.sort(key=self.sort)
 
@@ -231,6 +364,20 @@ class CatalogBase:
 
     def _update_id_to_pos(self):
         self.id_to_pos = {obj.id: i for i, obj in enumerate(self.__objects)}
+        self._update_store_rows()
+
+    def _update_store_rows(self):
+        """
+        (store, rows) when all objects share one store,
+        so filters can index the store arrays directly
+        """
+        self.store_rows = None
+        self._filtered_with = None
+        stores = {id(obj.store): obj.store for obj in self.__objects}
+        if len(stores) == 1:
+            store = next(iter(stores.values()))
+            rows = np.fromiter((obj.row for obj in self.__objects), np.int64)
+            self.store_rows = (store, rows)
 
     def _update_sequence_to_pos(self):
         self.sequence_to_pos = {obj.sequence: i for i, obj in enumerate(self.__objects)}
@@ -251,6 +398,7 @@ class Catalog(CatalogBase):
         self.filtered_objects: List[CompositeObject] = self.get_objects()
         self.filtered_objects_seq: List[int] = self._filtered_objects_to_seq()
         self.last_filtered = 0
+        self._filtered_with: Optional[Tuple[CatalogFilter, int]] = None
 
     def has(self, sequence: int, filtered=True):
         return sequence in self.filtered_objects_seq
@@ -258,11 +406,30 @@ class Catalog(CatalogBase):
     def _filtered_objects_to_seq(self):
         return [obj.sequence for obj in self.filtered_objects]
 
-    def filter_objects(self, shared_state) -> List[CompositeObject]:
-        self.filtered_objects = self.catalog_filter.apply(
-            shared_state, self.get_objects()
-        )
-        self.filtered_objects_seq = self._filtered_objects_to_seq()
+    def filter_objects(
+        self, shared_state, catalog_filter: Optional[CatalogFilter] = None
+    ) -> List[CompositeObject]:
+        """
+        Filters with this catalog's filter, or with an
+        already evaluated catalog_filter shared by all
+        catalogs
+        """
+        if catalog_filter is None:
+            catalog_filter = self.catalog_filter
+            catalog_filter.calc_fast_aa(shared_state)
+        if self.store_rows is None:
+            self.filtered_objects = catalog_filter.select(self.get_objects())
+            self.filtered_objects_seq = self._filtered_objects_to_seq()
+        else:
+            # skip the selection if the mask didn't change
+            store, rows = self.store_rows
+            filtered_with = (catalog_filter, catalog_filter.mask_version(store))
+            if filtered_with != self._filtered_with:
+                keep = np.flatnonzero(catalog_filter.store_mask(store)[rows])
+                objects = self.get_objects()
+                self.filtered_objects = [objects[i] for i in keep]
+                self.filtered_objects_seq = store.sequence[rows[keep]].tolist()
+                self._filtered_with = filtered_with
         self.last_filtered = time.time()
         return self.filtered_objects
 
@@ -370,6 +537,17 @@ class Catalogs:
         else:
             return list(self._code_to_pos.keys())
 
+    def mark_logged(self, catalog_code: str, sequence: int):
+        """
+        Flags a newly logged object, if it's loaded
+        """
+        catalog = self.get_catalog_by_code(catalog_code)
+        if catalog is None:
+            return
+        obj = catalog.get_object_by_sequence(sequence)
+        if obj is not None:
+            obj.logged = True
+
     def get_catalog_by_code(self, catalog_code: str) -> Optional[Catalog]:
         pos = self._code_to_pos.get(catalog_code, None)
         result = None
@@ -461,11 +639,18 @@ class Catalogs:
 
 
 class PlanetCatalog(Catalog):
-    """Creates a catalog of planets"""
+    """
+    Creates a catalog of planets, empty until there is
+    a location and the ephemeris covers dt (sampling is
+    started in the background and the catalog ui adds
+    the planets once it's done)
+    """
 
     def __init__(self, dt: datetime.datetime):
         super().__init__("PL", 10, "The planets")
-        planet_dict = sf_utils.calc_planets(dt)
+        planet_dict = sf_utils.planet_ephemeris.positions(dt)
+        if planet_dict is None:
+            return
         sequence = 0
         for name in sf_utils.planet_names:
             if name.lower() != "sun":
@@ -494,6 +679,12 @@ class PlanetCatalog(Catalog):
         self.add_object(obj)
 
 
+# CompositeObject fields from the catalog_objects table,
+# the rest come from the objects table
+CATALOG_OBJECT_FIELDS = ("id", "object_id", "catalog_code", "sequence", "description")
+OBJECT_FIELDS = ("obj_type", "ra", "dec", "const", "size", "mag", "image_name")
+
+
 class CatalogBuilder:
     """
     Builds catalogs from the database
@@ -501,22 +692,17 @@ class CatalogBuilder:
     """
 
     def build(self) -> Catalogs:
-        db: Database = ObjectsDatabase()
         obs_db: Database = ObservationsDatabase()
-        # list of dicts, one dict for each entry in the catalog_objects table
-        catalog_objects: List[Dict] = [dict(row) for row in db.get_catalog_objects()]
-        objects = db.get_objects()
-        common_names = Names()
-        catalogs_info = db.get_catalogs_dict()
-        objects = {row["id"]: dict(row) for row in objects}
-        composite_objects: List[CompositeObject] = self._build_composite(
-            catalog_objects, objects, common_names, obs_db
-        )
         # This is used for caching catalog dicts
         # to speed up repeated searches
         self.catalog_dicts = {}
-        logging.debug(f"Loaded {len(composite_objects)} objects from database")
-        all_catalogs: Catalogs = self._get_catalogs(composite_objects, catalogs_info)
+        db_hash = catalog_snapshot.db_hash()
+        all_catalogs: Optional[Catalogs] = self._load_snapshot(db_hash)
+        if all_catalogs is None:
+            all_catalogs = self._build_from_db(db_hash)
+        self._mark_logged(all_catalogs, obs_db)
+        # flip logged as objects get logged
+        ObservationsDatabase.add_log_listener(all_catalogs.mark_logged)
         # Initialize planet catalog with whatever date we have for now
         # This will be re-initialized on activation of Catalog ui module
         # if we have GPS lock
@@ -527,6 +713,77 @@ class CatalogBuilder:
         assert self.check_catalogs_sequences(all_catalogs) is True
         return all_catalogs
 
+    def _build_from_db(self, db_hash: str) -> Catalogs:
+        db: Database = ObjectsDatabase()
+        catalog_objects = db.get_catalog_objects()
+        objects = db.get_objects()
+        common_names = Names()
+        catalogs_info = db.get_catalogs_dict()
+        composite_objects: List[CompositeObject] = self._build_composite(
+            catalog_objects, objects, common_names
+        )
+        self._fill_constellations(composite_objects)
+        logging.debug(f"Loaded {len(composite_objects)} objects from database")
+        all_catalogs: Catalogs = self._get_catalogs(composite_objects, catalogs_info)
+        if composite_objects:
+            self._save_snapshot(db_hash, composite_objects[0].store, all_catalogs)
+        return all_catalogs
+
+    def _mark_logged(self, catalogs: Catalogs, obs_db: ObservationsDatabase):
+        """
+        Sets logged on every object, joining the
+        sequences of each catalog with the observed ones
+        """
+        observed = obs_db.get_observed_sequences()
+        for catalog in catalogs.get_catalogs(only_selected=False):
+            sequences = observed.get(catalog.catalog_code, set())
+            if catalog.store_rows is None:
+                for obj in catalog.get_objects():
+                    obj.logged = obj.sequence in sequences
+                continue
+            store, rows = catalog.store_rows
+            store.logged[rows] = np.isin(
+                store.sequence[rows], np.fromiter(sequences, np.int64, len(sequences))
+            )
+
+    def _load_snapshot(self, db_hash: str) -> Optional[Catalogs]:
+        """
+        Catalogs from the snapshot of the database
+        with db_hash, None if there is none
+        """
+        snapshot = catalog_snapshot.load(db_hash)
+        if snapshot is None:
+            return None
+        store, snapshot_catalogs = snapshot
+        catalog_list: List[Catalog] = []
+        for snapshot_catalog in snapshot_catalogs:
+            catalog = Catalog(
+                snapshot_catalog.catalog_code,
+                max_sequence=snapshot_catalog.max_sequence,
+                desc=snapshot_catalog.desc,
+            )
+            catalog.add_store_rows(store, snapshot_catalog.rows)
+            catalog_list.append(catalog)
+        logging.debug(f"Loaded {len(store)} objects from catalog snapshot")
+        return Catalogs(catalog_list)
+
+    def _save_snapshot(self, db_hash: str, store: CatalogStore, catalogs: Catalogs):
+        snapshot_catalogs = []
+        for catalog in catalogs.get_catalogs(only_selected=False):
+            rows = np.zeros(0, dtype=np.int64)
+            if catalog.store_rows is not None:
+                rows = catalog.store_rows[1]
+            snapshot_catalogs.append(
+                catalog_snapshot.SnapshotCatalog(
+                    catalog.catalog_code, catalog.max_sequence, catalog.desc, rows
+                )
+            )
+        try:
+            catalog_snapshot.save(db_hash, store, snapshot_catalogs)
+        except OSError as e:
+            # the next boot builds from the database again
+            logging.warning(f"Could not write catalog snapshot: {e}")
+
     def check_catalogs_sequences(self, catalogs: Catalogs):
         for catalog in catalogs.get_catalogs():
             result = catalog.check_sequences()
@@ -537,27 +794,42 @@ class CatalogBuilder:
 
     def _build_composite(
         self,
-        catalog_objects: List[Dict],
-        objects: Dict[int, Dict],
+        catalog_objects: List[Row],
+        objects: List[Row],
         common_names: Names,
-        obs_db: ObservationsDatabase,
     ) -> List[CompositeObject]:
-        composite_objects: List[CompositeObject] = []
-
+        # Merge the objects rows onto the catalog_objects rows
+        # column by column, straight into the store
+        object_rows = {row["id"]: row for row in objects}
+        columns: Dict[str, List] = {
+            field: [] for field in CATALOG_OBJECT_FIELDS + OBJECT_FIELDS + ("names",)
+        }
         for catalog_obj in catalog_objects:
             object_id = catalog_obj["object_id"]
+            for field in CATALOG_OBJECT_FIELDS:
+                columns[field].append(catalog_obj[field])
+            object_row = object_rows[object_id]
+            for field in OBJECT_FIELDS:
+                columns[field].append(object_row[field])
+            columns["names"].append(common_names.get_name(object_id))
 
-            # Merge the two dictionaries
-            composite_data = objects[object_id] | catalog_obj
+        store = CatalogStore(columns, len(catalog_objects))
+        return [CompositeObject.view(store, row) for row in range(len(store))]
 
-            # Create an instance from the merged dictionaries
-            composite_instance = CompositeObject.from_dict(composite_data)
-            composite_instance.logged = obs_db.check_logged(composite_instance)
-            composite_instance.names = common_names.get_name(object_id)
-
-            # Append to the result dictionary
-            composite_objects.append(composite_instance)
-        return composite_objects
+    def _fill_constellations(self, composite_objects: List[CompositeObject]):
+        """
+        Looks up the constellation for objects
+        ingested without one, in a single pass
+        """
+        missing = [obj for obj in composite_objects if not obj.const]
+        if not missing:
+            return
+        constellations = sf_utils.radec_to_constellation(
+            np.array([obj.ra for obj in missing]),
+            np.array([obj.dec for obj in missing]),
+        )
+        for obj, constellation in zip(missing, constellations):
+            obj.const = str(constellation)
 
     def _get_catalogs(
         self, composite_objects: List[CompositeObject], catalogs_info: Dict[str, Dict]
@@ -652,6 +924,7 @@ class CatalogTracker:
         self.shared_state = shared_state
         self.config_options = config_options
         self.catalogs: Catalogs = catalogs
+        self.catalog_filter = CatalogFilter()
         self.refresh_catalogs()
 
     def get_current_catalog(self) -> Optional[Catalog]:
@@ -809,6 +1082,17 @@ class CatalogTracker:
         altitude_filter = self.config_options["Alt Limit"]["value"]
         observed_filter = self.config_options["Observed"]["value"]
 
+        # One filter for all catalogs, so each store is only
+        # evaluated once.  It is kept so the altitudes are
+        # updated incrementally between refreshes
+        catalog_filter = self.catalog_filter
+        catalog_filter.set_values(
+            magnitude_filter,
+            type_filter,
+            altitude_filter,
+            observed_filter,
+        )
+        catalog_filter.calc_fast_aa(self.shared_state)
         for catalog in catalog_list:
             catalog.catalog_filter.set_values(
                 magnitude_filter,
@@ -816,7 +1100,7 @@ class CatalogTracker:
                 altitude_filter,
                 observed_filter,
             )
-            catalog.filter_objects(self.shared_state)
+            catalog.filter_objects(self.shared_state, catalog_filter)
 
         current_object = self.object_tracker[self.current_catalog_code]
         if current_object is not None and not self.get_current_catalog().has(
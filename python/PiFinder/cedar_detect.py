@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+This module wraps the cedar-detect client
+* One gRPC channel to the cedar-detect server for
+  the life of the solver
+* Frames go to the server through shared memory,
+  the request only carries the block name
+* extract_concurrent keeps several frames in flight
+  with the server, one unary call each, so replaying
+  frames overlaps server work but every frame still
+  pays its own RPC overhead
+
+Falls back to the tetra3 client, which sends the
+image bytes in the request, if the server fails
+to map the shared memory (an INTERNAL status).
+Other errors are raised to the caller.
+
+"""
+import sys
+import logging
+import grpc
+import numpy as np
+from multiprocessing import shared_memory
+from typing import List
+
+from PiFinder import utils
+
+sys.path.append(str(utils.tetra3_dir))
+from PiFinder.tetra3.tetra3 import cedar_detect_client
+from PiFinder.tetra3.tetra3 import cedar_detect_pb2, cedar_detect_pb2_grpc
+
+CEDAR_PORT = 50551
+# Frames in flight at once in extract_concurrent
+CONCURRENT_SLOTS = 4
+# Seconds to wait for the server on each request
+REQUEST_TIMEOUT = 5
+
+
+class CedarDetect:
+    """
+    Drop in for CedarDetectClient.extract_centroids
+    with a shared memory image handoff
+    """
+
+    def __init__(
+        self, binary_path: str, port: int = CEDAR_PORT, slots=CONCURRENT_SLOTS
+    ):
+        # The tetra3 client starts and owns the server process
+        # and is the fallback path
+        self.client = cedar_detect_client.CedarDetectClient(
+            binary_path=binary_path, port=port
+        )
+        self.channel = grpc.insecure_channel(f"localhost:{port}")
+        self.stub = cedar_detect_pb2_grpc.CedarDetectStub(self.channel)
+        self.slots = slots
+        self.use_shmem = True
+        self._shm = [None] * slots
+
+    def _slot(self, index: int, np_image) -> str:
+        """
+        Copies the image into shared memory slot index,
+        returns the name the server opens it by
+        """
+        shm = self._shm[index]
+        if shm is None or shm.size < np_image.nbytes:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = shared_memory.SharedMemory(create=True, size=np_image.nbytes)
+            self._shm[index] = shm
+        np.ndarray(np_image.shape, dtype=np.uint8, buffer=shm.buf)[:] = np_image
+        return "/" + shm.name
+
+    def _request(self, np_image, shmem_name, sigma, max_size, use_binned):
+        height, width = np_image.shape
+        return cedar_detect_pb2.CentroidsRequest(
+            input_image=cedar_detect_pb2.Image(
+                width=width, height=height, shmem_name=shmem_name
+            ),
+            sigma=sigma,
+            max_size=max_size,
+            return_binned_image=False,
+            use_binned_for_star_candidates=use_binned,
+        )
+
+    def _extract_shmem(self, np_images, sigma, max_size, use_binned):
+        results = []
+        for start in range(0, len(np_images), self.slots):
+            futures = [
+                self.stub.ExtractCentroids.future(
+                    self._request(
+                        np_image,
+                        self._slot(index, np_image),
+                        sigma,
+                        max_size,
+                        use_binned,
+                    ),
+                    timeout=REQUEST_TIMEOUT,
+                    wait_for_ready=True,
+                )
+                for index, np_image in enumerate(np_images[start : start + self.slots])
+            ]
+            for future in futures:
+                # (y, x) like tetra3, brightest first
+                results.append(
+                    [
+                        (sc.centroid_y, sc.centroid_x)
+                        for sc in future.result().star_candidates
+                    ]
+                )
+        return results
+
+    def extract_concurrent(self, images, sigma, max_size, use_binned) -> List[list]:
+        """
+        Returns one list of centroids per image, with
+        up to slots requests outstanding at a time
+        """
+        np_images = [np.ascontiguousarray(image, dtype=np.uint8) for image in images]
+        if self.use_shmem:
+            try:
+                return self._extract_shmem(np_images, sigma, max_size, use_binned)
+            except grpc.RpcError as e:
+                if e.code() != grpc.StatusCode.INTERNAL:
+                    raise
+                logging.warning(
+                    "cedar-detect shared memory failed (%s), sending image data",
+                    e.code(),
+                )
+                self.use_shmem = False
+                self._free_shmem()
+        return [
+            self.client.extract_centroids(
+                np_image, sigma=sigma, max_size=max_size, use_binned=use_binned
+            )
+            for np_image in np_images
+        ]
+
+    def extract_centroids(self, image, sigma, max_size, use_binned):
+        return self.extract_concurrent([image], sigma, max_size, use_binned)[0]
+
+    def _free_shmem(self):
+        for shm in self._shm:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self._shm = [None] * self.slots
+
+    def close(self):
+        self._free_shmem()
+        self.channel.close()
@@ -1,33 +1,87 @@
 # CompositeObject class
-from dataclasses import dataclass, field
+from PiFinder.catalog_store import CatalogStore
+
+
+def _column(field: str):
+    return property(
+        lambda self: self._store.get(field, self._row),
+        lambda self, value: self._store.set(field, self._row, value),
+    )
 
 
-@dataclass
 class CompositeObject:
-    """A catalog object, augmented with related DB data"""
+    """
+    A catalog object, augmented with related DB data
+
+    A view on one row of a CatalogStore.  Objects
+    built directly (planets, pushed targets) get a
+    store of their own.  Compares, prints and pickles
+    by field values like the dataclass it replaces
+    """
+
+    __slots__ = ("_store", "_row")
 
     # id is the primary key of the catalog_objects table
-    id: int = field(default=-1)
+    id = _column("id")
     # object_id is the primary key of the objects table
-    object_id: int = field(default=-1)
-    obj_type: str = field(default="")
+    object_id = _column("object_id")
+    obj_type = _column("obj_type")
     # ra in degrees, J2000
-    ra: float = field(default=0.0)
+    ra = _column("ra")
     # dec in degrees, J2000
-    dec: float = field(default=0.0)
-    const: str = field(default="")
-    size: str = field(default="")
-    mag: str = field(default="")
-    catalog_code: str = field(default="")
+    dec = _column("dec")
+    const = _column("const")
+    size = _column("size")
+    mag = _column("mag")
+    catalog_code = _column("catalog_code")
     # we want catalogs of M and NGC etc, so sequence should be a name like M 31
     # deduplicated from names. Catalog code stays, because this collection of
     # things has a name
-    sequence: int = field(default=0)
-    description: str = field(default="")
-    names: list = field(default_factory=list)
-    image_name: str = field(default="")
-    logged: bool = field(default=False)
+    sequence = _column("sequence")
+    description = _column("description")
+    names = _column("names")
+    image_name = _column("image_name")
+    logged = _column("logged")
+
+    def __init__(self, **fields):
+        self._store = CatalogStore.from_rows([fields])
+        self._row = 0
+
+    @classmethod
+    def view(cls, store: CatalogStore, row: int) -> "CompositeObject":
+        obj = cls.__new__(cls)
+        obj._store = store
+        obj._row = row
+        return obj
+
+    @property
+    def store(self) -> CatalogStore:
+        return self._store
+
+    @property
+    def row(self) -> int:
+        return self._row
 
     @classmethod
     def from_dict(cls, d):
         return cls(**d)
+
+    def to_dict(self) -> dict:
+        return self._store.row_dict(self._row)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={v!r}" for k, v in self.to_dict().items())
+        return f"CompositeObject({fields})"
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(**state)
@@ -17,17 +17,27 @@ class Config:
         self.config_file_path = Path(utils.data_dir, "config.json")
 
         self.default_file_path = Path(cwd, "../default_config.json")
+        self.reload()
+
+        # open default default_config
+        with open(self.default_file_path, "r") as config_file:
+            self._default_config_dict = json.load(config_file)
+
+    def reload(self):
+        """
+        re-reads the config file, other processes
+        keep their own Config and write to it too
+        """
         if not os.path.exists(self.config_file_path):
             self._config_dict = {}
         else:
             with open(self.config_file_path, "r") as config_file:
                 self._config_dict = json.load(config_file)
 
-        # open default default_config
-        with open(self.default_file_path, "r") as config_file:
-            self._default_config_dict = json.load(config_file)
-
     def set_option(self, option, value):
+        # start from the file so options set by
+        # other processes aren't written back
+        self.reload()
         self._config_dict[option] = value
         with open(self.config_file_path, "w") as config_file:
             json.dump(self._config_dict, config_file, indent=4)
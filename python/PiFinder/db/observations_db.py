@@ -1,6 +1,7 @@
 import json
+import weakref
 from pathlib import Path
-from typing import Tuple
+from typing import Callable, Dict, List, Set, Tuple
 from sqlite3 import Connection, Cursor, Error
 from PiFinder.db.db import Database
 import PiFinder.utils as utils
@@ -8,6 +9,10 @@ from PiFinder.composite_object import CompositeObject
 
 
 class ObservationsDatabase(Database):
+    # weak references to (catalog, sequence) callbacks
+    # run after every log_object in this process
+    log_listeners: List[weakref.WeakMethod] = []
+
     def __init__(self, db_path: Path = utils.observations_db):
         new_db = False
         if not db_path.exists():
@@ -87,6 +92,15 @@ class ObservationsDatabase(Database):
         )
         self.conn.commit()
 
+    @classmethod
+    def add_log_listener(cls, listener: Callable[[str, int], None]):
+        """
+        Calls the bound method listener with catalog
+        and sequence of every object logged from now on.
+        Only held weakly, it goes away with its object
+        """
+        cls.log_listeners.append(weakref.WeakMethod(listener))
+
     def log_object(self, session_uuid, obs_time, catalog, sequence, solution, notes):
         q = """
             INSERT INTO obs_objects(
@@ -124,6 +138,16 @@ class ObservationsDatabase(Database):
         observation_id = self.cursor.execute(
             "select last_insert_rowid() as id"
         ).fetchone()["id"]
+
+        if self.observed_objects_cache is not None:
+            self.observed_objects_cache.add((catalog, sequence))
+        live_listeners = []
+        for listener_ref in ObservationsDatabase.log_listeners:
+            listener = listener_ref()
+            if listener is not None:
+                listener(catalog, sequence)
+                live_listeners.append(listener_ref)
+        ObservationsDatabase.log_listeners[:] = live_listeners
         return observation_id
 
     def get_observed_objects(self):
@@ -142,9 +166,21 @@ class ObservationsDatabase(Database):
         """
         (re)Loads the logged object cache
         """
-        self.observed_objects_cache = [
+        self.observed_objects_cache = {
             (x["catalog"], x["sequence"]) for x in self.get_observed_objects()
-        ]
+        }
+
+    def get_observed_sequences(self) -> Dict[str, Set[int]]:
+        """
+        Observed sequences for each catalog code
+        """
+        if self.observed_objects_cache == None:
+            self.load_observed_objects_cache()
+
+        observed: Dict[str, Set[int]] = {}
+        for catalog, sequence in self.observed_objects_cache:
+            observed.setdefault(catalog, set()).add(sequence)
+        return observed
 
     def check_logged(self, obj_record: CompositeObject):
         """
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+This module holds the shared memory frame ring
+* The camera process writes each new frame into
+  the next slot of the ring
+* Solver / Preview read the latest frame as a
+  numpy view into shared memory, no copying or
+  pickling through the manager process
+
+"""
+import numpy as np
+from multiprocessing import shared_memory
+from PIL import Image
+from typing import Optional, Tuple
+
+# Per slot metadata, stored as float64
+META_SEQ = 0
+META_EXPOSURE_START = 1
+META_EXPOSURE_END = 2
+META_IMU_DELTA = 3
+META_IMU_VALID = 4
+META_IMU_POS = 5  # 3 values
+META_IMU_QUAT = 8  # 4 values
+META_LEN = 12
+
+# Header is a single int64, the sequence number of the latest
+# complete frame
+HEADER_BYTES = 8
+
+
+class FrameRing:
+    """
+    Ring buffer of N uint8 frames in shared memory
+
+    Each slot has a sequence number and the same metadata
+    the camera used to publish through the shared state
+    (exposure_start/end, imu, imu_delta).
+
+    Readers get numpy views into the ring.  A view stays valid
+    until the writer wraps around and reuses the slot, which
+    can be checked with is_current(seq).
+    """
+
+    def __init__(
+        self,
+        slots: int = 4,
+        shape: Tuple[int, int] = (512, 512),
+        name: Optional[str] = None,
+    ):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self._owner = name is None
+        frame_bytes = self.shape[0] * self.shape[1]
+        meta_bytes = slots * META_LEN * 8
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=HEADER_BYTES + meta_bytes + slots * frame_bytes
+            )
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        buf = self._shm.buf
+        self._header = np.ndarray((1,), dtype=np.int64, buffer=buf)
+        self._meta = np.ndarray(
+            (slots, META_LEN), dtype=np.float64, buffer=buf, offset=HEADER_BYTES
+        )
+        self._frames = np.ndarray(
+            (slots,) + self.shape,
+            dtype=np.uint8,
+            buffer=buf,
+            offset=HEADER_BYTES + meta_bytes,
+        )
+        if self._owner:
+            self._header[0] = -1
+            self._meta[:] = 0
+            self._meta[:, META_SEQ] = -1
+            self._frames[:] = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def __getstate__(self):
+        # Only the shared memory name goes across process
+        # boundaries, the reader re-attaches to the same block
+        return {"name": self._shm.name, "slots": self.slots, "shape": self.shape}
+
+    def __setstate__(self, state):
+        self.__init__(state["slots"], state["shape"], name=state["name"])
+
+    def put(self, image, metadata: dict) -> int:
+        """
+        Writes a frame (PIL image or numpy array) into
+        the next slot.  Returns the new sequence number
+        """
+        if isinstance(image, Image.Image):
+            image = np.asarray(image.convert("L"))
+
+        seq = int(self._header[0]) + 1
+        slot = seq % self.slots
+        meta = self._meta[slot]
+
+        # mark slot as being written
+        meta[META_SEQ] = -1
+        frame = self._frames[slot]
+        if image.shape == self.shape:
+            np.copyto(frame, image)
+        else:
+            # Smaller images (camera_none) go in the top left
+            # the same way Image.paste used to place them
+            frame[:] = 0
+            h = min(image.shape[0], self.shape[0])
+            w = min(image.shape[1], self.shape[1])
+            frame[:h, :w] = image[:h, :w]
+
+        meta[META_EXPOSURE_START] = metadata["exposure_start"]
+        meta[META_EXPOSURE_END] = metadata["exposure_end"]
+        meta[META_IMU_DELTA] = metadata["imu_delta"]
+        imu = metadata.get("imu")
+        if imu and imu.get("pos") is not None:
+            meta[META_IMU_VALID] = 1
+            meta[META_IMU_POS : META_IMU_POS + 3] = imu["pos"]
+            meta[META_IMU_QUAT : META_IMU_QUAT + 4] = imu.get("quat") or 0
+        else:
+            meta[META_IMU_VALID] = 0
+
+        meta[META_SEQ] = seq
+        self._header[0] = seq
+        return seq
+
+    def latest_seq(self) -> int:
+        return int(self._header[0])
+
+    def is_current(self, seq: int) -> bool:
+        """
+        True if the slot for seq has not been
+        overwritten since it was read
+        """
+        return seq >= 0 and int(self._meta[seq % self.slots, META_SEQ]) == seq
+
+    def metadata(self, seq: Optional[int] = None) -> dict:
+        """
+        Returns the metadata dict for seq, or the
+        latest frame if seq is None.  Same layout as
+        the old last_image_metadata
+        """
+        if seq is None:
+            seq = self.latest_seq()
+        if seq < 0:
+            return {
+                "exposure_start": 0,
+                "exposure_end": 0,
+                "imu": None,
+                "imu_delta": 0,
+            }
+        meta = self._meta[seq % self.slots]
+        imu = None
+        if meta[META_IMU_VALID]:
+            imu = {
+                "pos": meta[META_IMU_POS : META_IMU_POS + 3].tolist(),
+                "quat": meta[META_IMU_QUAT : META_IMU_QUAT + 4].tolist(),
+            }
+        return {
+            "exposure_start": float(meta[META_EXPOSURE_START]),
+            "exposure_end": float(meta[META_EXPOSURE_END]),
+            "imu": imu,
+            "imu_delta": float(meta[META_IMU_DELTA]),
+        }
+
+    def latest(self) -> Tuple[int, np.ndarray, dict]:
+        """
+        Returns (seq, frame, metadata) for the
+        latest frame.  frame is a read-only view into
+        shared memory, no copy is made
+        """
+        seq = self.latest_seq()
+        frame = self._frames[max(seq, 0) % self.slots]
+        frame = frame.view()
+        frame.flags.writeable = False
+        return seq, frame, self.metadata(seq)
+
+    def latest_image(self) -> Image.Image:
+        """
+        Returns a PIL image sharing memory
+        with the latest frame
+        """
+        _, frame, _ = self.latest()
+        return Image.frombuffer("L", self.shape[::-1], frame, "raw", "L", 0, 1)
+
+    def copy(self) -> Image.Image:
+        """
+        Returns a PIL image copy of the latest frame
+        that is safe to hold on to
+        """
+        _, frame, _ = self.latest()
+        return Image.fromarray(frame.copy())
+
+    def close(self):
+        self._header = None
+        self._meta = None
+        self._frames = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+This module holds the Hipparcos star catalog
+* hip_main.dat is parsed once and saved as a
+  numpy record file next to it
+* Every later load memory maps that file, so
+  processes share the pages and skip pandas parsing
+
+"""
+import os
+import logging
+import numpy as np
+import pandas
+from pathlib import Path
+from typing import Optional
+
+from skyfield.api import load
+from skyfield.data import hipparcos
+
+from PiFinder import utils
+
+HIP_DTYPE = np.dtype(
+    [
+        ("hip", np.int64),
+        ("magnitude", np.float64),
+        ("ra_degrees", np.float64),
+        ("dec_degrees", np.float64),
+        ("parallax_mas", np.float64),
+        ("ra_mas_per_year", np.float64),
+        ("dec_mas_per_year", np.float64),
+    ]
+)
+# Epoch of the Hipparcos positions
+HIP_EPOCH = 1991.25
+
+hip_dat_path = Path(utils.astro_data_dir, "hip_main.dat")
+hip_npy_path = Path(utils.astro_data_dir, "hip_main.npy")
+
+
+def compile_stars(dat_path: Path = hip_dat_path, npy_path: Path = hip_npy_path):
+    """
+    Parses hip_main.dat and writes the record file
+    """
+    with load.open(str(dat_path)) as f:
+        df = hipparcos.load_dataframe(f)
+
+    records = np.zeros(len(df), dtype=HIP_DTYPE)
+    records["hip"] = df.index
+    for name in HIP_DTYPE.names[1:]:
+        records[name] = df[name]
+
+    # write aside and rename so other processes never
+    # map a half written file
+    tmp_path = npy_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, records)
+    os.replace(tmp_path, npy_path)
+    logging.info(f"Compiled {len(records)} Hipparcos stars to {npy_path}")
+
+
+def load_records(
+    dat_path: Path = hip_dat_path, npy_path: Path = hip_npy_path
+) -> np.ndarray:
+    """
+    Memory mapped star records, compiled from
+    hip_main.dat first if needed
+    """
+    if (
+        not npy_path.exists()
+        or npy_path.stat().st_mtime < Path(dat_path).stat().st_mtime
+    ):
+        compile_stars(dat_path, npy_path)
+    return np.load(npy_path, mmap_mode="r")
+
+
+def load_dataframe(
+    max_magnitude: Optional[float] = None,
+    dat_path: Path = hip_dat_path,
+    npy_path: Path = hip_npy_path,
+) -> pandas.DataFrame:
+    """
+    Same layout as skyfield's hipparcos.load_dataframe,
+    optionally only stars up to max_magnitude
+    """
+    records = load_records(dat_path, npy_path)
+    if max_magnitude is not None:
+        records = records[records["magnitude"] <= max_magnitude]
+
+    df = pandas.DataFrame(
+        {name: records[name] for name in HIP_DTYPE.names[1:]},
+        index=pandas.Index(records["hip"], name="hip"),
+    )
+    return df.assign(ra_hours=df["ra_degrees"] / 15.0, epoch_year=HIP_EPOCH)
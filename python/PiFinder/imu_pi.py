@@ -2,10 +2,15 @@
 # -*- coding:utf-8 -*-
 """
 This module is for IMU related functions
+* Samples the BNO055 at IMU_SAMPLE_RATE
+* Every accepted sample goes into the shared
+  IMU ring with its timestamp
+* Movement start/stop is published as imu_data
 
 """
 from pprint import pprint
 import time
+from collections import deque
 import board
 import adafruit_bno055
 
@@ -15,6 +20,8 @@ from PiFinder import config
 
 QUEUE_LEN = 10
 MOVE_CHECK_LEN = 2
+# The BNO055 fusion output runs at 100Hz
+IMU_SAMPLE_RATE = 100
 
 
 class Imu:
@@ -42,7 +49,7 @@ class Imu:
                 adafruit_bno055.AXIS_REMAP_POSITIVE,
                 adafruit_bno055.AXIS_REMAP_POSITIVE,
             )
-        self.quat_history = [(0, 0, 0, 0)] * QUEUE_LEN
+        self.quat_history = deque([(0, 0, 0, 0)] * QUEUE_LEN, maxlen=QUEUE_LEN)
         self._flip_count = 0
         self.calibration = 0
         self.avg_quat = (0, 0, 0, 0)
@@ -51,7 +58,7 @@ class Imu:
         self.last_sample_time = time.time()
 
         # Calibration settings
-        self.imu_sample_frequency = 1 / 30
+        self.imu_sample_frequency = 1 / IMU_SAMPLE_RATE
 
         # First value is delta to exceed between samples
         # to start moving, second is threshold to fall below
@@ -76,10 +83,18 @@ class Imu:
         """
         return self.__moving
 
+    def next_sample_time(self):
+        return self.last_sample_time + self.imu_sample_frequency
+
     def update(self):
+        """
+        Takes a sample if one is due, returns True if
+        the sensor was read.  avg_quat holds the filtered
+        attitude, which noise/flips leave unchanged
+        """
         # check for update frequency
-        if time.time() - self.last_sample_time < self.imu_sample_frequency:
-            return
+        if time.time() < self.next_sample_time():
+            return False
 
         self.last_sample_time = time.time()
 
@@ -87,11 +102,13 @@ class Imu:
         self.calibration = self.sensor.calibration_status[1]
         if self.calibration == 0:
             print("NOIMU CAL")
-            return True
+            return False
         quat = self.sensor.quaternion
+        # stamp the reading when it came off the sensor
+        self.sample_time = time.time()
         if quat[0] == None:
             print("IMU: Failed to get sensor values")
-            return
+            return False
 
         _quat_diff = []
         for i in range(4):
@@ -105,7 +122,7 @@ class Imu:
         # by exactly this amount... so filter this out
         if self.__reading_diff == 0.0078125:
             self.__reading_diff = 0
-            return
+            return True
 
         # Sometimes the quat output will 'flip' and change by 2.0+
         # from one reading to another.  This is clearly noise or an
@@ -117,18 +134,16 @@ class Imu:
                 # can get stuck seeing flips if the IMU starts
                 # returning data. This count will reset history
                 # to the current state if it exceeds 10
-                self.quat_history = [quat] * QUEUE_LEN
+                self.quat_history = deque([quat] * QUEUE_LEN, maxlen=QUEUE_LEN)
                 self.__reading_diff = 0
             else:
                 self.__reading_diff = 0
-                return
+                return True
         else:
             # no flip
             self._flip_count = 0
 
         self.avg_quat = quat
-        if len(self.quat_history) == QUEUE_LEN:
-            self.quat_history = self.quat_history[1:]
         self.quat_history.append(quat)
 
         if self.__moving:
@@ -137,6 +152,7 @@ class Imu:
         else:
             if self.__reading_diff > self.__moving_threshold[0]:
                 self.__moving = True
+        return True
 
     def get_euler(self):
         return list(self.quat_to_euler(self.avg_quat))
@@ -145,16 +161,23 @@ class Imu:
 def imu_monitor(shared_state, console_queue):
     imu = Imu()
     imu_calibrated = False
+    last_imu_data = None
     imu_data = {
         "moving": False,
         "move_start": None,
         "move_end": None,
         "pos": [0, 0, 0],
         "start_pos": [0, 0, 0],
+        "quat": [0, 0, 0, 0],
         "status": 0,
     }
+    imu_ring = shared_state.imu_ring() if shared_state != None else None
     while True:
-        imu.update()
+        # sleep until the next sample is due rather than spin
+        time.sleep(max(0, imu.next_sample_time() - time.time()))
+        sampled = imu.update()
+        if sampled and imu_ring is not None and imu_calibrated and any(imu.avg_quat):
+            imu_ring.put(imu.sample_time, imu.avg_quat)
         imu_data["status"] = imu.calibration
         if imu.moving():
             if imu_data["moving"] == False:
@@ -163,12 +186,14 @@ def imu_monitor(shared_state, console_queue):
                 imu_data["start_pos"] = imu_data["pos"]
                 imu_data["move_start"] = time.time()
             imu_data["pos"] = imu.get_euler()
+            imu_data["quat"] = list(imu.avg_quat)
         else:
             if imu_data["moving"] == True:
                 # If wer were moving and we now stopped
                 # print("IMU: move end")
                 imu_data["moving"] = False
                 imu_data["pos"] = imu.get_euler()
+                imu_data["quat"] = list(imu.avg_quat)
                 imu_data["move_end"] = time.time()
 
         if imu_calibrated == False:
@@ -177,4 +202,7 @@ def imu_monitor(shared_state, console_queue):
                 console_queue.put("IMU: NDOF Calibrated!")
 
         if shared_state != None and imu_calibrated:
-            shared_state.set_imu(imu_data)
+            # only publish changes, each write wakes the integrator
+            if imu_data != last_imu_data:
+                shared_state.set_imu(imu_data)
+                last_imu_data = imu_data.copy()
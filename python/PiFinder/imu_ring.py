@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+This module holds the shared memory IMU ring
+* The IMU process writes every sample with its
+  timestamp into the next slot
+* Readers look up the attitude at any recent
+  time, interpolating between the samples either
+  side instead of taking the last reading
+
+"""
+import numpy as np
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+# Per slot values, stored as float64
+SAMPLE_SEQ = 0
+SAMPLE_TIME = 1
+SAMPLE_QUAT = 2  # 4 values, BNO055 order w, x, y, z
+SAMPLE_LEN = 6
+
+HEADER_BYTES = 8
+
+# Past the newest sample we hold the last attitude this long
+MAX_HOLD = 0.1
+
+
+def slerp(quat_a, quat_b, fraction):
+    """
+    Spherical interpolation between two (w, x, y, z) quaternions
+    """
+    quat_a = np.asarray(quat_a, dtype=np.float64)
+    quat_b = np.asarray(quat_b, dtype=np.float64)
+    dot = float(np.dot(quat_a, quat_b))
+    if dot < 0:
+        # same rotation, take the short way round
+        quat_b = -quat_b
+        dot = -dot
+    if dot > 0.9995:
+        result = quat_a + fraction * (quat_b - quat_a)
+    else:
+        theta = np.arccos(dot)
+        result = (
+            np.sin((1 - fraction) * theta) * quat_a + np.sin(fraction * theta) * quat_b
+        ) / np.sin(theta)
+    return result / np.linalg.norm(result)
+
+
+class ImuRing:
+    """
+    Ring buffer of timestamped IMU quaternions in
+    shared memory with a single writer.
+
+    A slot's seq is set to -1 while it is written,
+    readers copy the ring and drop those slots.
+    """
+
+    def __init__(self, slots: int = 1024, name: Optional[str] = None):
+        self.slots = slots
+        self._owner = name is None
+        size = HEADER_BYTES + slots * SAMPLE_LEN * 8
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        buf = self._shm.buf
+        self._header = np.ndarray((1,), dtype=np.int64, buffer=buf)
+        self._samples = np.ndarray(
+            (slots, SAMPLE_LEN), dtype=np.float64, buffer=buf, offset=HEADER_BYTES
+        )
+        if self._owner:
+            self._header[0] = -1
+            self._samples[:] = 0
+            self._samples[:, SAMPLE_SEQ] = -1
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def __getstate__(self):
+        return {"name": self._shm.name, "slots": self.slots}
+
+    def __setstate__(self, state):
+        self.__init__(state["slots"], name=state["name"])
+
+    def put(self, sample_time: float, quat) -> int:
+        seq = int(self._header[0]) + 1
+        sample = self._samples[seq % self.slots]
+        sample[SAMPLE_SEQ] = -1
+        sample[SAMPLE_TIME] = sample_time
+        sample[SAMPLE_QUAT : SAMPLE_QUAT + 4] = quat
+        sample[SAMPLE_SEQ] = seq
+        self._header[0] = seq
+        return seq
+
+    def latest_seq(self) -> int:
+        return int(self._header[0])
+
+    def samples(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (times, quats) of every complete
+        sample in the ring, oldest first
+        """
+        samples = self._samples.copy()
+        # drop slots written to while we copied
+        unchanged = samples[:, SAMPLE_SEQ] == self._samples[:, SAMPLE_SEQ]
+        samples = samples[unchanged & (samples[:, SAMPLE_SEQ] >= 0)]
+        samples = samples[np.argsort(samples[:, SAMPLE_SEQ])]
+        return samples[:, SAMPLE_TIME], samples[:, SAMPLE_QUAT : SAMPLE_QUAT + 4]
+
+    def quat_at(self, at_time: float) -> Optional[list]:
+        """
+        The attitude at at_time as a (w, x, y, z) list.
+        None if at_time is older than the ring or
+        too far past the newest sample
+        """
+        times, quats = self.samples()
+        if len(times) == 0 or at_time < times[0]:
+            return None
+        if at_time >= times[-1]:
+            if at_time - times[-1] > MAX_HOLD:
+                return None
+            return quats[-1].tolist()
+
+        after = int(np.searchsorted(times, at_time, side="right"))
+        before = after - 1
+        span = times[after] - times[before]
+        fraction = 0 if span <= 0 else (at_time - times[before]) / span
+        return slerp(quats[before], quats[after], fraction).tolist()
+
+    def close(self):
+        self._header = None
+        self._samples = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
@@ -6,17 +6,19 @@ This module is the solver
 * Plate solves high-res image
 
 """
-import queue
 import time
 import copy
 import logging
 
 from PiFinder import config
-from PiFinder import utils
+from PiFinder import attitude
 import PiFinder.calc_utils as calc_utils
 
-IMU_ALT = 2
-IMU_AZ = 0
+# Longest the integrator sleeps without an IMU reading or solve
+UPDATE_TIMEOUT = 1.0
+# The power state is a manager call, it's read at most this
+# often rather than on every IMU update
+POWER_STATE_SECONDS = 1.0
 
 
 def imu_moved(imu_a, imu_b):
@@ -56,31 +58,43 @@ def integrator(shared_state, solver_queue, console_queue, is_debug=False):
             "cam_solve_time": 0,
             "constellation": None,
         }
-        cfg = config.Config()
-        if (
-            cfg.get_option("screen_direction") == "left"
-            or cfg.get_option("screen_direction") == "flat"
-        ):
-            flip_alt_offset = True
-        else:
-            flip_alt_offset = False
-
         # This holds the last image solve position info
         # so we can delta for IMU updates
         last_image_solve = None
+        cfg = config.Config()
+        attitude_filter = attitude.AttitudeFilter(
+            attitude.imu_boresight(cfg.get_option("screen_direction"))
+        )
         last_solved = None
         last_solve_time = time.time()
+        power_state = 1
+        power_state_time = 0.0
         while True:
-            utils.sleep_for_framerate(shared_state)
-
-            # Check for new camera solve in queue
+            # Only throttles while the unit is asleep,
+            # otherwise wait for a new IMU reading or solve
+            if time.time() - power_state_time > POWER_STATE_SECONDS:
+                power_state = shared_state.power_state()
+                power_state_time = time.time()
+            if power_state <= 0:
+                time.sleep(0.5)
+            shared_state.wait_for_update(timeout=UPDATE_TIMEOUT)
+
+            # Check for new camera solve in queue, only the
+            # latest one matters
             next_image_solve = None
-            try:
-                next_image_solve = solver_queue.get(block=False)
-            except queue.Empty:
-                pass
-
-            if next_image_solve:
+            while not solver_queue.empty():
+                next_image_solve = solver_queue.get()
+
+            if next_image_solve and next_image_solve.get("solve_mode") == "reuse":
+                # Same frame content as the last solve, nothing
+                # new to fuse, just keep the fused solution fresh
+                if last_image_solve:
+                    solved = copy.copy(last_image_solve)
+                    solved["solve_time"] = next_image_solve["solve_time"]
+                    solved["cam_solve_time"] = next_image_solve["cam_solve_time"]
+                    solved["solve_source"] = "CAM"
+
+            elif next_image_solve:
                 solved = next_image_solve
 
                 # see if we can generate alt/az
@@ -97,7 +111,7 @@ def integrator(shared_state, solver_queue, console_queue, is_debug=False):
                         location["lon"],
                         location["altitude"],
                     )
-                    alt, az = calc_utils.sf_utils.radec_to_altaz(
+                    alt, az = calc_utils.sf_utils.observer_frame.radec_to_altaz(
                         solved["RA"],
                         solved["Dec"],
                         dt,
@@ -105,46 +119,30 @@ def integrator(shared_state, solver_queue, console_queue, is_debug=False):
                     solved["Alt"] = alt
                     solved["Az"] = az
 
+                    # weigh this solve against the IMU prediction
+                    solved |= attitude_filter.camera_update(
+                        solved,
+                        solved.get("imu_quat"),
+                        location["lat"],
+                        calc_utils.sf_utils.local_sidereal_time(dt, location["lon"]),
+                        solved.get("exposure_mid") or solved["cam_solve_time"],
+                    )
+
                 last_image_solve = copy.copy(solved)
                 solved["solve_source"] = "CAM"
 
-            # generate new solution by offsetting last camera solve
-            # if we don't have an alt/az solve
-            # we can't use the IMU
+            # generate new solution by rotating the last fused
+            # solve by the IMU rotation since.  Without alt/az
+            # there is no location/time to relate IMU to sky
             elif solved["Alt"]:
                 imu = shared_state.imu()
-                if imu:
-                    dt = shared_state.datetime()
-                    if last_image_solve and last_image_solve["Alt"]:
-                        # If we have alt, then we have
-                        # a position/time
-
-                        # calc new alt/az
-                        lis_imu = last_image_solve["imu_pos"]
-                        imu_pos = imu["pos"]
-                        if imu_moved(lis_imu, imu_pos):
-                            alt_offset = imu_pos[IMU_ALT] - lis_imu[IMU_ALT]
-                            if flip_alt_offset:
-                                alt_offset = ((alt_offset + 180) % 360 - 180) * -1
-                            else:
-                                alt_offset = (alt_offset + 180) % 360 - 180
-                            alt_upd = (last_image_solve["Alt"] - alt_offset) % 360
-
-                            az_offset = imu_pos[IMU_AZ] - lis_imu[IMU_AZ]
-                            az_offset = (az_offset + 180) % 360 - 180
-                            az_upd = (last_image_solve["Az"] + az_offset) % 360
-
-                            solved["Alt"] = alt_upd
-                            solved["Az"] = az_upd
-
-                            # Turn this into RA/DEC
-                            (
-                                solved["RA"],
-                                solved["Dec"],
-                            ) = calc_utils.sf_utils.altaz_to_radec(
-                                solved["Alt"], solved["Az"], dt
-                            )
-
+                if imu and last_image_solve and last_image_solve["Alt"]:
+                    if imu_moved(last_image_solve["imu_pos"], imu["pos"]):
+                        now = time.time()
+                        quat = shared_state.imu_ring().quat_at(now) or imu.get("quat")
+                        imu_solve = attitude_filter.update(quat, now)
+                        if imu_solve:
+                            solved |= imu_solve
                             solved["solve_time"] = time.time()
                             solved["solve_source"] = "IMU"
 
@@ -23,8 +23,8 @@ import logging
 import argparse
 import pickle
 from pathlib import Path
-from PIL import Image, ImageOps
-from multiprocessing import Process, Queue
+from PIL import ImageOps
+from multiprocessing import Process, Queue, SimpleQueue
 from multiprocessing.managers import BaseManager
 from timezonefinder import TimezoneFinder
 
@@ -54,6 +54,8 @@ from PiFinder.ui.config import UIConfig
 from PiFinder.ui.log import UILog
 
 from PiFinder.state import SharedStateObj, UIState
+from PiFinder.frame_ring import FrameRing
+from PiFinder.state_block import SharedStateBlock
 
 from PiFinder.image_util import (
     subtract_background,
@@ -163,7 +165,6 @@ class StateManager(BaseManager):
 
 StateManager.register("SharedState", SharedStateObj)
 StateManager.register("UIState", UIState)
-StateManager.register("NewImage", Image.new)
 
 
 def get_sleep_timeout(cfg):
@@ -226,7 +227,9 @@ def main(script_name=None, show_fps=False, verbose=False):
     keyboard_queue = Queue()
     gps_queue = Queue()
     camera_command_queue = Queue()
-    solver_queue = Queue()
+    # SimpleQueue puts are written before returning, so the
+    # integrator sees a solve as soon as it is notified
+    solver_queue = SimpleQueue()
     ui_queue = Queue()
 
     # init UI Modes
@@ -246,7 +249,9 @@ def main(script_name=None, show_fps=False, verbose=False):
     patch.apply()
 
     with StateManager() as manager:
-        shared_state = manager.SharedState()
+        # solution/imu/location/datetime are read from shared
+        # memory, everything else still goes through the manager
+        shared_state = SharedStateBlock(manager.SharedState())
         ui_state = manager.UIState()
         ui_state.set_show_fps(show_fps)
         ui_state.set_hint_timeout(cfg.get_option("hint_timeout"))
@@ -310,7 +315,7 @@ def main(script_name=None, show_fps=False, verbose=False):
 
         console.write("   Camera")
         console.update()
-        camera_image = manager.NewImage("RGB", (512, 512))
+        camera_image = FrameRing(slots=4, shape=(512, 512))
         image_process = Process(
             target=camera.get_images,
             args=(shared_state, camera_image, camera_command_queue, console_queue),
@@ -676,6 +681,14 @@ def main(script_name=None, show_fps=False, verbose=False):
                     for module in ui_modes:
                         module.background_update()
 
+                    # The solver learns the FOV, the config is written here
+                    solution = shared_state.solution()
+                    fov_estimate = solution.get("fov_estimate") if solution else None
+                    if solver.FovEstimator.needs_saving(
+                        fov_estimate, cfg.get_option("solver_fov")
+                    ):
+                        cfg.set_option("solver_fov", fov_estimate)
+
                 # check for coming out of power save...
                 if get_sleep_timeout(cfg) or get_screen_off_timeout(cfg):
                     # make sure that if there is a sleep
@@ -738,6 +751,11 @@ def main(script_name=None, show_fps=False, verbose=False):
 
             print("\tSolver...")
             solver_process.join()
+
+            camera_image.close()
+            camera_image.unlink()
+            shared_state.close()
+            shared_state.unlink()
             exit()
 
 
@@ -12,11 +12,12 @@ import pandas
 import time
 from pathlib import Path
 from PiFinder import utils
+from PiFinder import hip_stars
 from PIL import Image, ImageDraw, ImageFont, ImageChops, ImageOps
 
 from skyfield.api import Star, load, utc, Angle
 from skyfield.constants import GM_SUN_Pitjeva_2005_km3_s2 as GM_SUN
-from skyfield.data import hipparcos, mpc, stellarium
+from skyfield.data import mpc, stellarium
 from skyfield.projections import build_stereographic_projection
 from PiFinder.calc_utils import sf_utils
 
@@ -36,11 +37,6 @@ class Starfield:
 
         self.earth = sf_utils.earth
 
-        # The Hipparcos mission provides our star catalog.
-        hip_path = Path(utils.astro_data_dir, "hip_main.dat")
-        with load.open(str(hip_path)) as f:
-            self.raw_stars = hipparcos.load_dataframe(f)
-
         # constellations
         const_path = Path(utils.astro_data_dir, "constellationship.fab")
         with load.open(str(const_path)) as f:
@@ -65,10 +61,10 @@ class Starfield:
         ]
 
         self.set_mag_limit(mag_limit)
-        # Prefilter here for mag 9, just to make sure we have enough
+        # The Hipparcos mission provides our star catalog.
+        # Prefilter here for mag 7.5, just to make sure we have enough
         # for any plot.  Actual mag limit is enforced at plot time.
-        bright_stars = self.raw_stars.magnitude <= 7.5
-        self.stars = self.raw_stars[bright_stars].copy()
+        self.stars = hip_stars.load_dataframe(max_magnitude=7.5)
         self.star_positions = self.earth.at(self.t).observe(
             Star.from_dataframe(self.stars)
         )
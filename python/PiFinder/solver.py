@@ -6,42 +6,137 @@ This module is the solver
 * tries to solve them
 * If solved, emits solution into queue
 
+Extraction and solving run as a two stage pipeline:
+the extractor thread pulls frames from the frame ring
+and hands centroids to the solve loop through a
+queue that only holds the freshest frame.
+
+Between slews most frames are close to the previous
+one, so each frame is first checked against the last
+solve (see solver_tracking) before a blind solve.
+When the scope is parked and the frame has not changed
+at all, the last solution is re-issued without
+extracting or solving.
+
 """
 import numpy as np
 import time
+import queue
 import logging
 import sys
+import threading
 from time import perf_counter as precision_timestamp
 
 
+from PiFinder import config
 from PiFinder import utils
+from PiFinder import solver_tracking
+from PiFinder.solver_pipeline import (
+    put_latest,
+    bin_image,
+    binned_to_full,
+    FovEstimator,
+    ExtractionModeSelector,
+    FrameChangeDetector,
+    DEFAULT_FOV,
+    DEFAULT_FOV_MAX_ERROR,
+    DEFAULT_EXTRACT_MODE,
+)
+from PiFinder.cedar_detect import CedarDetect
 
 sys.path.append(str(utils.tetra3_dir))
 import PiFinder.tetra3.tetra3 as tetra3
-from PiFinder.tetra3.tetra3 import cedar_detect_client
 
+# Centroid sets waiting to be solved.  Anything older
+# than this is stale by the time the solver gets to it
+CENTROID_QUEUE_LEN = 1
 
-def solver(shared_state, solver_queue, camera_image, console_queue, is_debug=False):
-    logging.getLogger("tetra3.Tetra3").addHandler(logging.NullHandler())
-    logging.debug("Starting Solver")
-    t3 = tetra3.Tetra3(
-        str(utils.cwd_dir / "PiFinder/tetra3/tetra3/data/default_database.npz")
+
+def extract_centroids(np_image, cedar_detect, align=False, mode=DEFAULT_EXTRACT_MODE):
+    """
+    Returns the centroids for a frame, brightest first
+
+    mode is one of EXTRACT_MODES:
+    full: cedar-detect on the full frame
+    bin2: cedar-detect 2x2 binning (the original behaviour)
+    bin4: 2x2 bin here, then cedar-detect binning on top
+    """
+    if align:
+        # Use old tetr3 centroider to handle bloated/overexposed
+        # stars in alignment
+        return tetra3.get_centroids_from_image(np_image)
+    return extract_centroids_concurrent([np_image], cedar_detect, mode)[0]
+
+
+def extract_centroids_concurrent(np_images, cedar_detect, mode=DEFAULT_EXTRACT_MODE):
+    """
+    extract_centroids for a list of frames, sent to
+    cedar-detect concurrently, used to replay recorded frames
+    """
+    if mode == "bin4":
+        batch = cedar_detect.extract_concurrent(
+            [bin_image(np_image) for np_image in np_images],
+            sigma=8,
+            max_size=5,
+            use_binned=True,
+        )
+        return [binned_to_full(centroids, 2) for centroids in batch]
+    return cedar_detect.extract_concurrent(
+        np_images, sigma=8, max_size=10, use_binned=mode != "full"
     )
-    last_solve_time = 0
-    solved = {
-        "RA": None,
-        "Dec": None,
-        "imu_pos": None,
-        "solve_time": None,
-        "cam_solve_time": 0,
-    }
 
-    # Start cedar detext server
-    cedar_detect = cedar_detect_client.CedarDetectClient(
-        binary_path=str(utils.cwd_dir / "../bin/cedar-detect-server-")
-        + shared_state.arch()
+
+def solve_centroids(
+    t3,
+    centroids,
+    target_pixel,
+    fov_estimate=DEFAULT_FOV,
+    fov_max_error=DEFAULT_FOV_MAX_ERROR,
+):
+    """
+    Runs tetra3 on a set of centroids and
+    returns the trimmed solution dict
+    """
+    solution = t3.solve_from_centroids(
+        centroids,
+        (512, 512),
+        fov_estimate=fov_estimate,
+        fov_max_error=fov_max_error,
+        match_max_error=0.005,
+        return_matches=True,
+        target_pixel=target_pixel,
+        solve_timeout=1000,
     )
 
+    if "matched_centroids" in solution:
+        # Don't clutter printed solution with these fields.
+        # del solution['matched_centroids']
+        # del solution['matched_stars']
+        del solution["matched_catID"]
+        del solution["pattern_centroids"]
+        del solution["epoch_equinox"]
+        del solution["epoch_proper_motion"]
+        del solution["cache_hit_fraction"]
+    return solution
+
+
+def extractor(
+    shared_state,
+    frame_ring,
+    cedar_detect,
+    centroid_queue,
+    mode_selector,
+    change_detector,
+):
+    """
+    First pipeline stage, runs in its own thread.
+    Cedar-detect does the work in its own server process
+    so this overlaps with tetra3 solving the previous frame
+
+    Frames the change detector says are unchanged are
+    queued with centroids of None and not extracted
+    """
+    last_extract_time = 0
     try:
         while True:
             utils.sleep_for_framerate(shared_state)
@@ -49,75 +144,248 @@ def solver(shared_state, solver_queue, camera_image, console_queue, is_debug=Fal
             # use the time the exposure started here to
             # reject images started before the last solve
             # which might be from the IMU
-            last_image_metadata = shared_state.last_image_metadata()
+            frame_seq, np_image, last_image_metadata = frame_ring.latest()
             if (
-                last_image_metadata["exposure_end"] > (last_solve_time)
-                and last_image_metadata["imu_delta"] < 1
+                last_image_metadata["exposure_end"] <= last_extract_time
+                or last_image_metadata["imu_delta"] >= 1
             ):
-                img = camera_image.copy()
-                img = img.convert(mode="L")
-                np_image = np.asarray(img, dtype=np.uint8)
-
-                t0 = precision_timestamp()
-                if shared_state.camera_align():
-                    # Use old tetr3 centroider to handle bloated/overexposed
-                    # stars in alignment
-                    centroids = tetra3.get_centroids_from_image(np_image)
-                else:
-                    centroids = cedar_detect.extract_centroids(
-                        np_image, sigma=8, max_size=10, use_binned=True
-                    )
-
-                t_extract = (precision_timestamp() - t0) * 1000
-                logging.debug(
-                    "File %s, extracted %d centroids in %.2fms"
-                    % ("camera", len(centroids), t_extract)
+                continue
+            last_extract_time = last_image_metadata["exposure_end"]
+
+            thumbnail = change_detector.thumbnail(np_image)
+            if not frame_ring.is_current(frame_seq):
+                continue
+            if change_detector.unchanged(thumbnail, last_image_metadata, time.time()):
+                put_latest(
+                    centroid_queue, (last_image_metadata, None, 0, None, thumbnail)
+                )
+                continue
+
+            # np_image is a read-only view into the frame ring.
+            # If the camera laps us during extraction the
+            # centroids are thrown away below
+            extract_mode = mode_selector.mode
+            t0 = precision_timestamp()
+            centroids = extract_centroids(
+                np_image, cedar_detect, shared_state.camera_align(), extract_mode
+            )
+            t_extract = (precision_timestamp() - t0) * 1000
+            mode_selector.record_extract(extract_mode, t_extract)
+
+            if not frame_ring.is_current(frame_seq):
+                logging.debug("Frame %d overwritten during extraction" % frame_seq)
+                continue
+            logging.debug(
+                "File %s, extracted %d centroids in %.2fms"
+                % ("camera", len(centroids), t_extract)
+            )
+
+            if len(centroids) == 0:
+                # logging.debug("No stars found, skipping")
+                shared_state.set_solve_quality(
+                    {
+                        "exposure_start": last_image_metadata["exposure_start"],
+                        "solved": False,
+                        "centroids": 0,
+                        "T_extract": t_extract,
+                    }
                 )
+                continue
+
+            put_latest(
+                centroid_queue,
+                (last_image_metadata, centroids, t_extract, extract_mode, thumbnail),
+            )
+    except (BrokenPipeError, EOFError):
+        logging.error("Main no longer running for solver extractor")
+    except Exception as e:
+        logging.error("Solver extractor exception %s", e)
+
+
+class FrameSolver:
+    """
+    Turns a set of centroids into a solution and keeps
+    what carries over from frame to frame: the last solve
+    for tracking, the FOV estimate and the extraction mode.
+    Used by the solver process and the benchmark harness.
+    """
+
+    def __init__(self, t3, saved_fov=None, tracking=True):
+        self.t3 = t3
+        self.tracking = tracking
+        self.fov_estimator = FovEstimator(saved_fov)
+        self.mode_selector = ExtractionModeSelector()
+
+        # Last good camera solve (image center, not target pixel)
+        # used as the starting point for tracking solves
+        self.last_solve = None
 
-                if len(centroids) == 0:
-                    # logging.debug("No stars found, skipping")
-                    continue
-                else:
-                    solution = t3.solve_from_centroids(
-                        centroids,
-                        (512, 512),
-                        fov_estimate=12.0,
-                        fov_max_error=4.0,
-                        match_max_error=0.005,
-                        return_matches=True,
-                        target_pixel=shared_state.solve_pixel(),
-                        solve_timeout=1000,
-                    )
-
-                    if "matched_centroids" in solution:
-                        # Don't clutter printed solution with these fields.
-                        # del solution['matched_centroids']
-                        # del solution['matched_stars']
-                        del solution["matched_catID"]
-                        del solution["pattern_centroids"]
-                        del solution["epoch_equinox"]
-                        del solution["epoch_proper_motion"]
-                        del solution["cache_hit_fraction"]
-
-                solved |= solution
-
-                total_tetra_time = t_extract + solved["T_solve"]
-                if total_tetra_time > 1000:
-                    console_queue.put(f"SLV: Long: {total_tetra_time}")
+    def solve(self, centroids, image_metadata, target_pixel, extract_mode):
+        frame_imu_pos = None
+        frame_imu_quat = None
+        if image_metadata["imu"]:
+            frame_imu_pos = image_metadata["imu"]["pos"]
+            frame_imu_quat = image_metadata["imu"].get("quat")
 
+        # Try to follow the stars from the last solve first,
+        # only fall back to a blind solve if that fails
+        solution = None
+        if self.tracking and self.last_solve is not None:
+            solution = solver_tracking.track(
+                self.last_solve,
+                centroids,
+                (512, 512),
+                target_pixel,
+                solver_tracking.imu_delta(self.last_solve["imu_pos"], frame_imu_pos),
+            )
+        if solution is not None:
+            solution["solve_mode"] = "track"
+        else:
+            # Only hand tetra3 as many of the brightest
+            # stars as recent solves have needed
+            solution = solve_centroids(
+                self.t3,
+                centroids[: self.mode_selector.brightest_k],
+                target_pixel,
+                self.fov_estimator.fov_estimate,
+                self.fov_estimator.fov_max_error,
+            )
+            solution["solve_mode"] = "blind"
+            if solution["RA"] is not None:
+                self.fov_estimator.update(solution["FOV"])
+            else:
+                self.fov_estimator.failed()
+
+        if solution["RA"] is not None:
+            if solution["solve_mode"] == "track":
+                # keep tracking the stars of the last blind solve,
+                # not just the ones this frame happened to match
+                self.last_solve = solver_tracking.carry_reference(
+                    self.last_solve, solution, (512, 512)
+                )
+            else:
+                self.last_solve = solution.copy()
+            self.last_solve["imu_pos"] = frame_imu_pos
+
+        self.mode_selector.record_solve(extract_mode, solution)
+        solution["imu_pos"] = frame_imu_pos
+        solution["imu_quat"] = frame_imu_quat
+        # the IMU quat is for this instant
+        solution["exposure_mid"] = (
+            image_metadata["exposure_start"] + image_metadata["exposure_end"]
+        ) / 2
+        solution["extract_mode"] = extract_mode
+        # passed on so the main process can save it
+        solution["fov_estimate"] = self.fov_estimator.learned_fov()
+        solution["T_extract_modes"] = dict(self.mode_selector.timings)
+        return solution
+
+
+def get_tetra3():
+    logging.getLogger("tetra3.Tetra3").addHandler(logging.NullHandler())
+    return tetra3.Tetra3(
+        str(utils.cwd_dir / "PiFinder/tetra3/tetra3/data/default_database.npz")
+    )
+
+
+def get_cedar_detect(arch):
+    # Start cedar detext server
+    return CedarDetect(str(utils.cwd_dir / "../bin/cedar-detect-server-") + arch)
+
+
+def solver(shared_state, solver_queue, frame_ring, console_queue, is_debug=False):
+    logging.debug("Starting Solver")
+    t3 = get_tetra3()
+    solved = {
+        "RA": None,
+        "Dec": None,
+        "imu_pos": None,
+        "solve_time": None,
+        "cam_solve_time": 0,
+    }
+
+    cedar_detect = get_cedar_detect(shared_state.arch())
+    frame_solver = FrameSolver(t3, config.Config().get_option("solver_fov"))
+    change_detector = FrameChangeDetector()
+
+    centroid_queue = queue.Queue(maxsize=CENTROID_QUEUE_LEN)
+    extractor_thread = threading.Thread(
+        target=extractor,
+        args=(
+            shared_state,
+            frame_ring,
+            cedar_detect,
+            centroid_queue,
+            frame_solver.mode_selector,
+            change_detector,
+        ),
+        daemon=True,
+    )
+    extractor_thread.start()
+
+    try:
+        while True:
+            try:
+                (
+                    last_image_metadata,
+                    centroids,
+                    t_extract,
+                    extract_mode,
+                    thumbnail,
+                ) = centroid_queue.get(timeout=1)
+            except queue.Empty:
+                if not extractor_thread.is_alive():
+                    logging.error("Solver extractor stopped")
+                    return
+                continue
+
+            if centroids is None:
+                # Same sky as the last solve, just re-issue it
                 if solved["RA"] is not None:
-                    # map the RA/DEC to the target pixel RA/DEC
-                    solved["RA"] = solved["RA_target"]
-                    solved["Dec"] = solved["Dec_target"]
-                    if last_image_metadata["imu"]:
-                        solved["imu_pos"] = last_image_metadata["imu"]["pos"]
-                    else:
-                        solved["imu_pos"] = None
+                    solved["solve_mode"] = "reuse"
                     solved["solve_time"] = time.time()
                     solved["cam_solve_time"] = solved["solve_time"]
-                    solver_queue.put(solved)
+                    # the next solve updates solved in place
+                    solver_queue.put(solved.copy())
+                    shared_state.notify()
+                continue
 
-                last_solve_time = last_image_metadata["exposure_end"]
+            solution = frame_solver.solve(
+                centroids,
+                last_image_metadata,
+                shared_state.solve_pixel(),
+                extract_mode,
+            )
+            solved |= solution
+            solved["T_extract"] = t_extract
+            shared_state.set_solve_quality(
+                {
+                    "exposure_start": last_image_metadata["exposure_start"],
+                    "solved": solution["RA"] is not None,
+                    "Matches": solution.get("Matches"),
+                    "RMSE": solution.get("RMSE"),
+                    "centroids": len(centroids),
+                    "T_extract": t_extract,
+                }
+            )
+
+            total_tetra_time = t_extract + solved["T_solve"]
+            if total_tetra_time > 1000:
+                console_queue.put(f"SLV: Long: {total_tetra_time}")
+
+            if solved["RA"] is not None:
+                # map the RA/DEC to the target pixel RA/DEC
+                solved["RA"] = solved["RA_target"]
+                solved["Dec"] = solved["Dec_target"]
+                solved["solve_time"] = time.time()
+                solved["cam_solve_time"] = solved["solve_time"]
+                change_detector.set_reference(
+                    thumbnail, solved["imu_pos"], solved["solve_time"]
+                )
+                solver_queue.put(solved)
+                shared_state.notify()
+            else:
+                change_detector.clear()
     except EOFError:
         logging.error("Main no longer running for solver")
     except Exception as e:
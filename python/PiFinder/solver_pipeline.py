@@ -0,0 +1,274 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+This module holds the solver pipeline helpers
+that don't need tetra3 or cedar-detect
+* put_latest, the hand over between the
+  extractor thread and the solve loop
+* FovEstimator, learns the FOV from blind solves
+* Image binning and the extraction mode selection
+* FrameChangeDetector, skips solving frames that
+  show the same sky as the last solve
+
+"""
+import queue
+import logging
+import numpy as np
+from collections import deque
+from typing import Optional
+
+from PiFinder import solver_tracking
+
+# Extraction modes, coarsest first
+EXTRACT_MODES = ["bin4", "bin2", "full"]
+DEFAULT_EXTRACT_MODE = "bin2"
+
+# Wide FOV search used until we have learned the real one
+DEFAULT_FOV = 12.0
+DEFAULT_FOV_MAX_ERROR = 4.0
+
+
+def put_latest(q: queue.Queue, item):
+    """
+    Puts item in a bounded queue, dropping
+    the oldest entries to make room
+    """
+    while True:
+        try:
+            q.put(item, block=False)
+            return
+        except queue.Full:
+            try:
+                q.get(block=False)
+            except queue.Empty:
+                pass
+
+
+class FovEstimator:
+    """
+    Keeps a running median of the FOV reported by
+    recent blind solves and narrows the FOV search
+    once the samples agree.
+
+    Starts from a saved estimate if there is one.
+    Saving is left to the process that owns the
+    config, see learned_fov and needs_saving
+    """
+
+    WINDOW = 20
+    MIN_SAMPLES = 5
+    # error used for a saved estimate
+    SAVED_MAX_ERROR = 1.0
+    MIN_MAX_ERROR = 0.25
+    # consecutive failed solves before going back to wide
+    MAX_FAILURES = 10
+    # only write the config if the estimate moved this much
+    SAVE_THRESHOLD = 0.05
+
+    def __init__(self, saved_fov: Optional[float] = None):
+        self.samples: deque = deque(maxlen=self.WINDOW)
+        self.failures = 0
+        if saved_fov:
+            self.fov_estimate = saved_fov
+            self.fov_max_error = self.SAVED_MAX_ERROR
+        else:
+            self.reset()
+
+    def reset(self):
+        self.samples.clear()
+        self.fov_estimate = DEFAULT_FOV
+        self.fov_max_error = DEFAULT_FOV_MAX_ERROR
+
+    def update(self, fov):
+        self.failures = 0
+        self.samples.append(fov)
+        if len(self.samples) < self.MIN_SAMPLES:
+            return
+
+        samples = np.array(self.samples)
+        median = float(np.median(samples))
+        # median absolute deviation, scaled to ~sigma
+        mad = float(np.median(np.abs(samples - median))) * 1.4826
+        self.fov_estimate = median
+        self.fov_max_error = min(
+            DEFAULT_FOV_MAX_ERROR, max(self.MIN_MAX_ERROR, mad * 4)
+        )
+
+    def failed(self):
+        self.failures += 1
+        if (
+            self.failures > self.MAX_FAILURES
+            and self.fov_max_error < DEFAULT_FOV_MAX_ERROR
+        ):
+            logging.info("Solver: FOV estimate not solving, widening search")
+            self.reset()
+            self.failures = 0
+
+    def learned_fov(self) -> Optional[float]:
+        """
+        The estimate once enough solves agree on it
+        """
+        if len(self.samples) < self.MIN_SAMPLES:
+            return None
+        return round(self.fov_estimate, 3)
+
+    @classmethod
+    def needs_saving(cls, fov: Optional[float], saved_fov: Optional[float]) -> bool:
+        return fov is not None and (
+            saved_fov is None or abs(saved_fov - fov) > cls.SAVE_THRESHOLD
+        )
+
+
+def bin_image(np_image, factor=2):
+    """
+    Sums factor x factor blocks, scaled back into uint8.
+    Odd rows/columns at the bottom/right are dropped
+    """
+    h = np_image.shape[0] // factor * factor
+    w = np_image.shape[1] // factor * factor
+    binned = (
+        np_image[:h, :w]
+        .reshape(h // factor, factor, w // factor, factor)
+        .sum(axis=(1, 3), dtype=np.uint32)
+    )
+    return (binned // (factor * factor)).astype(np.uint8)
+
+
+def binned_to_full(centroids, factor=2) -> np.ndarray:
+    """
+    Centroids found in a bin_image back to full frame
+    pixel coordinates.  Cedar-detect (and tetra3) put
+    the origin on the corner of the first pixel, so its
+    center is (0.5, 0.5) and binning is a pure scale
+    """
+    return np.asarray(centroids, dtype=np.float64).reshape(-1, 2) * factor
+
+
+class ExtractionModeSelector:
+    """
+    Picks the extraction mode for the next frame from
+    how the last frames solved.  A run of solves with
+    plenty of matches means we can bin harder, a run of
+    failed solves steps back toward full resolution.
+    Needing a run keeps single frames from flipping
+    the mode back and forth.
+
+    Also keeps how many of the brightest centroids the
+    last solve needed so the solver can skip the rest,
+    and a running average extract time per mode.
+    """
+
+    # Step to a coarser mode after this many solves
+    # in a row matched COARSEN_MATCHES stars
+    COARSEN_MATCHES = 25
+    COARSEN_AFTER = 5
+    # Step to a finer mode after this many failed solves in a row
+    REFINE_AFTER = 2
+    # Brightest K passed to the solver is this many times
+    # the last match count, but never below MIN_BRIGHTEST
+    BRIGHTEST_FACTOR = 2
+    MIN_BRIGHTEST = 20
+    # weight of the newest sample in the timing average
+    TIMING_ALPHA = 0.2
+
+    def __init__(self):
+        self.mode = DEFAULT_EXTRACT_MODE
+        self.brightest_k = None
+        self.timings = {}
+        # consecutive strong solves and failures
+        self._strong = 0
+        self._failed = 0
+
+    def record_extract(self, mode, t_extract):
+        if mode in self.timings:
+            t_extract = (
+                self.TIMING_ALPHA * t_extract
+                + (1 - self.TIMING_ALPHA) * self.timings[mode]
+            )
+        self.timings[mode] = t_extract
+
+    def _step(self, mode, direction):
+        index = EXTRACT_MODES.index(mode) + direction
+        self.mode = EXTRACT_MODES[min(max(index, 0), len(EXTRACT_MODES) - 1)]
+        self._strong = 0
+        self._failed = 0
+
+    def record_solve(self, mode, solution):
+        if solution["RA"] is None:
+            # give the solver every star
+            self.brightest_k = None
+        else:
+            matches = solution.get("Matches") or 0
+            self.brightest_k = max(self.MIN_BRIGHTEST, matches * self.BRIGHTEST_FACTOR)
+
+        if mode != self.mode:
+            # extracted before the last switch
+            return
+        if solution["RA"] is None:
+            self._strong = 0
+            self._failed += 1
+            if self._failed >= self.REFINE_AFTER:
+                self._step(mode, 1)
+            return
+        self._failed = 0
+        if (solution.get("Matches") or 0) >= self.COARSEN_MATCHES:
+            self._strong += 1
+            if self._strong >= self.COARSEN_AFTER:
+                self._step(mode, -1)
+        else:
+            self._strong = 0
+
+
+class FrameChangeDetector:
+    """
+    Cheap check for a frame that shows the same sky as
+    the last solved one: a small thumbnail is compared
+    by mean absolute difference and the IMU must not
+    have moved.
+
+    The reference is only moved on a real solve so slow
+    drift adds up and eventually forces a new solve, and
+    reuse is capped at MAX_REUSE_SECONDS as the sky keeps
+    turning under a parked scope.
+    """
+
+    # Frames are binned by this much for the thumbnail
+    THUMBNAIL_BIN = 16
+    # Mean abs diff (0-255) below which a frame is unchanged
+    MAX_MEAN_DIFF = 2.0
+    # Summed IMU euler delta (degrees) below which we haven't moved
+    MAX_IMU_DELTA = 0.05
+    MAX_REUSE_SECONDS = 5.0
+
+    def __init__(self):
+        # (thumbnail, imu_pos, solve time) of the last solve
+        self.reference = None
+
+    @classmethod
+    def thumbnail(cls, np_image):
+        return bin_image(np_image, cls.THUMBNAIL_BIN).astype(np.int16)
+
+    def set_reference(self, thumbnail, imu_pos, solve_time):
+        # single assignment so the extractor thread
+        # always sees a complete reference
+        self.reference = (thumbnail, imu_pos, solve_time)
+
+    def clear(self):
+        self.reference = None
+
+    def unchanged(self, thumbnail, image_metadata, now):
+        reference = self.reference
+        if reference is None:
+            return False
+        ref_thumbnail, ref_imu_pos, ref_time = reference
+        if now - ref_time > self.MAX_REUSE_SECONDS:
+            return False
+
+        frame_imu_pos = None
+        if image_metadata["imu"]:
+            frame_imu_pos = image_metadata["imu"]["pos"]
+        imu_delta = solver_tracking.imu_delta(ref_imu_pos, frame_imu_pos)
+        if imu_delta is not None and imu_delta > self.MAX_IMU_DELTA:
+            return False
+
+        return float(np.abs(thumbnail - ref_thumbnail).mean()) < self.MAX_MEAN_DIFF
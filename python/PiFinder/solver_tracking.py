@@ -0,0 +1,244 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+This module is the solver tracking mode
+* Takes the stars matched in the previous solve
+* Projects them into the new frame and looks for
+  the small shift the IMU says we could have moved
+* Refits the attitude from the matched pairs
+
+Vector and rotation conventions follow tetra3 so
+the RA/Dec/Roll produced here can be mixed freely
+with blind solves.
+
+"""
+import numpy as np
+from time import perf_counter as precision_timestamp
+from typing import Optional
+
+# Pixel distance for a centroid to count as the same star
+MATCH_TOLERANCE_PX = 3.0
+# Need at least this many matched stars to accept a track
+MIN_TRACK_MATCHES = 8
+# Reject tracks with a worse fit than this (arcsec)
+MAX_TRACK_RMSE = 120.0
+# Extra search radius on top of the IMU delta (degrees)
+SHIFT_MARGIN_DEG = 0.5
+# Larger motions than this go straight to the blind solver
+MAX_TRACK_SHIFT_DEG = 3.0
+
+
+def pixels_to_vectors(centroids, size, fov):
+    """
+    Unit vectors in the camera frame for (y, x)
+    pixel coordinates, boresight on +x like tetra3
+    """
+    centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 2)
+    height, width = size
+    scale_factor = np.tan(np.deg2rad(fov) / 2) / width * 2
+    vectors = np.ones((len(centroids), 3))
+    vectors[:, 2:0:-1] = (np.array([height / 2, width / 2]) - centroids) * scale_factor
+    return vectors / np.linalg.norm(vectors, axis=1)[:, None]
+
+
+def vectors_to_pixels(vectors, size, fov):
+    """
+    Inverse of pixels_to_vectors, returns (y, x)
+    """
+    height, width = size
+    scale_factor = np.tan(np.deg2rad(fov) / 2) / width * 2
+    plane = vectors[:, 1:3] / vectors[:, 0:1]
+    return np.array([height / 2, width / 2]) - plane[:, ::-1] / scale_factor
+
+
+def radec_to_vectors(ra, dec):
+    """
+    Unit vectors for arrays of ra/dec in degrees
+    """
+    ra = np.deg2rad(np.asarray(ra, dtype=np.float64))
+    dec = np.deg2rad(np.asarray(dec, dtype=np.float64))
+    return np.stack(
+        [np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1
+    )
+
+
+def find_rotation_matrix(image_vectors, catalog_vectors):
+    """
+    Least squares rotation with image = R @ catalog
+    """
+    H = np.dot(image_vectors.T, catalog_vectors)
+    U, _, V = np.linalg.svd(H)
+    rotation_matrix = np.dot(U, V)
+    if np.linalg.det(rotation_matrix) < 0:
+        U[:, -1] *= -1
+        rotation_matrix = np.dot(U, V)
+    return rotation_matrix
+
+
+def rotation_to_radec_roll(rotation_matrix):
+    ra = np.rad2deg(np.arctan2(rotation_matrix[0, 1], rotation_matrix[0, 0])) % 360
+    dec = np.rad2deg(
+        np.arctan2(rotation_matrix[0, 2], np.linalg.norm(rotation_matrix[1:3, 2]))
+    )
+    roll = np.rad2deg(np.arctan2(rotation_matrix[1, 2], rotation_matrix[2, 2])) % 360
+    return float(ra), float(dec), float(roll)
+
+
+def vector_to_radec(vector):
+    ra = np.rad2deg(np.arctan2(vector[1], vector[0])) % 360
+    dec = np.rad2deg(np.arcsin(np.clip(vector[2], -1, 1)))
+    return float(ra), float(dec)
+
+
+def imu_delta(imu_a, imu_b) -> Optional[float]:
+    """
+    Summed absolute euler difference in degrees, the
+    same measure the camera uses for imu_delta
+    """
+    if imu_a is None or imu_b is None:
+        return None
+    diff = 0
+    for a, b in zip(imu_a, imu_b):
+        diff += abs((a - b + 180) % 360 - 180)
+    return diff
+
+
+def _best_offset(predicted, centroids, max_shift_px):
+    """
+    Votes over all star/centroid pairs for the
+    translation that lines up the most of them
+    """
+    offsets = (centroids[None, :, :] - predicted[:, None, :]).reshape(-1, 2)
+    offsets = offsets[np.linalg.norm(offsets, axis=1) <= max_shift_px]
+    if len(offsets) == 0:
+        return None
+    dist = np.linalg.norm(offsets[:, None, :] - offsets[None, :, :], axis=2)
+    votes = (dist <= MATCH_TOLERANCE_PX).sum(axis=1)
+    best = np.argmax(votes)
+    if votes[best] < MIN_TRACK_MATCHES:
+        return None
+    return offsets[dist[best] <= MATCH_TOLERANCE_PX].mean(axis=0)
+
+
+def _match(predicted, centroids):
+    """
+    Greedy one to one nearest neighbour match,
+    returns index pairs (star, centroid)
+    """
+    dist = np.linalg.norm(predicted[:, None, :] - centroids[None, :, :], axis=2)
+    pairs = []
+    used_stars = set()
+    used_centroids = set()
+    for flat in np.argsort(dist, axis=None):
+        i, j = np.unravel_index(flat, dist.shape)
+        if dist[i, j] > MATCH_TOLERANCE_PX:
+            break
+        if i in used_stars or j in used_centroids:
+            continue
+        used_stars.add(i)
+        used_centroids.add(j)
+        pairs.append((i, j))
+    return pairs
+
+
+def carry_reference(reference, solution, size) -> dict:
+    """
+    Tracking reference for the next frame after a
+    tracking solve: solution with all the stars of
+    reference (normally the last blind solve) placed
+    where its attitude puts them, so the star set
+    doesn't shrink to what a single frame matched
+    """
+    fov = solution["FOV"]
+    matched = np.asarray(solution["matched_stars"], dtype=np.float64)
+    rotation = find_rotation_matrix(
+        pixels_to_vectors(solution["matched_centroids"], size, fov),
+        radec_to_vectors(matched[:, 0], matched[:, 1]),
+    )
+    stars = np.asarray(reference["matched_stars"], dtype=np.float64)
+    star_vectors = radec_to_vectors(stars[:, 0], stars[:, 1])
+    return solution | {
+        "matched_stars": reference["matched_stars"],
+        "matched_centroids": vectors_to_pixels(
+            star_vectors @ rotation.T, size, fov
+        ).tolist(),
+    }
+
+
+def track(previous, centroids, size, target_pixel, delta_deg=None) -> Optional[dict]:
+    """
+    Tries to verify the previous solution against
+    a new set of centroids.
+
+    previous is a solution dict as returned by tetra3
+    (center RA/Dec, FOV, matched_stars, matched_centroids).
+    delta_deg is how far the IMU thinks we moved since.
+
+    Returns a tetra3 style solution dict or None if
+    the previous stars can't be found in this frame
+    """
+    t0 = precision_timestamp()
+    if (
+        previous is None
+        or previous.get("RA") is None
+        or not previous.get("matched_stars")
+        or len(previous["matched_stars"]) < MIN_TRACK_MATCHES
+    ):
+        return None
+
+    shift_deg = (delta_deg if delta_deg is not None else 1.0) + SHIFT_MARGIN_DEG
+    if shift_deg > MAX_TRACK_SHIFT_DEG:
+        return None
+
+    fov = previous["FOV"]
+    centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 2)
+    if len(centroids) < MIN_TRACK_MATCHES:
+        return None
+    stars = np.asarray(previous["matched_stars"], dtype=np.float64)
+    star_vectors = radec_to_vectors(stars[:, 0], stars[:, 1])
+
+    # Previous attitude from the previous matches
+    prev_rotation = find_rotation_matrix(
+        pixels_to_vectors(previous["matched_centroids"], size, fov), star_vectors
+    )
+    predicted = vectors_to_pixels(star_vectors @ prev_rotation.T, size, fov)
+
+    max_shift_px = shift_deg / fov * size[1]
+    offset = _best_offset(predicted, centroids, max_shift_px)
+    if offset is None:
+        return None
+
+    pairs = _match(predicted + offset, centroids)
+    if len(pairs) < MIN_TRACK_MATCHES:
+        return None
+    star_idx = [p[0] for p in pairs]
+    centroid_idx = [p[1] for p in pairs]
+
+    image_vectors = pixels_to_vectors(centroids[centroid_idx], size, fov)
+    rotation = find_rotation_matrix(image_vectors, star_vectors[star_idx])
+
+    residual = np.einsum("ij,ij->i", image_vectors, star_vectors[star_idx] @ rotation.T)
+    rmse = float(
+        np.rad2deg(np.sqrt(np.mean(np.arccos(np.clip(residual, -1, 1)) ** 2))) * 3600
+    )
+    if rmse > MAX_TRACK_RMSE:
+        return None
+
+    ra, dec, roll = rotation_to_radec_roll(rotation)
+    target_vector = pixels_to_vectors(target_pixel, size, fov)[0]
+    ra_target, dec_target = vector_to_radec(rotation.T @ target_vector)
+
+    return {
+        "RA": ra,
+        "Dec": dec,
+        "Roll": roll,
+        "FOV": fov,
+        "RMSE": rmse,
+        "Matches": len(pairs),
+        "Prob": None,
+        "T_solve": (precision_timestamp() - t0) * 1000,
+        "RA_target": ra_target,
+        "Dec_target": dec_target,
+        "matched_stars": stars[star_idx].tolist(),
+        "matched_centroids": centroids[centroid_idx].tolist(),
+    }
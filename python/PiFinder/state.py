@@ -132,12 +132,6 @@ class SharedStateObj:
         self.__power_state = 1
         self.__solve_state = None
         self.__ui_state = None
-        self.__last_image_metadata = {
-            "exposure_start": 0,
-            "exposure_end": 0,
-            "imu": None,
-            "imu_delta": 0,
-        }
         self.__solution = None
         self.__sats = None
         self.__imu = None
@@ -214,12 +208,6 @@ class SharedStateObj:
     def set_location(self, v):
         self.__location = v
 
-    def last_image_metadata(self):
-        return self.__last_image_metadata
-
-    def set_last_image_metadata(self, v):
-        self.__last_image_metadata = v
-
     def datetime(self):
         if self.__datetime == None:
             return self.__datetime
@@ -0,0 +1,455 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""
+This module holds the shared memory state block
+* Fixed layout records for solution, imu, location,
+  datetime and solve quality, each guarded by a seqlock
+  with a lock to serialize writers
+* Readers never block and never talk to the
+  manager process for these values
+* Everything else is forwarded to the
+  SharedStateObj manager proxy
+* The timestamped IMU history ring travels with it
+* An event is set on every IMU write or notify()
+  so a consumer can block until something changed
+
+"""
+import time
+import datetime
+import pickle
+import logging
+import multiprocessing
+import numpy as np
+import pytz
+from multiprocessing import shared_memory
+from multiprocessing.context import get_spawning_popen
+from typing import List, Optional, Tuple
+
+from PiFinder.imu_ring import ImuRing
+
+# Max number of matched stars/centroids kept with a solution
+MAX_MATCHES = 256
+# Room for keys that are not part of the fixed layout
+EXTRA_BYTES = 8192
+# Reader retries before giving up on a consistent snapshot
+READ_RETRIES = 1000
+
+SOLUTION_FIELDS = [
+    ("RA", "f"),
+    ("Dec", "f"),
+    ("Roll", "f"),
+    ("FOV", "f"),
+    ("RMSE", "f"),
+    ("Matches", "i"),
+    ("Prob", "f"),
+    ("T_solve", "f"),
+    ("T_extract", "f"),
+    ("RA_target", "f"),
+    ("Dec_target", "f"),
+    ("Alt", "f"),
+    ("Az", "f"),
+    ("solve_time", "f"),
+    ("cam_solve_time", "f"),
+    ("exposure_mid", "f"),
+    ("imu_pos", "v3"),
+    ("imu_quat", "v4"),
+    ("solve_source", "s16"),
+    ("solve_mode", "s16"),
+    ("extract_mode", "s16"),
+    ("constellation", "s16"),
+    ("matched_centroids", "p2"),
+    ("matched_stars", "p3"),
+]
+
+IMU_FIELDS = [
+    ("moving", "b"),
+    ("move_start", "f"),
+    ("move_end", "f"),
+    ("pos", "v3"),
+    ("start_pos", "v3"),
+    ("quat", "v4"),
+    ("status", "i"),
+]
+
+LOCATION_FIELDS = [
+    ("lat", "f"),
+    ("lon", "f"),
+    ("altitude", "f"),
+    ("gps_lock", "b"),
+    ("timezone", "s64"),
+    ("last_gps_lock", "s16"),
+]
+
+DATETIME_FIELDS = [
+    ("epoch", "f"),
+    ("set_time", "f"),
+]
+
+# Outcome of the last solve attempt, failed ones included,
+# for the camera auto exposure
+SOLVE_QUALITY_FIELDS = [
+    ("exposure_start", "f"),
+    ("solved", "b"),
+    ("Matches", "i"),
+    ("RMSE", "f"),
+    ("centroids", "i"),
+    ("T_extract", "f"),
+]
+
+
+def _field_dtype(name: str, kind: str) -> List[Tuple]:
+    if kind in ("f", "i"):
+        return [(name, np.float64)]
+    if kind == "b":
+        return [(name, np.int8)]
+    if kind.startswith("s"):
+        return [(name, f"S{kind[1:]}")]
+    if kind.startswith("v"):
+        return [(name, np.float64, (int(kind[1:]),))]
+    if kind.startswith("p"):
+        return [
+            (name + "__n", np.int32),
+            (name, np.float64, (MAX_MATCHES, int(kind[1:]))),
+        ]
+    raise ValueError(f"Unknown field kind {kind}")
+
+
+def _record_dtype(fields) -> np.dtype:
+    dtype = [("seq", np.int64), ("valid", np.int8)]
+    for name, kind in fields:
+        dtype += _field_dtype(name, kind)
+    dtype += [("extra__n", np.int32), ("extra", np.uint8, (EXTRA_BYTES,))]
+    return np.dtype(dtype, align=True)
+
+
+class SeqlockRecord:
+    """
+    A single fixed layout record in shared memory
+    with one writer and any number of readers.
+
+    The writer bumps seq to odd, writes, then bumps
+    it back to even.  Readers copy the whole record
+    and retry if seq moved or was odd while copying.
+    The seq bumps are not atomic, so writers (threads
+    or processes) take lock around the whole write.
+    Dict keys not in the field list are pickled into
+    the extra bytes if they fit.
+    """
+
+    def __init__(self, fields, buf, offset: int, lock):
+        self.fields = fields
+        self.dtype = _record_dtype(fields)
+        self.lock = lock
+        self._rec = np.ndarray((1,), dtype=self.dtype, buffer=buf, offset=offset)
+        self._field_names = {name for name, _ in fields}
+        # things only logged the first time they happen
+        self._warned = set()
+
+    def clear(self):
+        with self.lock:
+            self._rec[0] = np.zeros((), dtype=self.dtype)
+
+    def _warn_once(self, key, message):
+        if key not in self._warned:
+            self._warned.add(key)
+            logging.warning(message)
+
+    def write(self, values: Optional[dict]):
+        with self.lock:
+            self._write(values)
+
+    def _write(self, values: Optional[dict]):
+        rec = self._rec[0]
+        rec["seq"] += 1
+        try:
+            if values is None:
+                rec["valid"] = 0
+                return
+            for name, kind in self.fields:
+                value = values.get(name)
+                if kind.startswith("p") and value is not None:
+                    if len(value) > MAX_MATCHES:
+                        self._warn_once(
+                            name,
+                            f"State block: {name} cut to {MAX_MATCHES} of {len(value)}",
+                        )
+                self._encode(rec, name, kind, value)
+            extra = {k: v for k, v in values.items() if k not in self._field_names}
+            extra_bytes = pickle.dumps(extra) if extra else b""
+            if len(extra_bytes) > EXTRA_BYTES:
+                self._warn_once(
+                    tuple(sorted(extra)),
+                    f"State block: {len(extra_bytes)} bytes of extra keys "
+                    f"dropped {sorted(extra)}",
+                )
+                extra_bytes = b""
+            rec["extra__n"] = len(extra_bytes)
+            rec["extra"][: len(extra_bytes)] = np.frombuffer(extra_bytes, np.uint8)
+            rec["valid"] = 1
+        finally:
+            rec["seq"] += 1
+
+    def read(self) -> Optional[dict]:
+        snapshot = None
+        for _ in range(READ_RETRIES):
+            seq = int(self._rec[0]["seq"])
+            if seq % 2 == 0:
+                snapshot = self._rec.copy()[0]
+                if int(self._rec[0]["seq"]) == seq and int(snapshot["seq"]) == seq:
+                    break
+            # let a writer thread in this process finish
+            time.sleep(0)
+        else:
+            logging.warning("State block: no consistent read, using last copy")
+            if snapshot is None:
+                snapshot = self._rec.copy()[0]
+
+        if not snapshot["valid"]:
+            return None
+        values = {}
+        for name, kind in self.fields:
+            values[name] = self._decode(snapshot, name, kind)
+        extra_n = int(snapshot["extra__n"])
+        if extra_n:
+            values |= pickle.loads(snapshot["extra"][:extra_n].tobytes())
+        return values
+
+    @staticmethod
+    def _encode(rec, name, kind, value):
+        if kind in ("f", "i"):
+            rec[name] = np.nan if value is None else value
+        elif kind == "b":
+            rec[name] = -1 if value is None else int(bool(value))
+        elif kind.startswith("s"):
+            rec[name] = b"" if value is None else str(value).encode("utf-8")
+        elif kind.startswith("v"):
+            rec[name] = np.nan if value is None else value
+        elif kind.startswith("p"):
+            if value is None:
+                rec[name + "__n"] = -1
+            else:
+                value = np.asarray(value, dtype=np.float64)[:MAX_MATCHES]
+                rec[name + "__n"] = len(value)
+                if len(value):
+                    rec[name][: len(value)] = value
+
+    @staticmethod
+    def _decode(rec, name, kind):
+        value = rec[name]
+        if kind == "f":
+            return None if np.isnan(value) else float(value)
+        if kind == "i":
+            return None if np.isnan(value) else int(value)
+        if kind == "b":
+            return None if value == -1 else bool(value)
+        if kind.startswith("s"):
+            return value.decode("utf-8") if value else None
+        if kind.startswith("v"):
+            return None if np.isnan(value).all() else value.tolist()
+        if kind.startswith("p"):
+            count = int(rec[name + "__n"])
+            return None if count < 0 else value[:count].tolist()
+
+
+class SharedStateBlock:
+    """
+    Drop in for the SharedStateObj proxy.
+
+    solution, imu, location, datetime and the last
+    solve quality live in a shared memory block and
+    are read/written locally in each process.  All
+    other accessors go to the manager proxy as before.
+    """
+
+    def __init__(
+        self,
+        proxy,
+        name: Optional[str] = None,
+        event=None,
+        imu_ring_name: Optional[str] = None,
+        locks=None,
+    ):
+        self._proxy = proxy
+        self._owner = name is None
+        self._imu_ring = ImuRing(name=imu_ring_name)
+        self._event = event if event is not None else multiprocessing.Event()
+        groups = [
+            SOLUTION_FIELDS,
+            IMU_FIELDS,
+            LOCATION_FIELDS,
+            DATETIME_FIELDS,
+            SOLVE_QUALITY_FIELDS,
+        ]
+        if locks is None:
+            locks = [multiprocessing.Lock() for _ in groups]
+        self._locks = locks
+        sizes = [_record_dtype(fields).itemsize for fields in groups]
+        # keep every record 8 byte aligned
+        offsets = np.cumsum([0] + [(s + 7) // 8 * 8 for s in sizes])
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=int(offsets[-1]))
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        buf = self._shm.buf
+        (
+            self._solution,
+            self._imu,
+            self._location,
+            self._datetime,
+            self._solve_quality,
+        ) = [
+            SeqlockRecord(fields, buf, int(offset), lock)
+            for fields, offset, lock in zip(groups, offsets, locks)
+        ]
+        if self._owner:
+            for record in (
+                self._solution,
+                self._imu,
+                self._location,
+                self._datetime,
+                self._solve_quality,
+            ):
+                record.clear()
+
+    def __getstate__(self):
+        state = {
+            "proxy": self._proxy,
+            "name": self._shm.name,
+            "imu_ring_name": self._imu_ring.name,
+        }
+        # The update event and write locks can only be handed
+        # over while starting a process, other copies get their
+        # own and must not write records the others write
+        if get_spawning_popen() is not None:
+            state["event"] = self._event
+            state["locks"] = self._locks
+        return state
+
+    def __setstate__(self, state):
+        self.__init__(
+            state["proxy"],
+            name=state["name"],
+            event=state.get("event"),
+            imu_ring_name=state["imu_ring_name"],
+            locks=state.get("locks"),
+        )
+
+    def __getattr__(self, name):
+        # Only called for attributes not defined here
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._proxy, name)
+
+    def solution(self):
+        return self._solution.read()
+
+    def set_solution(self, v):
+        self._solution.write(v)
+
+    def imu(self):
+        return self._imu.read()
+
+    def set_imu(self, v):
+        self._imu.write(v)
+        self._event.set()
+
+    def imu_ring(self) -> ImuRing:
+        """
+        Timestamped IMU quaternions, see imu_ring
+        """
+        return self._imu_ring
+
+    def notify(self):
+        """
+        Wakes wait_for_update, for changes that
+        don't go through the block (e.g. queues)
+        """
+        self._event.set()
+
+    def wait_for_update(self, timeout=None) -> bool:
+        """
+        Blocks until the next IMU write or notify(),
+        False on timeout.  Meant for a single waiter:
+        check your sources after this returns
+        """
+        updated = self._event.wait(timeout)
+        self._event.clear()
+        return updated
+
+    def location(self):
+        return self._location.read()
+
+    def set_location(self, v):
+        self._location.write(v)
+
+    def solve_quality(self):
+        return self._solve_quality.read()
+
+    def set_solve_quality(self, v):
+        self._solve_quality.write(v)
+
+    def datetime(self):
+        _dt = self._datetime.read()
+        if _dt is None:
+            return None
+        return datetime.datetime.fromtimestamp(
+            _dt["epoch"] + time.time() - _dt["set_time"], pytz.utc
+        )
+
+    def local_datetime(self):
+        dt = self.datetime()
+        if dt is None:
+            return dt
+
+        location = self.location()
+        if not location:
+            return dt
+
+        return dt.astimezone(pytz.timezone(location["timezone"]))
+
+    def set_datetime(self, dt):
+        if dt.tzname() == None:
+            utc_tz = pytz.timezone("UTC")
+            dt = utc_tz.localize(dt)
+
+        curtime = self.datetime()
+        if curtime is not None:
+            # only reset if there is some significant diff
+            # as some gps recievers send multiple updates that can
+            # rewind and fastforward the clock
+            if abs((curtime - dt).total_seconds()) <= 60:
+                return
+        self._datetime.write({"epoch": dt.timestamp(), "set_time": time.time()})
+
+    def serialize(self, output_file):
+        # copy the block values over so the manager side
+        # object is complete when pickled
+        self._proxy.set_solution(self.solution())
+        self._proxy.set_imu(self.imu())
+        self._proxy.set_location(self.location())
+        dt = self.datetime()
+        if dt is not None:
+            self._proxy.set_datetime(dt)
+        self._proxy.serialize(output_file)
+
+    def close(self):
+        self._solution = self._imu = self._location = self._datetime = None
+        self._solve_quality = None
+        self._shm.close()
+        self._imu_ring.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+        self._imu_ring.unlink()
+
+    def __repr__(self):
+        return (
+            f"SharedStateBlock("
+            f"solution={self.solution()}, "
+            f"imu={self.imu()}, "
+            f"location={self.location()}, "
+            f"datetime={self.datetime()}, "
+            f"proxy={self._proxy!r})"
+        )
@@ -138,6 +138,7 @@ class UICatalog(UIModule):
 
         self.fov_list = [1, 0.5, 0.25, 0.125]
         self.fov_index = 0
+        self.planets_pending = False
 
         self.catalog_tracker.filter()
         self.closest_objects_finder = ClosestObjectsFinder()
@@ -148,6 +149,14 @@ class UICatalog(UIModule):
         Since we can't calc planet positions until we know the date/time
         this is called once we have a GPS lock to add on the planets catalog
         """
+        planet_ephemeris = calc_utils.sf_utils.planet_ephemeris
+        if not planet_ephemeris.covers(dt):
+            # Sampled in the background, background_update
+            # adds the planets once they are ready
+            planet_ephemeris.refresh(dt)
+            self.planets_pending = True
+            return
+        self.planets_pending = False
         self.catalogs.remove("PL")
 
         # We need to feed through the planet catalog selection status
@@ -499,6 +508,14 @@ class UICatalog(UIModule):
             self.update()
 
     def background_update(self):
+        if self.planets_pending:
+            dt = self.shared_state.datetime()
+            if dt:
+                # starts sampling again if there was
+                # no location the last time
+                self.add_planets(dt)
+                if not self.planets_pending:
+                    self.catalog_tracker.filter()
         if time.time() - self.catalog_tracker.get_current_catalog().last_filtered > 60:
             self.catalog_tracker.filter()
 
@@ -54,7 +54,7 @@ class UIPreview(UIModule):
         "Exposure": {
             "type": "enum",
             "value": "",
-            "options": [0.025, 0.05, 0.1, 0.2, 0.4, 0.75, 1],
+            "options": ["Auto", 0.025, 0.05, 0.1, 0.2, 0.4, 0.75, 1],
             "callback": "set_exp",
         },
         "Save Exp": {
@@ -68,9 +68,7 @@ class UIPreview(UIModule):
     def __init__(self, *args):
         super().__init__(*args)
 
-        exposure_time = self.config_object.get_option("camera_exp")
-        analog_gain = self.config_object.get_option("camera_gain")
-        self._config_options["Exposure"]["value"] = exposure_time / 1000000
+        self.update_exposure_option()
         self.reticle_mode = 2
         self.last_update = time.time()
         self.solution = None
@@ -86,11 +84,33 @@ class UIPreview(UIModule):
         self.star_list = np.empty((0, 2))
         self.highlight_count = 0
 
+    def update_exposure_option(self):
+        """
+        Shows the configured exposure in the menu
+        """
+        exposure_time = self.config_object.get_option("camera_exp")
+        self._config_options["Exposure"]["value"] = exposure_time / 1000000
+        if self.config_object.get_option("camera_auto_exp"):
+            self._config_options["Exposure"]["value"] = "Auto"
+
+    def active(self):
+        super().active()
+        # the camera turns auto exposure off on exp_up/exp_dn
+        self.config_object.reload()
+        self.update_exposure_option()
+
     def set_exp(self, option):
+        if option == "Auto":
+            self.command_queues["camera"].put("exp_auto")
+            self.message("Auto Exposure")
+            self.config_object.set_option("camera_auto_exp", True)
+            return False
+
         new_exposure = int(option * 1000000)
         self.command_queues["camera"].put(f"set_exp:{new_exposure}")
         self.message("Exposure Set")
         self.config_object.set_option("camera_exp", new_exposure)
+        self.config_object.set_option("camera_auto_exp", False)
         return False
 
     def set_gain(self, option):
@@ -186,9 +206,11 @@ class UIPreview(UIModule):
         if force:
             self.last_update = 0
         # display an image
-        last_image_time = self.shared_state.last_image_metadata()["exposure_end"]
+        last_image_time = self.camera_image.metadata()["exposure_end"]
         if last_image_time > self.last_update:
-            image_obj = self.camera_image.copy()
+            # shares memory with the frame ring, the resize
+            # below makes our own copy
+            image_obj = self.camera_image.latest_image()
 
             # Fetch Centroids before image is altered
             # Do this at least once to get a numpy array in
@@ -0,0 +1,178 @@
+import unittest
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from PiFinder import attitude
+from PiFinder.solver_tracking import rotation_to_radec_roll
+
+
+def bno_quat(rotation):
+    x, y, z, w = rotation.as_quat()
+    return [w, x, y, z]
+
+
+class TestDeadReckoning(unittest.TestCase):
+    def setUp(self):
+        self.lat = 34.0
+        self.lst = 120.0
+        # IMU world heading against the real horizon
+        self.world_to_enu = attitude.rotation_z(37.0)
+        # camera to IMU body, boresight on body X with some roll
+        self.mount = Rotation.from_euler("x", 25, degrees=True).as_matrix()
+
+    def truth(self, imu_rotation, elapsed):
+        horizon = attitude.rotation_z(
+            attitude.SIDEREAL_RATE * elapsed
+        ) @ attitude.horizon_frame(self.lat, self.lst)
+        camera_enu = self.world_to_enu @ imu_rotation.as_matrix() @ self.mount
+        camera_eq = horizon @ camera_enu
+        ra, dec, roll = rotation_to_radec_roll(camera_eq.T)
+        alt, az = attitude.vector_to_altaz(camera_enu[:, 0])
+        return {"RA": ra, "Dec": dec, "Roll": roll, "Alt": alt, "Az": az}
+
+    def check(self, start, end, elapsed, boresight=attitude.IMU_BORESIGHT):
+        dead_reckoning = attitude.DeadReckoning(boresight)
+        dead_reckoning.set_reference(
+            self.truth(start, 0), bno_quat(start), self.lat, self.lst, 1000.0
+        )
+        result = dead_reckoning.update(bno_quat(end), 1000.0 + elapsed)
+        expected = self.truth(end, elapsed)
+        for key in ["RA", "Az", "Roll"]:
+            diff = (result[key] - expected[key] + 180) % 360 - 180
+            self.assertAlmostEqual(diff, 0, places=6, msg=key)
+        for key in ["Dec", "Alt"]:
+            self.assertAlmostEqual(result[key], expected[key], places=6, msg=key)
+
+    def test_slew(self):
+        start = Rotation.from_euler("zy", [10, -30], degrees=True)
+        end = Rotation.from_euler("zy", [55, -50], degrees=True)
+        self.check(start, end, 120.0)
+
+    def test_through_zenith(self):
+        # euler offsets break down going over the top
+        start = Rotation.from_euler("zy", [10, -85], degrees=True)
+        end = Rotation.from_euler("zy", [190, -80], degrees=True)
+        self.check(start, end, 5.0)
+
+    def test_screen_directions(self):
+        start = Rotation.from_euler("zy", [10, -30], degrees=True)
+        end = Rotation.from_euler("zy", [55, -50], degrees=True)
+        for screen_direction, mount_z in [("right", 0), ("left", 180), ("flat", 180)]:
+            with self.subTest(screen_direction):
+                # camera X along body -X for left and flat mounts
+                self.mount = Rotation.from_euler(
+                    "zx", [mount_z, 25], degrees=True
+                ).as_matrix()
+                self.check(start, end, 120.0, attitude.imu_boresight(screen_direction))
+
+    def test_quat_angle(self):
+        start = Rotation.from_euler("zy", [10, -30], degrees=True)
+        end = start * Rotation.from_euler("x", 2.5, degrees=True)
+        self.assertAlmostEqual(
+            attitude.quat_angle(bno_quat(start), bno_quat(end)), 2.5, places=6
+        )
+
+    def test_no_reference(self):
+        dead_reckoning = attitude.DeadReckoning()
+        self.assertIsNone(dead_reckoning.update([1, 0, 0, 0], 0))
+        self.assertIsNone(attitude.quat_to_matrix([0, 0, 0, 0]))
+
+
+class TestAttitudeFilter(unittest.TestCase):
+    def setUp(self):
+        self.lat = 34.0
+        self.lst = 120.0
+        self.heading_drift = 0.0
+        # camera to IMU body
+        self.mount = np.eye(3)
+
+    def truth(self, imu_rotation, elapsed):
+        horizon = attitude.rotation_z(
+            attitude.SIDEREAL_RATE * elapsed
+        ) @ attitude.horizon_frame(self.lat, self.lst)
+        # IMU heading slowly wanders against the real horizon
+        world_to_enu = attitude.rotation_z(37.0 - self.heading_drift * elapsed)
+        camera_enu = world_to_enu @ imu_rotation.as_matrix() @ self.mount
+        ra, dec, roll = rotation_to_radec_roll((horizon @ camera_enu).T)
+        alt, az = attitude.vector_to_altaz(camera_enu[:, 0])
+        return {
+            "RA": ra,
+            "Dec": dec,
+            "Roll": roll,
+            "Alt": alt,
+            "Az": az,
+            "RMSE": 20.0,
+            "Matches": 16,
+        }
+
+    def solve(self, attitude_filter, imu_rotation, elapsed, offset_arcsec=0):
+        solution = self.truth(imu_rotation, elapsed)
+        solution["Dec"] += offset_arcsec / 3600
+        lst = self.lst + attitude.SIDEREAL_RATE * elapsed
+        return attitude_filter.camera_update(
+            solution, bno_quat(imu_rotation), self.lat, lst, 1000.0 + elapsed
+        )
+
+    def test_camera_weighting(self):
+        attitude_filter = attitude.AttitudeFilter()
+        rotation = Rotation.from_euler("zy", [10, -30], degrees=True)
+        self.solve(attitude_filter, rotation, 0)
+        # a second equally good solve right away, 60" off,
+        # only gets about half the weight
+        fused = self.solve(attitude_filter, rotation, 0.5, offset_arcsec=60)
+        expected = self.truth(rotation, 0.5)["Dec"]
+        error = (fused["Dec"] - expected) * 3600
+        self.assertAlmostEqual(error, 30, delta=2)
+        self.assertLess(fused["fusion_sigma"], 5.0)
+
+        # much later the prediction has drifted, the camera wins
+        fused = self.solve(attitude_filter, rotation, 600, offset_arcsec=60)
+        error = (fused["Dec"] - self.truth(rotation, 600)["Dec"]) * 3600
+        self.assertGreater(error, 55)
+
+    def test_reset_on_large_innovation(self):
+        attitude_filter = attitude.AttitudeFilter()
+        rotation = Rotation.from_euler("zy", [10, -30], degrees=True)
+        self.solve(attitude_filter, rotation, 0)
+        fused = self.solve(attitude_filter, rotation, 1, offset_arcsec=7200)
+        self.assertAlmostEqual(
+            fused["Dec"], self.truth(rotation, 1)["Dec"] + 2, places=6
+        )
+
+    def test_flipped_boresight(self):
+        # left and flat mounts look down body -X, the IMU
+        # prediction has to follow the camera in altitude
+        self.mount = Rotation.from_euler("z", 180, degrees=True).as_matrix()
+        for screen_direction in ["left", "flat"]:
+            with self.subTest(screen_direction):
+                attitude_filter = attitude.AttitudeFilter(
+                    attitude.imu_boresight(screen_direction)
+                )
+                for step in range(5):
+                    rotation = Rotation.from_euler(
+                        "zy", [step * 20, 20 - step * 10], degrees=True
+                    )
+                    self.solve(attitude_filter, rotation, step * 15.0)
+                np.testing.assert_allclose(
+                    attitude_filter.dead_reckoning.boresight, [-1, 0, 0], atol=1e-6
+                )
+                end = Rotation.from_euler("zy", [100, -40], degrees=True)
+                predicted = attitude_filter.update(bno_quat(end), 1075.0)
+                expected = self.truth(end, 75.0)
+                self.assertAlmostEqual(predicted["Alt"], expected["Alt"], places=4)
+                self.assertAlmostEqual(predicted["Dec"], expected["Dec"], places=4)
+
+    def test_learns_heading_drift(self):
+        self.heading_drift = 0.01
+        attitude_filter = attitude.AttitudeFilter()
+        for step in range(20):
+            rotation = Rotation.from_euler("zy", [step * 3, -30], degrees=True)
+            self.solve(attitude_filter, rotation, step * 15.0)
+        self.assertAlmostEqual(
+            attitude_filter.dead_reckoning.heading_rate, 0.01, delta=0.003
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from PiFinder import auto_exposure
+from PiFinder.auto_exposure import AutoExposure
+
+
+class TestAutoExposure(unittest.TestCase):
+    def setUp(self):
+        self.ae = AutoExposure(400000, 20)
+        self.t = 1000.0
+
+    def feed(self, count, solved=True, matches=30, rmse=10.0, centroids=60):
+        """
+        Feeds count solve results, returns the last change
+        """
+        change = None
+        for _ in range(count):
+            self.t += 1
+            result = self.ae.update(
+                {
+                    "exposure_start": self.t,
+                    "solved": solved,
+                    "Matches": matches if solved else None,
+                    "RMSE": rmse if solved else None,
+                    "centroids": centroids,
+                    "T_extract": 50.0,
+                },
+                now=self.t + 0.5,
+            )
+            change = result or change
+        return change
+
+    def test_good_solves_shorten(self):
+        change = self.feed(auto_exposure.WINDOW)
+        self.assertEqual(change, (int(400000 * auto_exposure.STEP_DOWN), 20))
+
+    def test_marginal_solves_hold(self):
+        self.assertIsNone(self.feed(auto_exposure.WINDOW * 3, matches=10))
+
+    def test_failures_lengthen_and_set_floor(self):
+        change = self.feed(auto_exposure.WINDOW, solved=False, centroids=5)
+        self.assertEqual(change[0], int(400000 * auto_exposure.STEP_UP))
+        # good solves now can't go back below the exposure that failed
+        self.feed(auto_exposure.WINDOW * 10)
+        self.assertGreaterEqual(
+            self.ae.exposure_time, int(400000 * auto_exposure.STEP_UP)
+        )
+
+    def test_gain_after_max_exposure(self):
+        self.ae = AutoExposure(auto_exposure.MAX_EXPOSURE, 20)
+        change = self.feed(auto_exposure.WINDOW, solved=False)
+        self.assertEqual(change, (auto_exposure.MAX_EXPOSURE, 22))
+
+    def test_duplicate_ignored(self):
+        quality = {
+            "exposure_start": 5.0,
+            "solved": True,
+            "Matches": 30,
+            "RMSE": 10.0,
+            "centroids": 60,
+            "T_extract": 50.0,
+        }
+        for _ in range(auto_exposure.WINDOW * 2):
+            self.assertIsNone(self.ae.update(quality, now=6.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import datetime
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pytz
+from skyfield.api import load, load_constellation_map, position_of_radec
+
+from PiFinder import calc_utils, utils
+
+
+class TestFastAltAz(unittest.TestCase):
+    def test_array_matches_scalar(self):
+        aa = calc_utils.FastAltAz(
+            40, -75, datetime.datetime(2024, 5, 1, 3, 21, tzinfo=pytz.utc)
+        )
+        rng = np.random.default_rng(0)
+        ra = rng.uniform(0, 360, 200)
+        dec = rng.uniform(-89, 89, 200)
+        alt, az = aa.radec_to_altaz_array(ra, dec)
+        expected = np.array([aa.radec_to_altaz(r, d) for r, d in zip(ra, dec)])
+        np.testing.assert_allclose(alt, expected[:, 0], atol=1e-9)
+        np.testing.assert_allclose(az, expected[:, 1], atol=1e-6)
+
+
+class TestAltitudeTracker(unittest.TestCase):
+    def test_advance_matches_fresh(self):
+        dt = datetime.datetime(2024, 5, 1, 3, 21, tzinfo=pytz.utc)
+        rng = np.random.default_rng(2)
+        ra = rng.uniform(0, 360, 2000)
+        dec = rng.uniform(-89, 89, 2000)
+        tracker = calc_utils.AltitudeTracker(ra, dec, 40, -75, 10, dt)
+        for minutes in range(1, 30, 7):
+            now = dt + datetime.timedelta(minutes=minutes)
+            self.assertTrue(tracker.matches(40, -75, 10, now))
+            tracker.advance(now)
+            alt, _ = calc_utils.FastAltAz(40, -75, now).radec_to_altaz_array(ra, dec)
+            # leave out objects right at the limit
+            clear = np.abs(alt - 10) > 1e-6
+            np.testing.assert_array_equal(tracker.above[clear], (alt > 10)[clear])
+
+
+class TestConstellationIndex(unittest.TestCase):
+    def test_matches_skyfield(self):
+        index = calc_utils.ConstellationIndex(load.timescale())
+        rng = np.random.default_rng(1)
+        ra = rng.uniform(0, 360, 2000)
+        dec = np.degrees(np.arcsin(rng.uniform(-1, 1, 2000)))
+        expected = load_constellation_map()(position_of_radec(ra / 15, dec))
+        np.testing.assert_array_equal(index.lookup(ra, dec), expected)
+        self.assertEqual(index.lookup(10.68, 41.27), "And")
+
+
+class TestLocation(unittest.TestCase):
+    def test_jitter_keeps_frame(self):
+        sf_utils = calc_utils.Skyfield_utils()
+        sf_utils.set_location(40.0, -75.0, 10.0)
+        sf_utils._observer_frame = frame = object()
+        sf_utils.set_location(40.00005, -75.00005, 12.0)
+        self.assertIs(sf_utils._observer_frame, frame)
+        sf_utils.set_location(40.001, -75.0, 10.0)
+        self.assertIsNone(sf_utils._observer_frame)
+        self.assertTrue(calc_utils.same_location((0, 179.99995, 0), (0, -180, 0)))
+
+
+@unittest.skipUnless(
+    Path(utils.astro_data_dir, "de421.bsp").exists(), "needs de421.bsp"
+)
+class TestObserverFrame(unittest.TestCase):
+    def test_matches_skyfield(self):
+        sf_utils = calc_utils.Skyfield_utils()
+        sf_utils.set_location(40.0, -75.0, 0.0)
+        frame = sf_utils.observer_frame
+        rng = np.random.default_rng(3)
+        for minutes in [0, 17, 59]:
+            dt = datetime.datetime(2024, 5, 1, 3, minutes, 30, tzinfo=pytz.utc)
+            ra = rng.uniform(0, 360, 50)
+            dec = rng.uniform(-89, 89, 50)
+            alt, az = frame.radec_to_altaz(ra, dec, dt)
+            for i in range(len(ra)):
+                expected = sf_utils.radec_to_altaz(ra[i], dec[i], dt)
+                # refraction and azimuth blow up near the horizon and zenith
+                if not 1 < expected[0] < 85:
+                    continue
+                self.assertAlmostEqual(alt[i], expected[0], delta=2 / 3600)
+                az_error = (az[i] - expected[1] + 180) % 360 - 180
+                self.assertLess(
+                    abs(az_error) * np.cos(np.radians(expected[0])), 2 / 3600
+                )
+                back = frame.altaz_to_radec(alt[i], az[i], dt)
+                self.assertAlmostEqual(back[1], dec[i], delta=1 / 3600)
+
+
+class TestPlanetEphemeris(unittest.TestCase):
+    def test_no_location(self):
+        ephemeris = calc_utils.Skyfield_utils().planet_ephemeris
+        dt = datetime.datetime(2024, 5, 1, 3, 21, tzinfo=pytz.utc)
+        self.assertIsNone(ephemeris.positions(dt))
+        self.assertFalse(ephemeris.covers(dt))
+        self.assertIsNone(ephemeris._thread)
+
+    @unittest.skipUnless(
+        Path(utils.astro_data_dir, "de421.bsp").exists(), "needs de421.bsp"
+    )
+    def test_matches_skyfield(self):
+        sf_utils = calc_utils.Skyfield_utils()
+        sf_utils.set_location(40.0, -75.0, 10.0)
+        ephemeris = sf_utils.planet_ephemeris
+        dt = datetime.datetime(2024, 5, 1, 3, 21, tzinfo=pytz.utc)
+        self.assertIsNone(ephemeris.positions(dt))
+        ephemeris._thread.join()
+
+        # GPS jitter keeps the window
+        sf_utils.set_location(40.00005, -75.0, 12.0)
+        dt += datetime.timedelta(minutes=47)
+        self.assertTrue(ephemeris.covers(dt))
+        positions = ephemeris.positions(dt)
+        for name, expected in sf_utils.calc_planets(dt).items():
+            for got, want in zip(positions[name]["radec"], expected["radec"]):
+                self.assertAlmostEqual(got, want, delta=30 / 3600)
+            self.assertAlmostEqual(
+                positions[name]["altaz"][0], expected["altaz"][0], delta=30 / 3600
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from PiFinder import catalog_snapshot
+from PiFinder.catalog_store import CatalogStore
+from PiFinder.catalogs import Catalog
+from PiFinder.composite_object import CompositeObject
+
+
+class TestCatalogSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name, "objects.snapshot")
+        self.store = CatalogStore(
+            {
+                "id": [1, 2, 3],
+                "obj_type": ["Gx", "Gx", "OC"],
+                "ra": [2.8, 10.5, 56.7],
+                "dec": [-12.0, 41.2, 24.1],
+                "mag": [14, "", 1.6],
+                "catalog_code": ["NGC", "M", "M"],
+                "sequence": [35, 31, 45],
+                "names": [[], ["Andromeda Galaxy"], ["Pleiades", "Seven Sisters"]],
+            },
+            3,
+        )
+        self.catalogs = [
+            catalog_snapshot.SnapshotCatalog("M", 110, "Messier", np.array([1, 2])),
+            catalog_snapshot.SnapshotCatalog("NGC", 7840, "NGC", np.array([0])),
+            catalog_snapshot.SnapshotCatalog("IC", 5386, "IC", np.array([], int)),
+        ]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        catalog_snapshot.save("abc", self.store, self.catalogs, self.path)
+        store, catalogs = catalog_snapshot.load("abc", self.path)
+        for row in range(3):
+            self.assertEqual(store.row_dict(row), self.store.row_dict(row))
+        self.assertEqual(
+            [(c.catalog_code, c.max_sequence, c.desc, list(c.rows)) for c in catalogs],
+            [
+                (c.catalog_code, c.max_sequence, c.desc, list(c.rows))
+                for c in self.catalogs
+            ],
+        )
+
+        # copy on write, the file keeps the saved values
+        CompositeObject.view(store, 2).logged = True
+        CompositeObject.view(store, 2).mag = 1.5
+        self.assertEqual(store.mag_value[2], 1.5)
+        store, _ = catalog_snapshot.load("abc", self.path)
+        self.assertEqual(store.row_dict(2), self.store.row_dict(2))
+
+    def test_out_of_date(self):
+        self.assertIsNone(catalog_snapshot.load("abc", self.path))
+        catalog_snapshot.save("abc", self.store, self.catalogs, self.path)
+        self.assertIsNone(catalog_snapshot.load("def", self.path))
+        self.path.write_bytes(b"garbage")
+        self.assertIsNone(catalog_snapshot.load("abc", self.path))
+
+    def test_catalog_from_rows(self):
+        catalog_snapshot.save("abc", self.store, self.catalogs, self.path)
+        store, catalogs = catalog_snapshot.load("abc", self.path)
+        catalog = Catalog("M", 110, "Messier")
+        catalog.add_store_rows(store, catalogs[0].rows)
+        self.assertEqual([obj.sequence for obj in catalog.get_objects()], [31, 45])
+        self.assertEqual(catalog.get_object_by_sequence(45).names[0], "Pleiades")
+        self.assertEqual(catalog.get_object_by_id(2).sequence, 31)
+
+
+if __name__ == "__main__":
+    unittest.main()
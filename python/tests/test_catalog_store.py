@@ -0,0 +1,60 @@
+import pickle
+import unittest
+
+import numpy as np
+
+from PiFinder.catalog_store import CatalogStore, NO_MAGNITUDE
+from PiFinder.composite_object import CompositeObject
+
+
+class TestCatalogStore(unittest.TestCase):
+    def setUp(self):
+        self.store = CatalogStore(
+            {
+                "id": [1, 2],
+                "object_id": [10, 20],
+                "obj_type": ["Gx", "Gx"],
+                "ra": [2.8, 10.5],
+                "dec": [-12.0, 41.2],
+                "mag": [14, ""],
+                "catalog_code": ["NGC", "M"],
+                "sequence": [35, 31],
+                "names": [[], ["Andromeda Galaxy", "M31"]],
+            },
+            2,
+        )
+        self.objects = [CompositeObject.view(self.store, row) for row in range(2)]
+
+    def test_columns(self):
+        np.testing.assert_array_equal(self.store.mag_value, [14, NO_MAGNITUDE])
+        self.assertEqual(self.store.obj_type[0], self.store.obj_type[1])
+        self.assertEqual(self.objects[1].names, ["Andromeda Galaxy", "M31"])
+        self.assertEqual(self.objects[0].mag, 14)
+        self.assertEqual(self.objects[0].const, "")
+
+    def test_view_writes_through(self):
+        obj = self.objects[0]
+        obj.logged = True
+        obj.names = ["Test"]
+        obj.mag = "9.5"
+        self.assertTrue(self.store.logged[0])
+        self.assertEqual(self.store.mag_value[0], 9.5)
+        self.assertEqual(obj.names, ["Test"])
+        self.assertEqual(self.objects[1].names, ["Andromeda Galaxy", "M31"])
+
+    def test_standalone_and_pickle(self):
+        obj = CompositeObject(id=-1, catalog_code="PUSH", sequence=1, ra=1.0, dec=2.0)
+        self.assertEqual(obj.names, [])
+        self.assertEqual(obj.object_id, -1)
+
+        copy = pickle.loads(pickle.dumps(self.objects[1]))
+        self.assertEqual(copy, self.objects[1])
+        self.assertIsNot(copy._store, self.store)
+        self.assertNotEqual(copy, self.objects[0])
+
+        with self.assertRaises(TypeError):
+            CompositeObject(bogus=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
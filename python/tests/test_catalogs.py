@@ -0,0 +1,140 @@
+import datetime
+import gc
+import tempfile
+import unittest
+from pathlib import Path
+
+import pytz
+
+from PiFinder.catalogs import Catalog, CatalogBuilder, CatalogFilter, Catalogs
+from PiFinder.db.observations_db import ObservationsDatabase
+from PiFinder.catalog_store import CatalogStore
+from PiFinder.composite_object import CompositeObject
+
+
+class FakeState:
+    def solution(self):
+        return {"RA": 0}
+
+    def location(self):
+        return {"lat": 40, "lon": -75}
+
+    def datetime(self):
+        return datetime.datetime(2024, 5, 1, 3, 21, tzinfo=pytz.utc)
+
+
+class TestCatalogFilter(unittest.TestCase):
+    def setUp(self):
+        store = CatalogStore.from_rows(
+            [
+                # Vega, high up at this time and place
+                {"sequence": 1, "ra": 279.2, "dec": 38.8, "mag": 0, "obj_type": "*"},
+                {"sequence": 2, "ra": 279.2, "dec": 38.8, "mag": "", "obj_type": "Gx"},
+                {
+                    "sequence": 3,
+                    "ra": 279.2,
+                    "dec": 38.8,
+                    "mag": 12.5,
+                    "obj_type": "Gx",
+                },
+                # Below the horizon
+                {"sequence": 4, "ra": 100.0, "dec": -60.0, "mag": 5, "obj_type": "Gx"},
+            ]
+        )
+        self.catalog = Catalog("T", 4, "test")
+        self.catalog.add_objects(
+            [CompositeObject.view(store, row) for row in range(len(store))]
+        )
+        self.catalog.get_objects()[2].logged = True
+
+    def filtered(self, *values):
+        self.catalog.catalog_filter = CatalogFilter(*values)
+        self.catalog.filter_objects(FakeState())
+        return [obj.sequence for obj in self.catalog.get_filtered_objects()]
+
+    def test_filters(self):
+        self.assertEqual(self.filtered("None", ["None"], "None", "Any"), [1, 2, 3, 4])
+        self.assertEqual(self.filtered("None", ["None"], 10, "Any"), [1, 2, 3])
+        self.assertEqual(self.filtered(12, ["None"], "None", "Any"), [1, 4])
+        self.assertEqual(self.filtered("None", ["Gx", "OC"], "None", "Any"), [2, 3, 4])
+        self.assertEqual(self.filtered("None", ["None"], "None", "Yes"), [3])
+        self.assertEqual(self.filtered(13, ["Gx"], 10, "No"), [])
+
+    def test_caches(self):
+        store = self.catalog.store_rows[0]
+        catalog_filter = CatalogFilter(12, ["Gx"], 10, "Any")
+        catalog_filter.calc_fast_aa(FakeState())
+        value_mask = catalog_filter.value_mask(store)
+        self.assertEqual(catalog_filter.store_mask(store).tolist(), [0, 0, 0, 0])
+        version = catalog_filter.mask_version(store)
+
+        # a refresh keeps the magnitude/type part
+        catalog_filter.set_values(12, ["Gx"], 10, "Any")
+        catalog_filter.calc_fast_aa(FakeState())
+        self.assertIs(catalog_filter.value_mask(store), value_mask)
+        self.assertEqual(catalog_filter.mask_version(store), version)
+
+        catalog_filter.set_values(13, ["Gx"], 10, "Any")
+        self.assertIsNot(catalog_filter.value_mask(store), value_mask)
+        self.assertEqual(catalog_filter.store_mask(store).tolist(), [0, 0, 1, 0])
+        self.assertEqual(catalog_filter.mask_version(store), version + 1)
+
+        # nothing keeps a replaced store alive
+        self.catalog = None
+        del store
+        gc.collect()
+        self.assertEqual(len(catalog_filter._value_masks), 0)
+        self.assertEqual(len(catalog_filter._altitudes), 0)
+        self.assertEqual(len(catalog_filter._versions), 0)
+
+
+class TestLogged(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.obs_db = ObservationsDatabase(Path(self.tmp.name, "observations.db"))
+        store = CatalogStore.from_rows(
+            [
+                {"catalog_code": "M", "sequence": 31},
+                {"catalog_code": "M", "sequence": 45},
+                {"catalog_code": "NGC", "sequence": 31},
+            ]
+        )
+        catalogs = []
+        for code, rows in (("M", [0, 1]), ("NGC", [2])):
+            catalog = Catalog(code, 7840, code)
+            catalog.add_objects([CompositeObject.view(store, row) for row in rows])
+            catalogs.append(catalog)
+        self.catalogs = Catalogs(catalogs)
+
+    def tearDown(self):
+        self.obs_db.close()
+        self.tmp.cleanup()
+
+    def log(self, catalog, sequence):
+        self.obs_db.log_object("session", 0, catalog, sequence, None, {})
+
+    def logged(self):
+        return [
+            (obj.catalog_code, obj.sequence)
+            for catalog in self.catalogs.get_catalogs()
+            for obj in catalog.get_objects()
+            if obj.logged
+        ]
+
+    def test_mark_logged(self):
+        self.log("M", 31)
+        CatalogBuilder()._mark_logged(self.catalogs, self.obs_db)
+        self.assertEqual(self.logged(), [("M", 31)])
+
+        # the listener list is class level, leave it as it was
+        saved = list(ObservationsDatabase.log_listeners)
+        self.addCleanup(setattr, ObservationsDatabase, "log_listeners", saved)
+        ObservationsDatabase.add_log_listener(self.catalogs.mark_logged)
+        self.log("NGC", 31)
+        self.log("IC", 1)
+        self.assertEqual(self.logged(), [("M", 31), ("NGC", 31)])
+        self.assertTrue(self.obs_db.check_logged(self.catalogs.get_objects()[2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import pickle
+import unittest
+
+import numpy as np
+from PiFinder.frame_ring import FrameRing
+
+
+class TestFrameRing(unittest.TestCase):
+    def setUp(self):
+        self.ring = FrameRing(slots=3, shape=(16, 16))
+
+    def tearDown(self):
+        self.ring.close()
+        self.ring.unlink()
+
+    def put(self, value, exposure_end):
+        return self.ring.put(
+            np.full((16, 16), value, dtype=np.uint8),
+            {
+                "exposure_start": exposure_end - 0.5,
+                "exposure_end": exposure_end,
+                "imu": {"pos": [1.0, 2.0, 3.0]},
+                "imu_delta": 0,
+            },
+        )
+
+    def test_empty(self):
+        self.assertEqual(self.ring.latest_seq(), -1)
+        self.assertEqual(self.ring.metadata()["exposure_end"], 0)
+
+    def test_latest(self):
+        self.put(1, 10)
+        seq = self.put(2, 20)
+        latest_seq, frame, metadata = self.ring.latest()
+        self.assertEqual(latest_seq, seq)
+        self.assertEqual(frame[0, 0], 2)
+        self.assertEqual(metadata["exposure_end"], 20)
+        self.assertEqual(metadata["imu"]["pos"], [1.0, 2.0, 3.0])
+        self.assertFalse(frame.flags.writeable)
+
+    def test_wraparound(self):
+        first = self.put(1, 10)
+        for i in range(3):
+            self.put(i, 20 + i)
+        self.assertFalse(self.ring.is_current(first))
+        self.assertTrue(self.ring.is_current(self.ring.latest_seq()))
+
+    def test_attach_by_pickle(self):
+        reader = pickle.loads(pickle.dumps(self.ring))
+        self.put(7, 10)
+        self.assertEqual(reader.latest_image().getpixel((3, 3)), 7)
+        reader.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas
+from skyfield.data import hipparcos
+
+from PiFinder import hip_stars
+
+HIP_LINES = b"""\
+H|           1| |00 00 00.22|+01 05 20.4| 9.10| |H|000.00091185|+01.08901332| |   3.54|   -5.20|   -1.88|  1.32|  0.74|  1.39|  1.36|  0.81| 0.32|-0.07|-0.11|-0.24| 0.09|-0.01| 0.10|-0.01| 0.01| 0.34|  0| 0.74|     1| 9.643|0.020| 9.130|0.019| | 0.482|0.025|T|0.55|0.03|L| | 9.2043|0.0020|0.017| 87| | 9.17| 9.24|       | | | |          | |  | 1| | | |  |   |       |     |     |    |S| | |224700|B+00 5077 |          |          |0.66|F5          |S 
+H|           2| |00 00 00.22|+01 05 20.4| 5.10| |H|010.00091185|+21.08901332| |   3.54|   -5.20|   -1.88|  1.32|  0.74|  1.39|  1.36|  0.81| 0.32|-0.07|-0.11|-0.24| 0.09|-0.01| 0.10|-0.01| 0.01| 0.34|  0| 0.74|     1| 9.643|0.020| 9.130|0.019| | 0.482|0.025|T|0.55|0.03|L| | 9.2043|0.0020|0.017| 87| | 9.17| 9.24|       | | | |          | |  | 1| | | |  |   |       |     |     |    |S| | |224700|B+00 5077 |          |          |0.66|F5          |S 
+"""
+
+
+class TestHipStars(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dat_path = Path(self.tmp.name, "hip_main.dat")
+        self.npy_path = Path(self.tmp.name, "hip_main.npy")
+        self.dat_path.write_bytes(HIP_LINES)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_matches_skyfield(self):
+        df = hip_stars.load_dataframe(dat_path=self.dat_path, npy_path=self.npy_path)
+        with open(self.dat_path, "rb") as f:
+            expected = hipparcos.load_dataframe(f)
+        pandas.testing.assert_frame_equal(df, expected)
+        self.assertIsInstance(
+            hip_stars.load_records(self.dat_path, self.npy_path), np.memmap
+        )
+
+    def test_max_magnitude(self):
+        df = hip_stars.load_dataframe(
+            max_magnitude=7.5, dat_path=self.dat_path, npy_path=self.npy_path
+        )
+        self.assertEqual(list(df.index), [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import pickle
+import unittest
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from PiFinder import imu_ring
+from PiFinder.imu_ring import ImuRing
+
+
+def bno_quat(angle):
+    x, y, z, w = Rotation.from_euler("z", angle, degrees=True).as_quat()
+    return [w, x, y, z]
+
+
+class TestImuRing(unittest.TestCase):
+    def setUp(self):
+        self.ring = ImuRing(slots=8)
+
+    def tearDown(self):
+        self.ring.close()
+        self.ring.unlink()
+
+    def test_empty(self):
+        self.assertEqual(self.ring.latest_seq(), -1)
+        self.assertIsNone(self.ring.quat_at(10.0))
+
+    def test_interpolate(self):
+        for i in range(4):
+            self.ring.put(10.0 + i * 0.1, bno_quat(i * 10))
+        quat = self.ring.quat_at(10.15)
+        np.testing.assert_allclose(np.abs(quat), np.abs(bno_quat(15)), atol=1e-9)
+
+        # before the oldest, just after and long after the newest
+        self.assertIsNone(self.ring.quat_at(9.0))
+        np.testing.assert_allclose(self.ring.quat_at(10.35), bno_quat(30))
+        self.assertIsNone(self.ring.quat_at(10.3 + imu_ring.MAX_HOLD * 2))
+
+    def test_wrap_and_other_process_view(self):
+        reader = pickle.loads(pickle.dumps(self.ring))
+        for i in range(20):
+            self.ring.put(float(i), bno_quat(i))
+        times, _ = reader.samples()
+        np.testing.assert_array_equal(times, np.arange(12.0, 20.0))
+        reader.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
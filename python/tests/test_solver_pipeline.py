@@ -0,0 +1,175 @@
+import queue
+import threading
+import unittest
+
+import numpy as np
+
+from PiFinder import solver_pipeline
+from PiFinder.solver_pipeline import (
+    ExtractionModeSelector,
+    FovEstimator,
+    FrameChangeDetector,
+)
+
+
+class TestPutLatest(unittest.TestCase):
+    def test_keeps_newest(self):
+        q = queue.Queue(maxsize=1)
+        for item in range(5):
+            solver_pipeline.put_latest(q, item)
+        self.assertEqual(q.get(block=False), 4)
+        self.assertTrue(q.empty())
+
+    def test_never_blocks(self):
+        # nobody is reading, the extractor must still get through
+        q = queue.Queue(maxsize=2)
+        extractor = threading.Thread(
+            target=lambda: [solver_pipeline.put_latest(q, i) for i in range(1000)]
+        )
+        extractor.start()
+        extractor.join(timeout=5)
+        self.assertFalse(extractor.is_alive())
+        self.assertEqual([q.get(block=False), q.get(block=False)], [998, 999])
+
+
+class TestFovEstimator(unittest.TestCase):
+    def test_converges(self):
+        estimator = FovEstimator()
+        self.assertEqual(estimator.fov_estimate, solver_pipeline.DEFAULT_FOV)
+        rng = np.random.default_rng(0)
+        for fov in 10.2 + rng.normal(0, 0.01, FovEstimator.MIN_SAMPLES - 1):
+            estimator.update(fov)
+        # not enough samples yet
+        self.assertIsNone(estimator.learned_fov())
+        for fov in 10.2 + rng.normal(0, 0.01, 10):
+            estimator.update(fov)
+        self.assertAlmostEqual(estimator.fov_estimate, 10.2, delta=0.02)
+        self.assertEqual(estimator.fov_max_error, FovEstimator.MIN_MAX_ERROR)
+        self.assertAlmostEqual(estimator.learned_fov(), 10.2, delta=0.02)
+
+    def test_rejects_outliers(self):
+        estimator = FovEstimator()
+        for fov in [10.2, 10.21, 3.5, 10.19, 10.2, 24.0, 10.22, 10.18]:
+            estimator.update(fov)
+        self.assertAlmostEqual(estimator.fov_estimate, 10.2, delta=0.02)
+        self.assertLess(estimator.fov_max_error, 0.5)
+
+    def test_saved_estimate(self):
+        estimator = FovEstimator(10.2)
+        self.assertEqual(estimator.fov_estimate, 10.2)
+        self.assertEqual(estimator.fov_max_error, FovEstimator.SAVED_MAX_ERROR)
+        # a saved estimate that no longer solves is dropped
+        for _ in range(FovEstimator.MAX_FAILURES + 1):
+            estimator.failed()
+        self.assertEqual(estimator.fov_estimate, solver_pipeline.DEFAULT_FOV)
+
+    def test_needs_saving(self):
+        self.assertFalse(FovEstimator.needs_saving(None, 10.2))
+        self.assertTrue(FovEstimator.needs_saving(10.2, None))
+        self.assertFalse(FovEstimator.needs_saving(10.22, 10.2))
+        self.assertTrue(FovEstimator.needs_saving(10.4, 10.2))
+
+
+class TestBinning(unittest.TestCase):
+    def centroid(self, image):
+        # intensity weighted, origin on the corner of the first pixel
+        y, x = np.indices(image.shape) + 0.5
+        weights = image.astype(np.float64)
+        return np.array([(y * weights).sum(), (x * weights).sum()]) / weights.sum()
+
+    def test_bin_image(self):
+        image = np.arange(35, dtype=np.uint8).reshape(5, 7)
+        binned = solver_pipeline.bin_image(image)
+        self.assertEqual(binned.shape, (2, 3))
+        self.assertEqual(binned[0, 0], (0 + 1 + 7 + 8) // 4)
+        self.assertEqual(binned.dtype, np.uint8)
+
+    def test_binned_centroids_map_back(self):
+        y, x = np.indices((64, 64))
+        for star in [(20.0, 30.0), (33.3, 17.8), (40.5, 41.5)]:
+            image = 200 * np.exp(
+                -((y + 0.5 - star[0]) ** 2 + (x + 0.5 - star[1]) ** 2) / (2 * 1.5**2)
+            )
+            image = image.astype(np.uint8)
+            full = self.centroid(image)
+            binned = self.centroid(solver_pipeline.bin_image(image))
+            np.testing.assert_allclose(full, star, atol=0.05)
+            np.testing.assert_allclose(
+                solver_pipeline.binned_to_full(binned)[0], full, atol=0.05
+            )
+
+
+class TestExtractionModeSelector(unittest.TestCase):
+    def solve(self, selector, matches):
+        solution = {"RA": None if matches is None else 10.0, "Matches": matches}
+        selector.record_solve(selector.mode, solution)
+        return selector.mode
+
+    def test_hysteresis(self):
+        selector = ExtractionModeSelector()
+        self.assertEqual(selector.mode, "bin2")
+        # one strong solve or one failure doesn't switch
+        self.assertEqual(self.solve(selector, 40), "bin2")
+        self.assertEqual(self.solve(selector, None), "bin2")
+        self.assertEqual(self.solve(selector, 40), "bin2")
+        self.assertEqual(self.solve(selector, 10), "bin2")
+        for _ in range(ExtractionModeSelector.COARSEN_AFTER - 1):
+            self.assertEqual(self.solve(selector, 40), "bin2")
+        self.assertEqual(self.solve(selector, 40), "bin4")
+        self.assertEqual(selector.brightest_k, 80)
+
+        # alternating results stay put
+        for matches in [None, 40] * 5:
+            self.assertEqual(self.solve(selector, matches), "bin4")
+        for _ in range(ExtractionModeSelector.REFINE_AFTER):
+            self.solve(selector, None)
+        self.assertEqual(selector.mode, "bin2")
+        self.assertIsNone(selector.brightest_k)
+
+    def test_stale_mode(self):
+        selector = ExtractionModeSelector()
+        for _ in range(ExtractionModeSelector.REFINE_AFTER):
+            selector.record_solve("bin4", {"RA": None})
+        self.assertEqual(selector.mode, "bin2")
+
+
+class TestFrameChangeDetector(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.image = rng.integers(20, 200, (512, 512), dtype=np.uint8)
+        self.detector = FrameChangeDetector()
+        self.imu_pos = [10.0, 20.0, 30.0]
+        self.detector.set_reference(
+            FrameChangeDetector.thumbnail(self.image), self.imu_pos, 100.0
+        )
+
+    def unchanged(self, image, imu_pos=None, now=101.0):
+        metadata = {"imu": {"pos": imu_pos or self.imu_pos}}
+        return self.detector.unchanged(
+            FrameChangeDetector.thumbnail(image), metadata, now
+        )
+
+    def test_unchanged(self):
+        self.assertTrue(self.unchanged(self.image))
+        # sensor noise averages out in the thumbnail
+        noise = np.random.default_rng(2).integers(-5, 6, self.image.shape)
+        self.assertTrue(self.unchanged((self.image + noise).astype(np.uint8)))
+        # no IMU data falls back on the image alone
+        metadata = {"imu": None}
+        thumbnail = FrameChangeDetector.thumbnail(self.image)
+        self.assertTrue(self.detector.unchanged(thumbnail, metadata, 101.0))
+
+    def test_changed(self):
+        self.assertFalse(self.unchanged(np.roll(self.image, 40, axis=1) // 2))
+        self.assertFalse(self.unchanged(self.image, imu_pos=[10.0, 20.0, 30.5]))
+        self.assertFalse(
+            self.unchanged(
+                self.image, now=100.0 + FrameChangeDetector.MAX_REUSE_SECONDS + 1
+            )
+        )
+        self.detector.clear()
+        self.assertFalse(self.unchanged(self.image))
+
+
+if __name__ == "__main__":
+    unittest.main()
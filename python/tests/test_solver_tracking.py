@@ -0,0 +1,97 @@
+import unittest
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+from PiFinder import solver_tracking
+
+SIZE = (512, 512)
+FOV = 10.2
+
+
+def project(rotation, stars):
+    vectors = solver_tracking.radec_to_vectors(stars[:, 0], stars[:, 1])
+    vectors = vectors @ rotation.T
+    pixels = solver_tracking.vectors_to_pixels(vectors, SIZE, FOV)
+    in_frame = (pixels > 0).all(axis=1) & (pixels < 512).all(axis=1)
+    return pixels, in_frame & (vectors[:, 0] > 0)
+
+
+class TestTracking(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.rotation = Rotation.from_euler(
+            "zyx", [-40, -20, 15], degrees=True
+        ).as_matrix()
+        boresight = self.rotation[0]
+        stars = []
+        for _ in range(60):
+            v = boresight + rng.normal(0, 0.07, 3)
+            stars.append(solver_tracking.vector_to_radec(v / np.linalg.norm(v)))
+        self.stars = np.array([s + (5.0,) for s in stars])
+        pixels, in_frame = project(self.rotation, self.stars)
+        ra, dec, roll = solver_tracking.rotation_to_radec_roll(self.rotation)
+        self.previous = {
+            "RA": ra,
+            "Dec": dec,
+            "Roll": roll,
+            "FOV": FOV,
+            "matched_stars": self.stars[in_frame][:20].tolist(),
+            "matched_centroids": pixels[in_frame][:20].tolist(),
+        }
+
+    def test_small_move(self):
+        moved = (
+            Rotation.from_euler("zyx", [0.4, -0.3, 0.2], degrees=True).as_matrix()
+            @ self.rotation
+        )
+        pixels, in_frame = project(moved, self.stars)
+        solution = solver_tracking.track(
+            self.previous, pixels[in_frame], SIZE, (256, 256), delta_deg=0.9
+        )
+        self.assertIsNotNone(solution)
+        ra, dec, roll = solver_tracking.rotation_to_radec_roll(moved)
+        self.assertAlmostEqual(solution["RA"], ra, places=3)
+        self.assertAlmostEqual(solution["Dec"], dec, places=3)
+        self.assertAlmostEqual(solution["Roll"], roll, places=3)
+        self.assertAlmostEqual(solution["RA_target"], ra, places=3)
+
+    def test_reference_does_not_shrink(self):
+        rng = np.random.default_rng(3)
+        reference = self.previous
+        rotation = self.rotation
+        for _ in range(6):
+            rotation = (
+                Rotation.from_euler("zyx", [0.1, -0.1, 0.1], degrees=True).as_matrix()
+                @ rotation
+            )
+            pixels, in_frame = project(rotation, self.stars)
+            # each frame misses a different few stars
+            seen = in_frame & (rng.uniform(size=len(in_frame)) > 0.3)
+            solution = solver_tracking.track(
+                reference, pixels[seen], SIZE, (256, 256), delta_deg=0.3
+            )
+            self.assertIsNotNone(solution)
+            self.assertLess(solution["Matches"], 20)
+            reference = solver_tracking.carry_reference(reference, solution, SIZE)
+            self.assertEqual(len(reference["matched_stars"]), 20)
+        ra, dec, roll = solver_tracking.rotation_to_radec_roll(rotation)
+        self.assertAlmostEqual(solution["RA"], ra, places=3)
+        self.assertAlmostEqual(solution["Dec"], dec, places=3)
+
+    def test_large_move_is_rejected(self):
+        pixels, in_frame = project(self.rotation, self.stars)
+        solution = solver_tracking.track(
+            self.previous, pixels[in_frame], SIZE, (256, 256), delta_deg=10
+        )
+        self.assertIsNone(solution)
+
+    def test_unrelated_frame(self):
+        rng = np.random.default_rng(2)
+        solution = solver_tracking.track(
+            self.previous, rng.uniform(0, 512, (30, 2)), SIZE, (256, 256), 0.5
+        )
+        self.assertIsNone(solution)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import datetime
+import pickle
+import threading
+import unittest
+
+from PiFinder.state_block import MAX_MATCHES, SharedStateBlock
+
+
+class FakeProxy:
+    def power_state(self):
+        return 1
+
+
+class TestSharedStateBlock(unittest.TestCase):
+    def setUp(self):
+        self.state = SharedStateBlock(FakeProxy())
+
+    def tearDown(self):
+        self.state.close()
+        self.state.unlink()
+
+    def test_empty(self):
+        self.assertIsNone(self.state.solution())
+        self.assertIsNone(self.state.imu())
+        self.assertIsNone(self.state.datetime())
+
+    def test_solution_roundtrip(self):
+        solution = {
+            "RA": 22.8,
+            "Dec": 15.3,
+            "Matches": 12,
+            "Alt": None,
+            "imu_pos": [171.3, 202.7, 358.2],
+            "solve_source": "CAM",
+            "matched_centroids": [[1.0, 2.0], [3.0, 4.0]],
+            "not_in_layout": "extra",
+        }
+        self.state.set_solution(solution)
+        result = self.state.solution()
+        for key, value in solution.items():
+            self.assertEqual(result[key], value)
+
+    def test_forwarded(self):
+        self.assertEqual(self.state.power_state(), 1)
+
+    def test_other_process_view(self):
+        reader = pickle.loads(pickle.dumps(self.state))
+        self.state.set_location({"lat": 59.0, "lon": 7.9, "timezone": "UTC"})
+        self.assertEqual(reader.location()["lat"], 59.0)
+        reader.close()
+
+    def test_wait_for_update(self):
+        self.assertFalse(self.state.wait_for_update(timeout=0.01))
+        self.state.set_imu({"moving": False, "pos": [1.0, 2.0, 3.0]})
+        self.assertTrue(self.state.wait_for_update(timeout=0.01))
+        # consumed
+        self.assertFalse(self.state.wait_for_update(timeout=0.01))
+        self.state.notify()
+        self.assertTrue(self.state.wait_for_update(timeout=0.01))
+
+    def test_concurrent_writers(self):
+        # solve quality is written by the extractor and the solve loop
+        def writer(offset):
+            for i in range(2000):
+                self.state.set_solve_quality(
+                    {"Matches": offset + i, "centroids": offset + i}
+                )
+
+        threads = [threading.Thread(target=writer, args=(o,)) for o in (0, 10000)]
+        for thread in threads:
+            thread.start()
+        torn = 0
+        while any(thread.is_alive() for thread in threads):
+            quality = self.state.solve_quality()
+            if quality is not None and quality["Matches"] != quality["centroids"]:
+                torn += 1
+        for thread in threads:
+            thread.join()
+        self.assertEqual(torn, 0)
+
+    def test_matches_cut_once(self):
+        matched = [[float(i), float(i)] for i in range(MAX_MATCHES + 10)]
+        with self.assertLogs(level="WARNING") as logs:
+            self.state.set_solution({"matched_centroids": matched})
+            self.state.set_solution({"matched_centroids": matched})
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(
+            self.state.solution()["matched_centroids"], matched[:MAX_MATCHES]
+        )
+
+    def test_datetime(self):
+        dt = datetime.datetime(2024, 1, 1, 12, 0, 0)
+        self.state.set_datetime(dt)
+        self.assertLess(
+            abs((self.state.datetime().replace(tzinfo=None) - dt).total_seconds()), 1
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()